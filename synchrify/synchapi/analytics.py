@@ -0,0 +1,100 @@
+import numpy as np
+
+
+MAX_RATING = 10
+BLOCK_COLUMNS = 2048
+
+
+def _shared_columns(members, users, content):
+	rows = np.searchsorted(members, users)
+	items, columns, counts = np.unique(content, return_inverse=True, return_counts=True)
+	shared = counts[columns] >= 2
+	kept, columns = np.unique(columns[shared], return_inverse=True)
+	return rows[shared], columns, len(kept), shared
+
+
+def rating_overlap(members, ratings, block_columns=BLOCK_COLUMNS):
+	# members: sorted user ids; ratings: (user, content, rating) rows, where
+	# rows of users outside members are ignored. Returns (shared, mean_abs_diff)
+	# as n x n matrices over every pair of distinct members; the diagonal is 0 / NaN.
+	members = np.asarray(members, dtype=np.int64)
+	n = len(members)
+
+	shared = np.zeros((n, n), dtype=np.float64)
+	diff = np.zeros((n, n), dtype=np.float64)
+
+	if ratings:
+		users, content, values = (np.asarray(column) for column in zip(*ratings))
+		known = np.isin(users, members)
+		rows, columns, width, mask = _shared_columns(members, users[known].astype(np.int64), content[known].astype(np.int64))
+		values = values[known].astype(np.float64)[mask]
+
+		# sum |a - b| = sum a + sum b - 2 sum min(a, b), and for integer ratings
+		# sum min(a, b) = sum over t = 1..MAX_RATING of [a >= t][b >= t], so every
+		# statistic is a dense matrix product. Columns are processed in blocks to
+		# bound memory at n x block_columns.
+		order = np.argsort(columns, kind='stable')
+		rows, columns, values = rows[order], columns[order], values[order]
+		bounds = np.searchsorted(columns, np.arange(0, width + block_columns, block_columns))
+
+		for start, end in zip(bounds[:-1], bounds[1:]):
+			if start == end:
+				continue
+			block_rows = rows[start:end]
+			block_columns_ = columns[start:end] - columns[start]
+			block_width = block_columns_[-1] + 1
+
+			rated = np.zeros((n, block_width), dtype=np.float32)
+			rated[block_rows, block_columns_] = 1.0
+			rating = np.zeros((n, block_width), dtype=np.float32)
+			rating[block_rows, block_columns_] = values[start:end]
+
+			shared += rated @ rated.T
+			cross = rating @ rated.T
+			diff += cross + cross.T
+			for threshold in range(1, MAX_RATING + 1):
+				at_least = (rating >= threshold).astype(np.float32)
+				diff -= 2.0 * (at_least @ at_least.T)
+
+	np.fill_diagonal(shared, 0)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		mean_diff = np.where(shared > 0, diff / shared, np.nan)
+
+	return shared.astype(np.int64), mean_diff
+
+
+def pack_ids(ids):
+	return np.unique(np.asarray(ids, dtype='<u4')).tobytes()
+
+
+def unpack_ids(blob):
+	return np.frombuffer(blob, dtype='<u4')
+
+
+def top_overlap(mine, others):
+	# mine: packed ids; others: (user, packed ids) rows. Every other array is
+	# probed against mine in a single searchsorted over their concatenation.
+	# Returns (user, shared ids, jaccard) sorted by jaccard, most similar first.
+	mine = unpack_ids(mine)
+	if not others:
+		return []
+
+	users = [user for user, _ in others]
+	arrays = [unpack_ids(items) for _, items in others]
+	lengths = np.fromiter((len(array) for array in arrays), dtype=np.int64, count=len(arrays))
+	flat = np.concatenate(arrays)
+	owners = np.repeat(np.arange(len(arrays)), lengths)
+
+	if len(mine):
+		positions = np.minimum(np.searchsorted(mine, flat), len(mine) - 1)
+		hit = mine[positions] == flat
+	else:
+		hit = np.zeros(len(flat), dtype=bool)
+
+	shared = np.bincount(owners[hit], minlength=len(arrays))
+	union = len(mine) + lengths - shared
+	jaccard = np.divide(shared, union, out=np.zeros(len(arrays)), where=union > 0)
+	common = np.split(flat[hit], np.cumsum(shared)[:-1])
+
+	order = np.lexsort((users, -jaccard))
+	return [(users[i], common[i].tolist(), float(jaccard[i])) for i in order]
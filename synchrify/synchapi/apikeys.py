@@ -1,15 +1,62 @@
 import base64
+import threading
 import time
 
 from django.conf import settings
 
-import requests
-import spotipy
+from . import db, metrics
 
-from . import db
 
+OAUTH_TOKEN_URL = settings.SPOTIFY_TOKEN_URL
+API_PREFIX = settings.SPOTIFY_API_URL
 
-OAUTH_TOKEN_URL = 'https://accounts.spotify.com/api/token'
+_app_token = {'access_token': None, 'expires_at': 0}
+_app_token_lock = threading.Lock()
+
+
+_relaying_spotify = None
+
+# Path segments kept verbatim in metric labels; anything else is an ID
+_SPOTIFY_PATH_WORDS = {
+	'me', 'top', 'tracks', 'artists', 'albums', 'playlists', 'player', 'currently-playing',
+	'recently-played', 'following', 'search', 'users', 'images', 'followers', 'contains', 'library', 'items',
+}
+
+
+def _spotify_endpoint(url):
+	path = url.split('?', 1)[0].split('/v1/', 1)[-1].strip('/')
+	return '/'.join(segment if segment in _SPOTIFY_PATH_WORDS else '{id}' for segment in path.split('/'))
+
+
+def _record_response(response):
+	labels = (('endpoint', _spotify_endpoint(response.request.url)),)
+	metrics.observe('synchapi_spotify_request_seconds', labels, response.elapsed.total_seconds())
+	metrics.inc('synchapi_spotify_responses_total', labels + (('status', str(response.status_code)),))
+
+
+def _relaying_spotify_class():
+	# spotipy (and requests under it) is imported on first use, not at boot
+	global _relaying_spotify
+	if _relaying_spotify is None:
+		import spotipy
+
+		class RelayingSpotify(spotipy.Spotify):
+			# Keeps the raw body of the last API response so passthrough views can
+			# relay Spotify's bytes instead of re-encoding the parsed result.
+			def __init__(self, *args, **kwargs):
+				super().__init__(*args, **kwargs)
+				self.last_response = None
+				self._session.hooks['response'].append(self._remember_response)
+
+			def _remember_response(self, response, *args, **kwargs):
+				self.last_response = response
+				_record_response(response)
+
+			def last_body(self):
+				return self.last_response.content if self.last_response is not None else b''
+
+		_relaying_spotify = RelayingSpotify
+	return _relaying_spotify
 
 
 class SpotifyUserAuth:
@@ -48,9 +95,11 @@ class SpotifyUserAuth:
 		return self.access_token
 
 	def client(self, user, requests_timeout=None):
-		return spotipy.Spotify(
+		client = _relaying_spotify_class()(
 			auth=self._get_access_token(user, requests_timeout)
 		)
+		client.prefix = API_PREFIX
+		return client
 
 
 def _auth_headers():
@@ -61,12 +110,14 @@ def _auth_headers():
 
 
 def _api_error(response):
+	from spotipy import SpotifyException
+
 	try:
 		msg = response.json()['error']['message']
 	except (ValueError, KeyError, TypeError):
 		msg = 'unknown error'
 
-	return spotipy.SpotifyException(
+	return SpotifyException(
 		response.status_code,
 		-1,
 		response.url + ':\n ' + msg,
@@ -75,6 +126,8 @@ def _api_error(response):
 
 
 def complete_auth(code, user, requests_timeout=None):
+	import requests
+
 	payload = {
 		'grant_type': 'authorization_code',
 		'code': code,
@@ -87,6 +140,7 @@ def complete_auth(code, user, requests_timeout=None):
 		headers=_auth_headers(),
 		timeout=requests_timeout,
 	)
+	metrics.inc('synchapi_spotify_token_refreshes_total', (('grant', payload['grant_type']),))
 
 	if response.status_code != 200:
 		raise _api_error(response)
@@ -98,7 +152,42 @@ def complete_auth(code, user, requests_timeout=None):
 	)
 
 
+def _app_access_token(requests_timeout=None):
+	import requests
+
+	with _app_token_lock:
+		if _app_token['expires_at'] - int(time.time()) < 60:
+			response = requests.post(
+				OAUTH_TOKEN_URL,
+				data={'grant_type': 'client_credentials'},
+				headers=_auth_headers(),
+				timeout=requests_timeout,
+			)
+			metrics.inc('synchapi_spotify_token_refreshes_total', (('grant', 'client_credentials'),))
+
+			if response.status_code != 200:
+				raise _api_error(response)
+
+			token_response = response.json()
+			_app_token['access_token'] = token_response['access_token']
+			_app_token['expires_at'] = int(time.time()) + token_response['expires_in']
+
+		return _app_token['access_token']
+
+
+def app_client(requests_timeout=None):
+	# Client credentials client for catalogue lookups not made on behalf of a user
+	client = _relaying_spotify_class()(
+		auth=_app_access_token(requests_timeout),
+		requests_timeout=requests_timeout
+	)
+	client.prefix = API_PREFIX
+	return client
+
+
 def _refresh_auth(auth, user, requests_timeout=None):
+	import requests
+
 	payload = {
 		'grant_type': 'refresh_token',
 		'refresh_token': auth.refresh_token,
@@ -110,6 +199,7 @@ def _refresh_auth(auth, user, requests_timeout=None):
 		headers=_auth_headers(),
 		timeout=requests_timeout,
 	)
+	metrics.inc('synchapi_spotify_token_refreshes_total', (('grant', payload['grant_type']),))
 
 	if response.status_code != 200:
 		raise _api_error(response)
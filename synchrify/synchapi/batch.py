@@ -0,0 +1,156 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import HttpRequest, QueryDict
+from django.urls import NoReverseMatch, Resolver404, resolve, reverse
+
+from .middleware import RateLimitMiddleware
+from .responses import dumps
+
+
+logger = logging.getLogger(__name__)
+
+# Sub-requests to these routes wait on Spotify, so they run on worker threads
+CONCURRENT_ROUTES = {'spotify-wrapper', 'content-get-by-uri'}
+SPOTIFY_ROUTES = CONCURRENT_ROUTES | {'blend-create'}
+EXCLUDED_ROUTES = {'batch', 'login', 'logout', 'register', 'spotify-auth', 'spotify-auth-callback'}
+FORWARDED_META = ('REMOTE_ADDR', 'HTTP_USER_AGENT', 'HTTP_HOST', 'SERVER_NAME', 'SERVER_PORT')
+
+_rate_limiter = None
+
+
+class BatchError(ValueError):
+	pass
+
+
+def _sub_request(request, item, spotify_auth):
+	route = item.get('route')
+	if not isinstance(route, str) or route in EXCLUDED_ROUTES:
+		raise BatchError('Invalid route %r' % route)
+
+	method = item.get('method', 'GET')
+	if method not in ('GET', 'POST'):
+		raise BatchError('Invalid method %r' % method)
+
+	try:
+		path = reverse('synchapi:' + route, args=item.get('args') or [])
+		match = resolve(path)
+	except (NoReverseMatch, Resolver404, TypeError):
+		raise BatchError('Invalid arguments for route %r' % route)
+
+	sub = HttpRequest()
+	sub.method = method
+	sub.path = sub.path_info = path
+	sub.META = {key: request.META[key] for key in FORWARDED_META if key in request.META}
+	sub.COOKIES = request.COOKIES
+	sub.session = request.session
+	if route in SPOTIFY_ROUTES:
+		sub.spotify_auth = spotify_auth
+	sub.resolver_match = match
+
+	params = item.get('params') or {}
+	if not isinstance(params, dict):
+		raise BatchError('Invalid params for route %r' % route)
+
+	sub.GET = QueryDict(mutable=True)
+	for key, value in params.items():
+		sub.GET[key] = str(value)
+
+	if method == 'POST':
+		sub._body = dumps(item.get('body') or {})
+	return route, sub
+
+
+def _limiter():
+	global _rate_limiter
+	if _rate_limiter is None:
+		try:
+			enabled = 'synchapi.middleware.RateLimitMiddleware' in settings.MIDDLEWARE
+			_rate_limiter = RateLimitMiddleware(None) if enabled else False
+		except MiddlewareNotUsed:
+			_rate_limiter = False
+	return _rate_limiter
+
+
+def _run(sub):
+	# A failing sub-request becomes a 500 item instead of failing the batch
+	match = sub.resolver_match
+	try:
+		# Sub-requests skip the middleware stack, so their own routes' limits are applied here
+		limiter = _limiter()
+		limited = limiter and limiter.process_view(sub, match.func, match.args, match.kwargs)
+		if limited:
+			return limited
+		return match.func(sub, *match.args, **match.kwargs)
+	except Exception:
+		logger.exception('Batch sub-request to %s failed', sub.path)
+		return None
+
+
+def _run_threaded(sub):
+	try:
+		return _run(sub)
+	finally:
+		connection.close()
+
+
+def _encode(response):
+	if response is None:
+		return b'{"status":500,"body":{"error":"Internal server error"}}'
+	if response.get('Content-Type', '').startswith('application/json') and response.content:
+		body = response.content
+	else:
+		body = dumps(response.content.decode('utf-8', 'replace'))
+	return b'{"status":%d,"body":%s}' % (response.status_code, body)
+
+
+def execute(request, items, spotify_auth):
+	# Database sub-requests run in order on this thread's connection while the
+	# Spotify ones run concurrently; bodies are spliced in without re-encoding.
+	subs = []
+	for item in items:
+		try:
+			subs.append(_sub_request(request, item, spotify_auth))
+		except BatchError as e:
+			subs.append((None, str(e)))
+
+	results = [None] * len(subs)
+	threaded = [index for index, (route, sub) in enumerate(subs) if route in CONCURRENT_ROUTES]
+	with ThreadPoolExecutor(max(1, min(len(threaded), settings.BATCH_WORKERS))) as pool:
+		futures = {index: pool.submit(_run_threaded, subs[index][1]) for index in threaded}
+
+		for index, (route, sub) in enumerate(subs):
+			if route is None:
+				results[index] = b'{"status":400,"body":%s}' % dumps(sub)
+			elif index not in futures:
+				results[index] = _encode(_run(sub))
+
+		for index, future in futures.items():
+			results[index] = _encode(future.result())
+
+	return b'{"responses":[' + b','.join(results) + b']}'
+
+
+def _sub_cost(request, item):
+	try:
+		_, sub = _sub_request(request, item, None)
+	except (BatchError, AttributeError):
+		return 1
+	match = sub.resolver_match
+	cost = getattr(match.func, 'rate_limit_cost', None)
+	return cost(sub, **match.kwargs) if cost else 1
+
+
+def cost(request, **kwargs):
+	# Charged against RATE_LIMITS['batch']: what every sub-request would cost on its own
+	try:
+		items = json.loads(request.body).get('requests')
+	except (ValueError, AttributeError):
+		return 1
+	if not isinstance(items, list):
+		return 1
+	return max(1, sum(_sub_cost(request, item) for item in items))
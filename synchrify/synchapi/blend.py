@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+import numpy as np
+
+from . import db
+
+
+TOP_TRACKS_LIMIT = 50
+SAVED_TRACKS_LIMIT = 50
+PLAYLIST_ADD_CHUNK = 100
+
+RATING_WEIGHT = 1.0
+TOP_WEIGHT = 0.7
+SAVED_WEIGHT = 0.4
+
+
+def _fetch_library(member, auth):
+	try:
+		client = auth.client(member)
+		top = client.current_user_top_tracks(TOP_TRACKS_LIMIT, 0, 'medium_term')
+		saved = client.current_user_saved_tracks(SAVED_TRACKS_LIMIT, 0)
+		return (
+			[item['id'] for item in top.get('items', []) if item and item.get('id')],
+			[item['track']['id'] for item in saved.get('items', []) if item.get('track') and item['track'].get('id')],
+		)
+	finally:
+		connection.close()
+
+
+def score_tracks(members, ratings, libraries):
+	# ratings: (user, track uri, rating) rows; libraries: {member: (top ids, saved ids)}.
+	# Builds members x tracks signal matrices and ranks tracks by the weighted
+	# group score, boosted by how many members contributed a signal.
+	index = {member: row for row, member in enumerate(members)}
+	tracks = sorted(
+		{uri for _, uri, _ in ratings} |
+		{uri for top, saved in libraries.values() for uri in top + saved}
+	)
+	if not tracks:
+		return []
+	column = {uri: n for n, uri in enumerate(tracks)}
+	shape = (len(members), len(tracks))
+
+	rated = np.zeros(shape, dtype=np.float32)
+	rating_signal = np.zeros(shape, dtype=np.float32)
+	if ratings:
+		users, uris, values = zip(*ratings)
+		rows = np.fromiter((index[user] for user in users), dtype=np.intp, count=len(users))
+		columns = np.fromiter((column[uri] for uri in uris), dtype=np.intp, count=len(uris))
+		rated[rows, columns] = 1.0
+		rating_signal[rows, columns] = (np.asarray(values, dtype=np.float32) - 5.0) / 5.0
+
+	top_signal = np.zeros(shape, dtype=np.float32)
+	saved_signal = np.zeros(shape, dtype=np.float32)
+	for member, (top, saved) in libraries.items():
+		row = index[member]
+		if top:
+			top_signal[row, [column[uri] for uri in top]] = 1.0 - np.arange(len(top), dtype=np.float32) / len(top)
+		if saved:
+			saved_signal[row, [column[uri] for uri in saved]] = 1.0
+
+	per_member = RATING_WEIGHT * rating_signal + TOP_WEIGHT * top_signal + SAVED_WEIGHT * saved_signal
+	coverage = ((rated + top_signal + saved_signal) > 0).sum(axis=0)
+	scores = per_member.sum(axis=0) * (1.0 + coverage / len(members))
+
+	order = np.lexsort((np.arange(len(tracks)), -scores))
+	return [(tracks[n], float(scores[n])) for n in order if scores[n] > 0]
+
+
+def build_blend(job, user, members, name, size):
+	auths = {member: db.get_spotify_auth(member) for member in members}
+	auths = {member: auth for member, auth in auths.items() if auth}
+	owner_auth = auths.get(user)
+	if not owner_auth or not owner_auth.username:
+		raise ValueError('You must be authenticated with Spotify to create a blend')
+
+	steps = len(auths) + 2
+	done = 0
+	job.progress(done, steps, 'Fetching libraries')
+
+	libraries = {}
+	with ThreadPoolExecutor(settings.BLEND_FETCH_WORKERS) as pool:
+		futures = {pool.submit(_fetch_library, member, auth): member for member, auth in auths.items()}
+		for future, member in futures.items():
+			try:
+				libraries[member] = future.result()
+			except Exception:
+				libraries[member] = ([], [])
+			done += 1
+			job.progress(done, steps, 'Fetching libraries')
+
+	ranked = score_tracks(members, db.get_members_track_ratings(members), libraries)[:size]
+	done += 1
+	job.progress(done, steps, 'Creating playlist')
+
+	client = owner_auth.client(user)
+	playlist = client.user_playlist_create(owner_auth.username, name, description='Synchrify blend')
+	uris = [uri for uri, _ in ranked]
+	chunks = range(0, len(uris), PLAYLIST_ADD_CHUNK)
+	steps += len(chunks)
+	for start in chunks:
+		client.user_playlist_add_tracks(owner_auth.username, playlist['id'], uris[start:start + PLAYLIST_ADD_CHUNK])
+		done += 1
+		job.progress(done, steps, 'Adding tracks')
+
+	done += 1
+	job.progress(done, steps, 'Done')
+	return {'playlist_id': playlist['id'], 'tracks': len(uris)}
@@ -0,0 +1,47 @@
+import time
+
+from django.core.cache import cache
+
+
+POLL_INTERVAL = 0.25
+# Concurrent notifies are last-writer-wins, so a lower version can overwrite a
+# higher one; waiters re-read the real version this often to get past that
+RECHECK_INTERVAL = 5.0
+
+
+def _key(user):
+	return 'synchapi:changes:%d' % user
+
+
+def notify(users, version):
+	cache.set_many({_key(user): version for user in users}, None)
+
+
+def wait(user, version, timeout, load_version):
+	# Sleeps until the user's cached change version passes `version`, so an idle
+	# long-poll costs one cache read per tick and no SQL at all.
+	deadline = time.monotonic() + timeout
+	key = _key(user)
+
+	latest = cache.get(key)
+	if latest is None:
+		latest = load_version() or 0
+		cache.add(key, latest, None)
+
+	recheck_at = time.monotonic() + RECHECK_INTERVAL
+	while latest <= version:
+		now = time.monotonic()
+		remaining = deadline - now
+		if remaining <= 0:
+			return False
+		if now >= recheck_at:
+			recheck_at = now + RECHECK_INTERVAL
+			loaded = load_version() or 0
+			if loaded > latest:
+				cache.set(key, loaded, None)
+				latest = loaded
+				continue
+		time.sleep(min(POLL_INTERVAL, remaining))
+		latest = cache.get(key, 0)
+
+	return True
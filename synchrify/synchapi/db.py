@@ -1,23 +1,56 @@
+import time
+
+from django.conf import settings
 from django.db import connection
 
+from . import changes, metrics, ratingbuffer, versions
 from .apikeys import SpotifyUserAuth
 
 
+_query_labels = {}
+
+
+def _observe(query, start):
+	# Labels each query with the name of its _xxx_sql constant
+	labels = _query_labels.get(query)
+	if labels is None:
+		name = next((name for name, value in globals().items() if value is query), 'other')
+		labels = _query_labels[query] = (('query', name),)
+	metrics.observe('synchapi_db_query_seconds', labels, time.perf_counter() - start)
+
+
 def _execute(query, values=None):
+	start = time.perf_counter()
 	with connection.cursor() as cursor:
 		cursor.execute(query, values)
+	_observe(query, start)
+
+
+def _executemany(query, values):
+	start = time.perf_counter()
+	with connection.cursor() as cursor:
+		cursor.executemany(query, values)
+		last = cursor.lastrowid + len(values) - 1
+	_observe(query, start)
+	return last
 
 
 def _fetchone(query, values=None):
+	start = time.perf_counter()
 	with connection.cursor() as cursor:
 		cursor.execute(query, values)
-		return cursor.fetchone()
+		row = cursor.fetchone()
+	_observe(query, start)
+	return row
 
 
 def _fetchall(query, values=None):
+	start = time.perf_counter()
 	with connection.cursor() as cursor:
 		cursor.execute(query, values)
-		return cursor.fetchall()
+		rows = cursor.fetchall()
+	_observe(query, start)
+	return rows
 
 
 # User queries
@@ -42,6 +75,11 @@ _user_by_email_sql = """
 	WHERE email = %s
 """
 
+_set_password_sql = """
+	UPDATE synchrify_users SET password = %s
+	WHERE id = %s
+"""
+
 _email_by_id_sql = """
 	SELECT email FROM synchrify_users
 	WHERE id = %s
@@ -55,6 +93,13 @@ def insert_user(email, password):
 	)
 
 
+def set_password(user, password):
+	_execute(
+		_set_password_sql,
+		(password, user)
+	)
+
+
 def activate_user(user):
 	_execute(
 		_activate_user_sql,
@@ -177,6 +222,13 @@ _friends_of_friends_sql = """
 	)
 """
 
+_friends_mutual_edges_sql = """
+	SELECT f.friender, f.friendee FROM synchrify_friends f
+	INNER JOIN synchrify_friends b
+	ON b.friender = f.friendee AND b.friendee = f.friender
+	ORDER BY f.friender, f.friendee
+"""
+
 _friends_check_sql = """
 	SELECT IF(COUNT(*), TRUE, FALSE) FROM synchrify_friends f
 	WHERE friender = %s AND friendee = %s AND (
@@ -191,13 +243,44 @@ def insert_friend(user, friend):
 		_insert_friend_sql,
 		(user, friend)
 	)
+	if check_friends(user, friend):
+		copy_timeline(user, friend)
+		copy_timeline(friend, user)
+		record_changes([
+			(user, 'friends', 'set', friend),
+			(friend, 'friends', 'set', user),
+			(friend, 'pending', 'delete', user),
+		])
+	else:
+		record_changes([
+			(user, 'pending', 'set', friend),
+		])
+	_bump_friend_versions(user, friend)
 
 
 def delete_friend(user, friend):
+	were_friends = check_friends(user, friend)
 	_execute(
 		_delete_friend_sql,
 		(user, friend)
 	)
+	if were_friends:
+		delete_timeline(user, friend)
+		record_changes([
+			(user, 'friends', 'delete', friend),
+			(friend, 'friends', 'delete', user),
+			(friend, 'pending', 'set', user),
+		])
+	else:
+		record_changes([
+			(user, 'pending', 'delete', friend),
+		])
+	_bump_friend_versions(user, friend)
+
+
+def _bump_friend_versions(user, friend):
+	# Friends-of-friends of everyone adjacent to the edge change too
+	versions.bump('friends', {user, friend, *get_friends_list(user), *get_friends_list(friend)})
 
 
 def get_friends_pending(user):
@@ -221,6 +304,10 @@ def get_friends_of_friends(user):
 	)]
 
 
+def get_mutual_friend_edges():
+	return _fetchall(_friends_mutual_edges_sql)
+
+
 def check_friends(user, friend):
 	row = _fetchone(
 		_friends_check_sql,
@@ -229,6 +316,52 @@ def check_friends(user, friend):
 	return None if not row else row[0] == 1
 
 
+# Privacy queries
+
+_privacy_sql = """
+	SELECT friends, ratings FROM synchrify_privacy
+	WHERE user = %s
+"""
+
+_privacy_many_sql = """
+	SELECT user, friends, ratings FROM synchrify_privacy
+	WHERE user IN %s
+"""
+
+_set_privacy_sql = """
+	INSERT INTO synchrify_privacy (user, friends, ratings)
+	VALUES (%(user)s, %(friends)s, %(ratings)s)
+	ON DUPLICATE KEY UPDATE
+		friends = %(friends)s,
+		ratings = %(ratings)s
+"""
+
+
+def get_privacy(user):
+	return _fetchone(
+		_privacy_sql,
+		(user,)
+	)
+
+
+def get_privacy_many(users):
+	return {user: (friends, ratings) for user, friends, ratings in _fetchall(
+		_privacy_many_sql,
+		(tuple(users),)
+	)}
+
+
+def set_privacy(user, friends, ratings):
+	_execute(
+		_set_privacy_sql,
+		{
+			'user': user,
+			'friends': friends,
+			'ratings': ratings,
+		}
+	)
+
+
 # Spotify Auth queries
 
 _insert_spotify_auth_sql = """
@@ -290,10 +423,12 @@ def get_spotify_auth(user, requests_timeout=None):
 # Content queries
 
 _insert_content_sql = """
-	INSERT INTO synchrify_spotify_content (type, uri, name)
-	VALUES (%(type)s, %(uri)s, %(name)s)
+	INSERT INTO synchrify_spotify_content (type, uri, name, fetched_at)
+	VALUES (%(type)s, %(uri)s, %(name)s, %(fetched_at)s)
 	ON DUPLICATE KEY UPDATE
-		name = %(name)s
+		id = LAST_INSERT_ID(id),
+		name = %(name)s,
+		fetched_at = %(fetched_at)s
 """
 
 _content_exists_sql = """
@@ -301,26 +436,102 @@ _content_exists_sql = """
 	WHERE id = %s
 """
 
-_content_by_id = """
+_content_by_id_sql = """
 	SELECT type, uri, name FROM synchrify_spotify_content
 	WHERE id = %s
 """
 
-_content_by_uri = """
+_content_by_uri_sql = """
 	SELECT id, name FROM synchrify_spotify_content
 	WHERE type = %s AND uri = %s
 """
 
 
+_content_search_fulltext_sql = """
+	SELECT id, type, uri, name, MATCH (name) AGAINST (%(terms)s IN BOOLEAN MODE) AS relevance
+	FROM synchrify_spotify_content
+	WHERE MATCH (name) AGAINST (%(terms)s IN BOOLEAN MODE)
+	AND (%(type)s IS NULL OR type = %(type)s)
+	ORDER BY relevance DESC
+	LIMIT %(limit)s
+"""
+
+# 1e0 is a DOUBLE like MATCH's relevance; a plain 1.0 is a DECIMAL
+_content_search_prefix_sql = """
+	SELECT id, type, uri, name, 1e0 FROM synchrify_spotify_content
+	WHERE name LIKE %(prefix)s
+	AND (%(type)s IS NULL OR type = %(type)s)
+	ORDER BY name
+	LIMIT %(limit)s
+"""
+
+_content_friend_ratings_sql = """
+	SELECT content, COUNT(*) FROM synchrify_ratings
+	WHERE content IN %s AND user IN %s
+	GROUP BY content
+"""
+
+
+_content_stale_sql = """
+	SELECT id, type, uri, name, fetched_at FROM synchrify_spotify_content
+	WHERE fetched_at < %(cutoff)s
+	AND (fetched_at, id) > (%(fetched_at)s, %(id)s)
+	ORDER BY fetched_at, id
+	LIMIT %(limit)s
+"""
+
+# MySQLdb folds executemany() of a single-row INSERT into one multi-row statement
+_content_refresh_sql = """
+	INSERT INTO synchrify_spotify_content (id, type, uri, name, fetched_at)
+	VALUES (%s, %s, %s, %s, %s)
+	ON DUPLICATE KEY UPDATE
+		name = VALUES(name),
+		fetched_at = VALUES(fetched_at)
+"""
+
+_content_touch_sql = """
+	UPDATE synchrify_spotify_content SET fetched_at = %s
+	WHERE id IN %s
+"""
+
+_content_by_ids_sql = """
+	SELECT id, type, uri, name FROM synchrify_spotify_content
+	WHERE id IN %s
+"""
+
+_content_ids_by_uri_sql = """
+	SELECT uri, id FROM synchrify_spotify_content
+	WHERE type = %s AND uri IN %s
+"""
+
+# Existing rows keep their name; the refresh job owns keeping names current
+_content_intern_sql = """
+	INSERT INTO synchrify_spotify_content (type, uri, name, fetched_at)
+	VALUES (%s, %s, %s, %s)
+	ON DUPLICATE KEY UPDATE
+		id = id
+"""
+
+
 def insert_content(content_type, uri, name):
-	_execute(
-		_insert_content_sql,
-		{
-			'type': content_type,
-			'uri': uri,
-			'name': name,
-		}
-	)
+	start = time.perf_counter()
+	with connection.cursor() as cursor:
+		cursor.execute(
+			_insert_content_sql,
+			{
+				'type': content_type,
+				'uri': uri,
+				'name': name,
+				'fetched_at': int(time.time()),
+			}
+		)
+		content, affected = cursor.lastrowid, cursor.rowcount
+	_observe(_insert_content_sql, start)
+
+	# MySQL reports 2 affected rows when an existing row's name changed
+	if affected == 2:
+		versions.bump('content', [content, 'names'])
+	return content
 
 
 def check_content_exists(content):
@@ -331,16 +542,104 @@ def check_content_exists(content):
 	return None if not row else row[0] == 1
 
 
+def search_content_fulltext(terms, content_type, limit):
+	return _fetchall(
+		_content_search_fulltext_sql,
+		{
+			'terms': terms,
+			'type': content_type,
+			'limit': limit,
+		}
+	)
+
+
+def search_content_prefix(prefix, content_type, limit):
+	escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+	return _fetchall(
+		_content_search_prefix_sql,
+		{
+			'prefix': escaped + '%',
+			'type': content_type,
+			'limit': limit,
+		}
+	)
+
+
+def count_friend_ratings(contents, friends):
+	return dict(_fetchall(
+		_content_friend_ratings_sql,
+		(tuple(contents), tuple(friends))
+	))
+
+
 def get_content_by_id(content):
 	return _fetchone(
-		_content_by_id,
+		_content_by_id_sql,
 		(content,)
 	)
 
 
+def get_stale_content(cutoff, after, limit):
+	fetched_at, content = after
+	return _fetchall(
+		_content_stale_sql,
+		{
+			'cutoff': cutoff,
+			'fetched_at': fetched_at,
+			'id': content,
+			'limit': limit,
+		}
+	)
+
+
+def refresh_content(changed, unchanged, fetched_at):
+	if changed:
+		_executemany(
+			_content_refresh_sql,
+			[(content, content_type, uri, name, fetched_at) for content, content_type, uri, name in changed]
+		)
+		versions.bump('content', [row[0] for row in changed] + ['names'])
+	if unchanged:
+		_execute(
+			_content_touch_sql,
+			(fetched_at, tuple(unchanged))
+		)
+
+
+def intern_content(content_type, names):
+	# Maps each uri in names ({uri: name}) to its content id, inserting missing rows
+	if not names:
+		return {}
+	ids = dict(_fetchall(
+		_content_ids_by_uri_sql,
+		(content_type, tuple(names))
+	))
+	missing = [uri for uri in names if uri not in ids]
+	if missing:
+		fetched_at = int(time.time())
+		_executemany(
+			_content_intern_sql,
+			[(content_type, uri, (names[uri] or '')[:100], fetched_at) for uri in missing]
+		)
+		ids.update(_fetchall(
+			_content_ids_by_uri_sql,
+			(content_type, tuple(missing))
+		))
+	return ids
+
+
+def get_content_by_ids(contents):
+	if not contents:
+		return {}
+	return {row[0]: row for row in _fetchall(
+		_content_by_ids_sql,
+		(tuple(contents),)
+	)}
+
+
 def get_content_by_uri(content_type, uri):
 	return _fetchone(
-		_content_by_uri,
+		_content_by_uri_sql,
 		(content_type, uri)
 	)
 
@@ -348,10 +647,11 @@ def get_content_by_uri(content_type, uri):
 # Rating queries
 
 _insert_rating_sql = """
-	INSERT INTO synchrify_ratings (user, content, rating)
-	VALUES (%(user)s, %(content)s, %(rating)s)
+	INSERT INTO synchrify_ratings (user, content, rating, rated_at)
+	VALUES (%(user)s, %(content)s, %(rating)s, %(rated_at)s)
 	ON DUPLICATE KEY UPDATE
-		rating = %(rating)s
+		rating = %(rating)s,
+		rated_at = %(rated_at)s
 """
 
 _delete_rating_sql = """
@@ -364,6 +664,65 @@ _content_rating_sql = """
 	WHERE user = %s AND content = %s
 """
 
+_ratings_rated_at_sql = """
+	SELECT user, content, rated_at FROM synchrify_ratings
+	WHERE (user, content) IN %s
+"""
+
+# A deleted rating leaves no row, so its change feed entry stands in as the tombstone
+_ratings_deleted_at_sql = """
+	SELECT user, content, MAX(changed_at) FROM synchrify_changes
+	WHERE user IN %(users)s AND kind = 'ratings' AND op = 'delete' AND content IN %(contents)s
+	GROUP BY user, content
+"""
+
+# Batched forms of the statements insert_rating and delete_rating run, for
+# write_ratings. An upsert never replaces a rating with an older one.
+_ratings_upsert_sql = """
+	INSERT INTO synchrify_ratings (user, content, rating, rated_at)
+	VALUES (%s, %s, %s, %s)
+	ON DUPLICATE KEY UPDATE
+		rating = IF(VALUES(rated_at) >= rated_at, VALUES(rating), rating),
+		rated_at = GREATEST(rated_at, VALUES(rated_at))
+"""
+
+_ratings_delete_many_sql = """
+	DELETE FROM synchrify_ratings
+	WHERE (user, content) IN %s
+"""
+
+_ratings_mutual_friends_sql = """
+	SELECT f.friender, f.friendee FROM synchrify_friends f
+	INNER JOIN synchrify_friends b
+	ON b.friender = f.friendee AND b.friendee = f.friender
+	WHERE f.friender IN %s
+"""
+
+_ratings_timeline_upsert_sql = """
+	INSERT INTO synchrify_timeline (owner, friend, content, rating, rated_at)
+	VALUES (%s, %s, %s, %s, %s)
+	ON DUPLICATE KEY UPDATE
+		rating = VALUES(rating),
+		rated_at = VALUES(rated_at)
+"""
+
+_ratings_timeline_retract_sql = """
+	DELETE FROM synchrify_timeline
+	WHERE (friend, content) IN %s
+"""
+
+_ratings_trending_retract_sql = """
+	DELETE FROM synchrify_trending
+	WHERE (user, content) IN %s
+"""
+
+_ratings_trending_upsert_sql = """
+	INSERT INTO synchrify_trending (user, span, bucket, content, score)
+	VALUES (%s, %s, %s, %s, %s)
+	ON DUPLICATE KEY UPDATE
+		score = VALUES(score)
+"""
+
 _ratings_list_sql = """
 	SELECT r.content, c.type, c.uri, c.name, r.rating FROM synchrify_ratings r
 	INNER JOIN synchrify_spotify_content c
@@ -385,14 +744,26 @@ _ratings_list_friends_sql = """
 """
 
 
-def insert_rating(user, content, rating):
+def insert_rating(user, content, rating, rated_at=None):
+	values = {
+		'user': user,
+		'content': content,
+		'rating': rating,
+		'rated_at': rated_at or int(time.time()),
+	}
 	_execute(
 		_insert_rating_sql,
-		{
-			'user': user,
-			'content': content,
-			'rating': rating,
-		}
+		values
+	)
+	_execute(
+		_timeline_fan_out_sql,
+		values
+	)
+	_update_trending(user, content, rating, values['rated_at'])
+	versions.bump('ratings', [user])
+	record_changes(
+		[(user, 'ratings', 'set', None, content, rating)] +
+		[(friend, 'friend_ratings', 'set', user, content, rating) for friend in get_friends_list(user)]
 	)
 
 
@@ -401,9 +772,77 @@ def delete_rating(user, content):
 		_delete_rating_sql,
 		(user, content)
 	)
+	_execute(
+		_timeline_retract_sql,
+		(user, content)
+	)
+	_update_trending(user, content, None, int(time.time()))
+	versions.bump('ratings', [user])
+	record_changes(
+		[(user, 'ratings', 'delete', None, content)] +
+		[(friend, 'friend_ratings', 'delete', user, content) for friend in get_friends_list(user)]
+	)
+
+
+def write_ratings(sets, deletes):
+	# insert_rating and delete_rating for a whole batch in a fixed number of
+	# statements: sets are (user, content, rating, rated_at), deletes (user, content)
+	users = sorted({row[0] for row in sets} | {row[0] for row in deletes})
+	if not users:
+		return
+
+	friends = {}
+	for user, friend in _fetchall(_ratings_mutual_friends_sql, (tuple(users),)):
+		friends.setdefault(user, []).append(friend)
+
+	# Expired buckets are left to `manage.py trending --expire`
+	_execute(
+		_ratings_trending_retract_sql,
+		(tuple([row[:2] for row in sets] + list(deletes)),)
+	)
+
+	if sets:
+		_executemany(_ratings_upsert_sql, sets)
+		timeline = [
+			(friend, user, content, rating, rated_at)
+			for user, content, rating, rated_at in sets
+			for friend in friends.get(user, ())
+		]
+		if timeline:
+			_executemany(_ratings_timeline_upsert_sql, timeline)
+		trending = [
+			(user, span, rated_at // span, content, rating - settings.TRENDING_MIN_RATING + 1)
+			for user, content, rating, rated_at in sets if rating >= settings.TRENDING_MIN_RATING
+			for span in (3600, 86400)
+		]
+		if trending:
+			_executemany(_ratings_trending_upsert_sql, trending)
+
+	if deletes:
+		_execute(
+			_ratings_delete_many_sql,
+			(tuple(deletes),)
+		)
+		_execute(
+			_ratings_timeline_retract_sql,
+			(tuple(deletes),)
+		)
+
+	versions.bump('ratings', users)
+	record_changes(
+		[(user, 'ratings', 'set', None, content, rating) for user, content, rating, _ in sets] +
+		[(friend, 'friend_ratings', 'set', user, content, rating)
+			for user, content, rating, _ in sets for friend in friends.get(user, ())] +
+		[(user, 'ratings', 'delete', None, content) for user, content in deletes] +
+		[(friend, 'friend_ratings', 'delete', user, content)
+			for user, content in deletes for friend in friends.get(user, ())]
+	)
 
 
 def get_rating(user, content):
+	pending = ratingbuffer.overlay(user)
+	if pending and content in pending:
+		return pending[content]
 	row = _fetchone(
 		_content_rating_sql,
 		(user, content)
@@ -411,19 +850,592 @@ def get_rating(user, content):
 	return None if not row else row[0]
 
 
-def get_ratings(user):
+def get_rated_at(keys):
+	# {(user, content): when it was last rated or reset}, for the given pairs;
+	# resets older than the change feed's retention are not known
+	if not keys:
+		return {}
+	wanted = set(keys)
+	latest = {}
+	for user, content, deleted_at in _fetchall(
+		_ratings_deleted_at_sql,
+		{'users': tuple({user for user, _ in wanted}), 'contents': tuple({content for _, content in wanted})}
+	):
+		if (user, content) in wanted:
+			latest[user, content] = deleted_at
+	for user, content, rated_at in _fetchall(
+		_ratings_rated_at_sql,
+		(tuple(keys),)
+	):
+		latest[user, content] = max(rated_at, latest.get((user, content), 0))
+	return latest
+
+
+_group_ratings_sql = """
+	SELECT user, content, rating FROM synchrify_ratings
+	WHERE user = %(user)s
+	UNION ALL
+	SELECT r.user, r.content, r.rating FROM synchrify_friends f
+	INNER JOIN synchrify_friends b
+	ON b.friender = f.friendee AND b.friendee = f.friender
+	INNER JOIN synchrify_ratings r
+	ON r.user = f.friendee
+	WHERE f.friender = %(user)s
+"""
+
+_members_track_ratings_sql = """
+	SELECT r.user, c.uri, r.rating FROM synchrify_ratings r
+	INNER JOIN synchrify_spotify_content c
+	ON r.content = c.id
+	WHERE r.user IN %s AND c.type = 'track'
+"""
+
+RATINGS_COLUMNS = ['content_id', 'type', 'uri', 'name', 'rating']
+FRIENDS_RATINGS_COLUMNS = ['friend_id', 'content_id', 'type', 'uri', 'name', 'rating']
+
+
+def _apply_rating_overlay(rows, pending):
+	# Buffered updates replace, add or (None) remove rows
+	rows = [row[:4] + (pending[row[0]],) if row[0] in pending else row
+		for row in rows if pending.get(row[0], True) is not None]
+	listed = {row[0] for row in rows}
+	content = get_content_by_ids([item for item, rating in pending.items() if rating is not None and item not in listed])
+	return rows + [content[item] + (pending[item],) for item in sorted(content)]
+
+
+def get_ratings(user, as_rows=False):
+	rows = _fetchall(
+		_ratings_list_sql,
+		(user,)
+	)
+	pending = ratingbuffer.overlay(user)
+	if pending:
+		rows = _apply_rating_overlay(rows, pending)
+	if as_rows:
+		return rows
 	return [{'content_id': content_id, 'type': content_type, 'uri': uri, 'name': name, 'rating': rating}
-		for content_id, content_type, uri, name, rating in _fetchall(
-			_ratings_list_sql,
-			(user,)
-		)
+		for content_id, content_type, uri, name, rating in rows
 	]
 
 
-def get_friends_ratings(user):
+def get_group_ratings(user):
+	return _fetchall(
+		_group_ratings_sql,
+		{'user': user}
+	)
+
+
+def get_members_track_ratings(members):
+	return _fetchall(
+		_members_track_ratings_sql,
+		(tuple(members),)
+	)
+
+
+def get_friends_ratings(user, as_rows=False):
+	rows = _fetchall(
+		_ratings_list_friends_sql,
+		(user,)
+	)
+	if as_rows:
+		return rows
 	return [{'friend_id': user, 'content_id': content_id, 'type': content_type, 'uri': uri, 'name': name, 'rating': rating}
-		for user, content_id, content_type, uri, name, rating in _fetchall(
-			_ratings_list_friends_sql,
-			(user,)
+		for user, content_id, content_type, uri, name, rating in rows
+	]
+
+
+# Timeline queries
+
+_timeline_fan_out_sql = """
+	INSERT INTO synchrify_timeline (owner, friend, content, rating, rated_at)
+	SELECT f.friendee, %(user)s, %(content)s, %(rating)s, %(rated_at)s FROM synchrify_friends f
+	INNER JOIN synchrify_friends b
+	ON b.friender = f.friendee AND b.friendee = f.friender
+	WHERE f.friender = %(user)s
+	ON DUPLICATE KEY UPDATE
+		rating = %(rating)s,
+		rated_at = %(rated_at)s
+"""
+
+_timeline_retract_sql = """
+	DELETE FROM synchrify_timeline
+	WHERE friend = %s AND content = %s
+"""
+
+_timeline_copy_sql = """
+	INSERT IGNORE INTO synchrify_timeline (owner, friend, content, rating, rated_at)
+	SELECT %(owner)s, user, content, rating, rated_at FROM synchrify_ratings
+	WHERE user = %(friend)s
+	ORDER BY rated_at DESC
+	LIMIT %(limit)s
+"""
+
+_timeline_delete_sql = """
+	DELETE FROM synchrify_timeline
+	WHERE (owner = %(user)s AND friend = %(friend)s)
+	OR (owner = %(friend)s AND friend = %(user)s)
+"""
+
+_timeline_page_sql = """
+	SELECT t.friend, t.content, c.type, c.uri, c.name, t.rating, t.rated_at FROM synchrify_timeline t
+	INNER JOIN synchrify_spotify_content c
+	ON t.content = c.id
+	WHERE t.owner = %(user)s AND t.rated_at > %(since)s
+	AND (t.rated_at, t.friend, t.content) < (%(rated_at)s, %(friend)s, %(content)s)
+	ORDER BY t.rated_at DESC, t.friend DESC, t.content DESC
+	LIMIT %(limit)s
+"""
+
+_timeline_overfull_sql = """
+	SELECT owner FROM synchrify_timeline
+	GROUP BY owner
+	HAVING COUNT(*) > %s
+"""
+
+_timeline_cutoff_sql = """
+	SELECT rated_at FROM synchrify_timeline
+	WHERE owner = %s
+	ORDER BY rated_at DESC
+	LIMIT 1 OFFSET %s
+"""
+
+_timeline_trim_sql = """
+	DELETE FROM synchrify_timeline
+	WHERE owner = %s AND rated_at <= %s
+"""
+
+_timeline_backfill_sql = """
+	INSERT IGNORE INTO synchrify_timeline (owner, friend, content, rating, rated_at)
+	SELECT f.friender, r.user, r.content, r.rating, r.rated_at FROM synchrify_friends f
+	INNER JOIN synchrify_friends b
+	ON b.friender = f.friendee AND b.friendee = f.friender
+	INNER JOIN synchrify_ratings r
+	ON r.user = f.friendee
+"""
+
+TIMELINE_START = (2 ** 31 - 1, 2 ** 31 - 1, 2 ** 31 - 1)
+TIMELINE_COLUMNS = ['friend_id', 'content_id', 'type', 'uri', 'name', 'rating', 'rated_at']
+
+
+def copy_timeline(owner, friend):
+	_execute(
+		_timeline_copy_sql,
+		{
+			'owner': owner,
+			'friend': friend,
+			'limit': settings.TIMELINE_LENGTH,
+		}
+	)
+
+
+def delete_timeline(user, friend):
+	_execute(
+		_timeline_delete_sql,
+		{
+			'user': user,
+			'friend': friend,
+		}
+	)
+
+
+def get_timeline(user, since=0, before=TIMELINE_START, limit=50, as_rows=False):
+	rated_at, friend, content = before
+	rows = _fetchall(
+		_timeline_page_sql,
+		{
+			'user': user,
+			'since': since,
+			'rated_at': rated_at,
+			'friend': friend,
+			'content': content,
+			'limit': limit,
+		}
+	)
+	if as_rows:
+		return rows
+	return [{'friend_id': friend, 'content_id': content_id, 'type': content_type, 'uri': uri, 'name': name,
+			'rating': rating, 'rated_at': rated_at}
+		for friend, content_id, content_type, uri, name, rating, rated_at in rows
+	]
+
+
+def trim_timelines(length):
+	trimmed = 0
+	for (owner,) in _fetchall(
+		_timeline_overfull_sql,
+		(length,)
+	):
+		row = _fetchone(
+			_timeline_cutoff_sql,
+			(owner, length)
+		)
+		if row:
+			_execute(
+				_timeline_trim_sql,
+				(owner, row[0])
+			)
+			trimmed += 1
+	return trimmed
+
+
+def backfill_timelines():
+	_execute(_timeline_backfill_sql)
+
+
+# Trending queries
+
+# Window -> (bucket span in seconds, buckets read). Hourly and daily rows are
+# both written for every high rating; each span keeps only the buckets its
+# longest window reads, see _trending_cutoffs.
+TRENDING_WINDOWS = {'24h': (3600, 24), '7d': (86400, 7), '30d': (86400, 30)}
+
+# Also drops the user's expired buckets, so storage stays bounded by recent activity
+_trending_retract_sql = """
+	DELETE FROM synchrify_trending
+	WHERE user = %(user)s AND (
+		content = %(content)s
+		OR (span = 3600 AND bucket < %(hours)s)
+		OR (span = 86400 AND bucket < %(days)s)
+	)
+"""
+
+_trending_insert_sql = """
+	INSERT INTO synchrify_trending (user, span, bucket, content, score)
+	VALUES
+		(%(user)s, 3600, %(hour)s, %(content)s, %(score)s),
+		(%(user)s, 86400, %(day)s, %(content)s, %(score)s)
+	ON DUPLICATE KEY UPDATE
+		score = VALUES(score)
+"""
+
+_trending_rows_sql = """
+	SELECT user, bucket, content, score FROM synchrify_trending
+	WHERE user IN %(users)s AND span = %(span)s AND bucket >= %(since)s
+	ORDER BY user, bucket, content
+"""
+
+_trending_expire_sql = """
+	DELETE FROM synchrify_trending
+	WHERE (span = 3600 AND bucket < %(hours)s)
+	OR (span = 86400 AND bucket < %(days)s)
+"""
+
+_trending_backfill_sql = """
+	INSERT IGNORE INTO synchrify_trending (user, span, bucket, content, score)
+	SELECT user, 3600, rated_at DIV 3600, content, rating - %(min_rating)s + 1 FROM synchrify_ratings
+	WHERE rating >= %(min_rating)s AND rated_at >= %(hours)s * 3600
+	UNION ALL
+	SELECT user, 86400, rated_at DIV 86400, content, rating - %(min_rating)s + 1 FROM synchrify_ratings
+	WHERE rating >= %(min_rating)s AND rated_at >= %(days)s * 86400
+"""
+
+
+def _trending_cutoffs(now):
+	# Oldest bucket of each span that the longest window using it still reads
+	return {'hours': now // 3600 - 24 + 1, 'days': now // 86400 - 30 + 1}
+
+
+def _update_trending(user, content, rating, now):
+	_execute(
+		_trending_retract_sql,
+		dict(_trending_cutoffs(now), user=user, content=content)
+	)
+	if rating is not None and rating >= settings.TRENDING_MIN_RATING:
+		_execute(
+			_trending_insert_sql,
+			{
+				'user': user,
+				'content': content,
+				'score': rating - settings.TRENDING_MIN_RATING + 1,
+				'hour': now // 3600,
+				'day': now // 86400,
+			}
+		)
+
+
+def get_trending_rows(users, span, since):
+	if not users:
+		return []
+	return _fetchall(
+		_trending_rows_sql,
+		{
+			'users': tuple(users),
+			'span': span,
+			'since': since,
+		}
+	)
+
+
+def expire_trending():
+	_execute(
+		_trending_expire_sql,
+		_trending_cutoffs(int(time.time()))
+	)
+
+
+def backfill_trending():
+	_execute(
+		_trending_backfill_sql,
+		dict(_trending_cutoffs(int(time.time())), min_rating=settings.TRENDING_MIN_RATING)
+	)
+
+
+# Play history queries
+
+# The cursor is derived from the stored plays, so it can never run ahead of them
+_history_cursors_sql = """
+	SELECT a.user, a.username, a.access_token, a.refresh_token, a.expires_at, (
+		SELECT COALESCE(MAX(p.played_at), 0) FROM synchrify_plays p
+		WHERE p.user = a.user
+	) FROM synchrify_spotify_auth a
+	WHERE a.user > %s
+	ORDER BY a.user
+	LIMIT %s
+"""
+
+_insert_plays_sql = """
+	INSERT IGNORE INTO synchrify_plays (user, content, played_at)
+	VALUES (%s, %s, %s)
+"""
+
+_history_page_sql = """
+	SELECT p.content, c.uri, c.name, p.played_at FROM synchrify_plays p
+	INNER JOIN synchrify_spotify_content c
+	ON c.id = p.content
+	WHERE p.user = %(user)s AND p.played_at >= %(since)s AND p.played_at < %(before)s
+	ORDER BY p.played_at DESC
+	LIMIT %(limit)s
+"""
+
+HISTORY_COLUMNS = ['content_id', 'uri', 'name', 'played_at']
+
+
+def get_history_cursors(after, limit):
+	return _fetchall(
+		_history_cursors_sql,
+		(after, limit)
+	)
+
+
+def insert_plays(rows):
+	if rows:
+		_executemany(
+			_insert_plays_sql,
+			rows
+		)
+
+
+def get_history(user, since=0, before=2 ** 31 - 1, limit=50, as_rows=False):
+	rows = _fetchall(
+		_history_page_sql,
+		{
+			'user': user,
+			'since': since,
+			'before': before,
+			'limit': limit,
+		}
+	)
+	if as_rows:
+		return rows
+	return [dict(zip(HISTORY_COLUMNS, row)) for row in rows]
+
+
+# Top snapshot queries
+
+_spotify_auth_page_sql = """
+	SELECT user, username, access_token, refresh_token, expires_at FROM synchrify_spotify_auth
+	WHERE user > %s
+	ORDER BY user
+	LIMIT %s
+"""
+
+_insert_top_snapshot_sql = """
+	INSERT INTO synchrify_top_snapshots (user, kind, timespan, items, taken_at)
+	VALUES (%s, %s, %s, %s, %s)
+	ON DUPLICATE KEY UPDATE
+		items = VALUES(items),
+		taken_at = VALUES(taken_at)
+"""
+
+_top_snapshot_sql = """
+	SELECT items, taken_at FROM synchrify_top_snapshots
+	WHERE kind = %s AND timespan = %s AND user = %s
+"""
+
+_top_snapshots_of_sql = """
+	SELECT user, items FROM synchrify_top_snapshots
+	WHERE kind = %s AND timespan = %s AND user IN %s
+"""
+
+
+def get_spotify_auth_page(after, limit):
+	return _fetchall(
+		_spotify_auth_page_sql,
+		(after, limit)
+	)
+
+
+def insert_top_snapshots(rows):
+	if rows:
+		_executemany(
+			_insert_top_snapshot_sql,
+			rows
+		)
+
+
+def get_top_snapshot(user, kind, timespan):
+	return _fetchone(
+		_top_snapshot_sql,
+		(kind, timespan, user)
+	)
+
+
+def get_top_snapshots(users, kind, timespan):
+	if not users:
+		return []
+	return _fetchall(
+		_top_snapshots_of_sql,
+		(kind, timespan, tuple(users))
+	)
+
+
+# Change feed queries
+
+_insert_change_sql = """
+	INSERT INTO synchrify_changes (user, kind, op, subject, content, rating, changed_at)
+	VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+
+_changes_since_sql = """
+	SELECT id, kind, op, subject, content, rating FROM synchrify_changes
+	WHERE user = %s AND id > %s
+	ORDER BY id
+	LIMIT %s
+"""
+
+_changes_version_sql = """
+	SELECT MAX(id) FROM synchrify_changes
+	WHERE user = %s
+"""
+
+_changes_floor_sql = """
+	SELECT MIN(id) FROM synchrify_changes
+"""
+
+_changes_prune_boundary_sql = """
+	SELECT id FROM synchrify_changes
+	WHERE changed_at >= %s
+	ORDER BY id
+	LIMIT 1
+"""
+
+_changes_next_id_sql = """
+	SELECT MAX(id) + 1 FROM synchrify_changes
+"""
+
+_changes_friends_sql = """
+	SELECT id, user, op, subject FROM synchrify_changes
+	WHERE id > %s AND kind = 'friends'
+	ORDER BY id
+	LIMIT %s
+"""
+
+_changes_mark_sql = """
+	SELECT COALESCE(MAX(id), 0) FROM synchrify_changes
+"""
+
+_changes_prune_sql = """
+	DELETE FROM synchrify_changes
+	WHERE id < %s
+"""
+
+
+def record_changes(rows):
+	changed_at = int(time.time())
+	values = [
+		(row + (None,) * (6 - len(row)) + (changed_at,))
+		for row in rows
+	]
+	version = _executemany(
+		_insert_change_sql,
+		values
+	)
+	changes.notify({row[0] for row in rows}, version)
+
+
+def get_changes(user, since, limit):
+	return [{'version': version, 'kind': kind, 'op': op, 'subject': subject, 'content_id': content, 'rating': rating}
+		for version, kind, op, subject, content, rating in _fetchall(
+			_changes_since_sql,
+			(user, since, limit)
 		)
 	]
+
+
+def get_changes_version(user):
+	row = _fetchone(
+		_changes_version_sql,
+		(user,)
+	)
+	return None if not row else row[0]
+
+
+def get_friend_changes(since, limit):
+	return _fetchall(
+		_changes_friends_sql,
+		(since, limit)
+	)
+
+
+def get_changes_mark():
+	return _fetchone(_changes_mark_sql)[0]
+
+
+def get_changes_floor():
+	row = _fetchone(_changes_floor_sql)
+	return None if not row else row[0]
+
+
+def prune_changes(before):
+	row = _fetchone(
+		_changes_prune_boundary_sql,
+		(before,)
+	)
+	if not row:
+		row = _fetchone(_changes_next_id_sql)
+	if row and row[0]:
+		_execute(
+			_changes_prune_sql,
+			(row[0],)
+		)
+
+
+# Checkpoint queries
+
+_checkpoint_get_sql = """
+	SELECT position FROM synchrify_checkpoints
+	WHERE name = %s
+"""
+
+_checkpoint_set_sql = """
+	INSERT INTO synchrify_checkpoints (name, position, updated_at)
+	VALUES (%s, %s, %s)
+	ON DUPLICATE KEY UPDATE
+		position = VALUES(position),
+		updated_at = VALUES(updated_at)
+"""
+
+
+def get_checkpoint(name):
+	row = _fetchone(
+		_checkpoint_get_sql,
+		(name,)
+	)
+	return row[0] if row else None
+
+
+def set_checkpoint(name, position):
+	_execute(
+		_checkpoint_set_sql,
+		(name, position, int(time.time()))
+	)
@@ -0,0 +1,213 @@
+import glob
+import json
+import os
+import shutil
+import threading
+import time
+
+from django.conf import settings
+
+from . import db, versions
+
+
+MANIFEST = 'current.json'
+KEEP_SNAPSHOTS = 2
+
+
+class _Snapshot:
+	# Mutual friendships in CSR form: the friends of users[i] are
+	# neighbors[offsets[i]:offsets[i + 1]], sorted. The arrays are memory-mapped
+	# read-only, so every worker shares the same pages.
+	def __init__(self, path, mark):
+		import numpy as np
+
+		# Plain ndarray views skip np.memmap's per-operation overhead
+		self.users, self.offsets, self.neighbors = (
+			np.load(os.path.join(path, name + '.npy'), mmap_mode='r').view(np.ndarray)
+			for name in ('users', 'offsets', 'neighbors')
+		)
+		self.mark = mark
+
+	def friends(self, user):
+		index = int(self.users.searchsorted(user))
+		if index < len(self.users) and self.users[index] == user:
+			return self.neighbors[self.offsets[index]:self.offsets[index + 1]]
+		return self.neighbors[:0]
+
+	def check(self, user, friend):
+		friends = self.friends(user)
+		index = int(friends.searchsorted(friend))
+		return index < len(friends) and friends[index] == friend
+
+
+_lock = threading.Lock()
+_snapshot = None
+_manifest_mtime = None
+_checked_at = 0.0
+_polled_at = 0.0
+_seen = 0
+# user -> {friend: True (added) or False (removed)} since the snapshot was built
+_delta = {}
+# user -> the 'friends' version this worker last caught up with
+_versions = {}
+
+
+def _load(manifest):
+	global _snapshot, _seen, _delta, _polled_at
+	with open(manifest) as f:
+		current = json.load(f)
+
+	snapshot = _Snapshot(os.path.join(settings.GRAPH_DIR, current['path']), current['mark'])
+
+	# Changes older than the snapshot may have been pruned from the feed, in
+	# which case the delta cannot be rebuilt; stay on SQL until the next build
+	floor = db.get_changes_floor()
+	if floor is not None and floor > snapshot.mark + 1:
+		snapshot = None
+
+	_snapshot = snapshot
+	_seen = current['mark']
+	_delta = {}
+	_polled_at = 0.0
+
+
+def _poll():
+	global _seen
+	for version, user, op, subject in db.get_friend_changes(_seen, settings.GRAPH_DELTA_BATCH):
+		# Copied rather than mutated, since readers iterate these without the lock
+		changes = dict(_delta.get(user, ()))
+		changes[subject] = op == 'set'
+		_delta[user] = changes
+		_seen = version
+
+
+def _current():
+	global _snapshot, _manifest_mtime, _checked_at, _polled_at
+	now = time.monotonic()
+	if now - _checked_at < settings.GRAPH_RELOAD_INTERVAL and now - _polled_at < settings.GRAPH_DELTA_INTERVAL:
+		return _snapshot
+
+	with _lock:
+		if now - _checked_at >= settings.GRAPH_RELOAD_INTERVAL:
+			_checked_at = now
+			manifest = os.path.join(settings.GRAPH_DIR, MANIFEST)
+			try:
+				mtime = os.stat(manifest).st_mtime
+			except OSError:
+				mtime = None
+			if mtime != _manifest_mtime:
+				_manifest_mtime = mtime
+				if mtime is None:
+					_snapshot = None
+				else:
+					_load(manifest)
+
+		if _snapshot is not None and now - _polled_at >= settings.GRAPH_DELTA_INTERVAL:
+			_polled_at = now
+			_poll()
+
+	return _snapshot
+
+
+def refresh_delta():
+	# Makes this worker's next read pick up a friendship it just changed
+	global _polled_at
+	_polled_at = 0.0
+
+
+def friends_version(user):
+	# The 'friends' version to tag a response about user with. It is bumped in
+	# the shared cache as soon as a friendship changes, possibly through another
+	# worker, so a token this worker has not seen yet means polling the change
+	# feed before the graph is read; otherwise a stale list would be served
+	# under the new validator.
+	version = versions.get('friends', user)
+	if _versions.get(user) != version:
+		refresh_delta()
+		if len(_versions) > 10000:
+			_versions.clear()
+		_versions[user] = version
+	return version
+
+
+def _friends(snapshot, user):
+	result = snapshot.friends(user).tolist()
+	changes = _delta.get(user)
+	if changes:
+		result = sorted(
+			(set(result) - {friend for friend, added in changes.items() if not added})
+			| {friend for friend, added in changes.items() if added}
+		)
+	return result
+
+
+def check_friends(user, friend):
+	snapshot = _current()
+	if snapshot is None:
+		return db.check_friends(user, friend)
+
+	added = _delta.get(user, {}).get(friend)
+	if added is not None:
+		return added
+	return snapshot.check(user, friend)
+
+
+def friends(user):
+	snapshot = _current()
+	if snapshot is None:
+		return db.get_friends_list(user)
+	return _friends(snapshot, user)
+
+
+def friends_of_friends(user, skip=()):
+	# skip: friends whose own friends are left out
+	snapshot = _current()
+	if snapshot is None and not skip:
+		return db.get_friends_of_friends(user)
+
+	found = set()
+	for friend in friends(user):
+		if friend not in skip:
+			found.update(_friends(snapshot, friend) if snapshot is not None else db.get_friends_list(friend))
+	found.discard(user)
+	return sorted(found)
+
+
+def build():
+	import numpy as np
+
+	# Taken before reading the edges, so the overlay replays anything that races the read
+	mark = db.get_changes_mark()
+	edges = np.array(db.get_mutual_friend_edges(), dtype=np.int32).reshape(-1, 2)
+
+	users, counts = np.unique(edges[:, 0], return_counts=True)
+	offsets = np.zeros(len(users) + 1, dtype=np.int64)
+	np.cumsum(counts, out=offsets[1:])
+	neighbors = np.ascontiguousarray(edges[:, 1])
+
+	name = 'graph-%d-%d' % (mark, int(time.time() * 1000))
+	path = os.path.join(settings.GRAPH_DIR, name)
+	os.makedirs(path)
+	for array_name, array in (('users', users), ('offsets', offsets), ('neighbors', neighbors)):
+		np.save(os.path.join(path, array_name + '.npy'), array)
+
+	manifest = os.path.join(settings.GRAPH_DIR, MANIFEST)
+	with open(manifest + '.tmp', 'w') as f:
+		json.dump({'path': name, 'mark': mark}, f)
+	os.replace(manifest + '.tmp', manifest)
+
+	# Workers that still map an older snapshot keep reading it after the unlink
+	for old in sorted(glob.glob(os.path.join(settings.GRAPH_DIR, 'graph-*')), key=os.path.getmtime)[:-KEEP_SNAPSHOTS]:
+		shutil.rmtree(old, ignore_errors=True)
+
+	return {'users': len(users), 'edges': len(neighbors), 'mark': mark}
+
+
+def changed_since_build():
+	manifest = os.path.join(settings.GRAPH_DIR, MANIFEST)
+	try:
+		with open(manifest) as f:
+			mark = json.load(f)['mark']
+	except (OSError, ValueError):
+		return True
+	return bool(db.get_friend_changes(mark, 1))
@@ -0,0 +1,87 @@
+import calendar
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import spotipy
+from django.db import connection
+
+from . import db, throttle
+from .apikeys import SpotifyUserAuth
+
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT = 'history_ingest'
+
+# Spotify only remembers a user's 50 most recent plays, so one full page per
+# user per pass picks up everything since the cursor if passes run often enough
+PAGE_SIZE = 50
+
+
+def _played_at(timestamp):
+	# '2024-01-31T12:34:56.789Z', milliseconds optional, to Unix seconds
+	return calendar.timegm(time.strptime(timestamp[:19], '%Y-%m-%dT%H:%M:%S'))
+
+
+def _fetch_plays(bucket, user, username, access_token, refresh_token, expires_at, cursor):
+	bucket.acquire()
+	try:
+		auth = SpotifyUserAuth(access_token, refresh_token, expires_at, user, username)
+		# Plays are stored to the second, so skip the rest of the cursor's second
+		page = auth.client(user).current_user_recently_played(PAGE_SIZE, after=cursor * 1000 + 999)
+	finally:
+		# Refreshing an expired token writes through this thread's connection
+		connection.close()
+
+	plays = []
+	for item in page.get('items') or []:
+		track = item.get('track')
+		# Local files have no Spotify ID and episodes are not content we store
+		if track and track.get('id') and track.get('type', 'track') == 'track':
+			plays.append((track['id'], track.get('name'), _played_at(item['played_at'])))
+	return plays
+
+
+def ingest(batch_size, workers, rate, max_batches=None):
+	bucket = throttle.TokenBucket(rate)
+	after = int(db.get_checkpoint(CHECKPOINT) or 0)
+
+	stats = {'batches': 0, 'users': 0, 'plays': 0, 'failed': 0}
+	with ThreadPoolExecutor(workers) as pool:
+		while max_batches is None or stats['batches'] < max_batches:
+			rows = db.get_history_cursors(after, batch_size)
+			if not rows:
+				# The pass is complete; the next run starts from the first user again
+				db.set_checkpoint(CHECKPOINT, None)
+				break
+
+			futures = [pool.submit(_fetch_plays, bucket, *row) for row in rows]
+
+			fetched = []
+			for row, future in zip(rows, futures):
+				try:
+					fetched.append((row[0], future.result()))
+				except (spotipy.SpotifyException, requests.RequestException) as e:
+					# Their cursor has not moved, so the next pass catches up
+					logger.warning('Fetching recent plays for user %d failed: %s', row[0], e)
+					stats['failed'] += 1
+
+			ids = db.intern_content('track', {uri: name for _, plays in fetched for uri, name, _ in plays})
+			plays = [
+				(user, ids[uri], played_at)
+				for user, user_plays in fetched
+				for uri, _, played_at in user_plays
+				if uri in ids
+			]
+			db.insert_plays(plays)
+
+			after = rows[-1][0]
+			db.set_checkpoint(CHECKPOINT, str(after))
+
+			stats['batches'] += 1
+			stats['users'] += len(rows)
+			stats['plays'] += len(plays)
+
+	return stats
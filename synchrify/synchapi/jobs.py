@@ -0,0 +1,77 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+JOB_TTL = 24 * 3600
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _key(job_id):
+	return 'synchapi:job:%s' % job_id
+
+
+def _get_executor():
+	global _executor
+	with _executor_lock:
+		if _executor is None:
+			_executor = ThreadPoolExecutor(settings.JOB_WORKERS, thread_name_prefix='synchapi-job')
+		return _executor
+
+
+class Job:
+	def __init__(self, job_id, owner, kind):
+		self.id = job_id
+		self.state = {
+			'id': job_id,
+			'owner': owner,
+			'kind': kind,
+			'status': 'queued',
+			'done': 0,
+			'total': 0,
+			'message': None,
+			'result': None,
+			'error': None,
+			'updated_at': int(time.time()),
+		}
+
+	def _save(self, **changes):
+		self.state.update(changes, updated_at=int(time.time()))
+		cache.set(_key(self.id), self.state, JOB_TTL)
+
+	def progress(self, done, total, message=None):
+		self._save(done=done, total=total, message=message)
+
+
+def _run(job, fn, args):
+	job._save(status='running')
+	try:
+		result = fn(job, *args)
+	except Exception as e:
+		logger.exception('Job %s failed', job.id)
+		job._save(status='failed', error=str(e))
+	else:
+		job._save(status='done', result=result)
+	finally:
+		connection.close()
+
+
+def submit(owner, kind, fn, *args):
+	job = Job(uuid.uuid4().hex, owner, kind)
+	job._save()
+	_get_executor().submit(_run, job, fn, args)
+	return job.id
+
+
+def get(job_id):
+	return cache.get(_key(job_id))
@@ -0,0 +1,62 @@
+import json
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.http import JsonResponse as StdlibJsonResponse
+
+from synchapi import db, responses, spotify_stub
+
+
+def _friends_rating_rows(count):
+	return [
+		(n % 300, n, 'track', 'synth%017d' % n, 'Synthetic Content %d' % n, n % 11)
+		for n in range(count)
+	]
+
+
+def _spotify_body(count):
+	return json.dumps({
+		'items': [
+			{'added_at': '2020-01-01T00:00:00Z', 'track': spotify_stub.track('%022d' % n)}
+			for n in range(count)
+		],
+		'limit': count,
+		'offset': 0,
+		'total': count,
+	}).encode('utf-8')
+
+
+class Command(BaseCommand):
+	help = 'Micro-benchmark response serialization for large row payloads and Spotify passthrough bodies'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--rows', type=int, default=10000)
+		parser.add_argument('--spotify-items', type=int, default=50)
+		parser.add_argument('--repeat', type=int, default=20)
+
+	def handle(self, *args, **options):
+		rows = _friends_rating_rows(options['rows'])
+		body = _spotify_body(options['spotify_items'])
+
+		cases = [
+			('rows: stdlib JsonResponse(dicts)', lambda: StdlibJsonResponse({'ratings': [
+				dict(zip(db.FRIENDS_RATINGS_COLUMNS, row)) for row in rows
+			]})),
+			('rows: fast JsonResponse(dicts)', lambda: responses.JsonResponse({'ratings': [
+				dict(zip(db.FRIENDS_RATINGS_COLUMNS, row)) for row in rows
+			]})),
+			('rows: fast JsonResponse(columns)', lambda: responses.JsonResponse({
+				'ratings': responses.columns(db.FRIENDS_RATINGS_COLUMNS, rows)
+			})),
+			('spotify: parse + stdlib re-encode', lambda: StdlibJsonResponse(json.loads(body))),
+			('spotify: raw relay', lambda: responses.RawJsonResponse(body)),
+		]
+
+		self.stdout.write('encoder: %s, %d rows, %d Spotify items' % (
+			'orjson' if responses.orjson else 'stdlib json', len(rows), options['spotify_items']
+		))
+		self.stdout.write('%-40s %10s %10s' % ('case', 'ms/op', 'bytes'))
+		for name, build in cases:
+			size = len(build().content)
+			seconds = min(timeit.repeat(build, number=1, repeat=options['repeat']))
+			self.stdout.write('%-40s %10.3f %10d' % (name, seconds * 1000, size))
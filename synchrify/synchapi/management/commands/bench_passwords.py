@@ -0,0 +1,66 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from synchapi import passwords
+
+
+PASSWORD = 'benchmark-password-0000000000000'
+
+
+def _logins_per_second(encoded, workers, duration):
+	# pbkdf2_hmac releases the GIL, so worker threads scale across cores
+	def run(deadline):
+		count = 0
+		while time.perf_counter() < deadline:
+			passwords.check_password(PASSWORD, encoded)
+			count += 1
+		return count
+
+	start = time.perf_counter()
+	with ThreadPoolExecutor(workers) as pool:
+		counts = list(pool.map(run, [start + duration] * workers))
+	return sum(counts) / (time.perf_counter() - start)
+
+
+class Command(BaseCommand):
+	help = 'Measure password checks (logins) per second per core at each PBKDF2 work factor'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--iterations', type=int, nargs='+',
+			default=[50000, 100000, 200000, 400000, 600000, 1000000])
+		parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+			help='threads hashing concurrently for the all-workers column')
+		parser.add_argument('--duration', type=float, default=2.0,
+			help='seconds to run each measurement')
+		parser.add_argument('--budget-ms', type=float, default=settings.LOGIN_HASH_BUDGET_MS,
+			help='per-login hashing latency the recommendation must stay under')
+
+	def handle(self, *args, **options):
+		workers = options['workers']
+		self.stdout.write('%-12s %10s %14s %14s' % (
+			'iterations', 'ms/login', 'logins/s/core', 'logins/s (%d)' % workers
+		))
+
+		recommended = None
+		for iterations in sorted(options['iterations']):
+			encoded = passwords.make_password(PASSWORD, iterations)
+			single = _logins_per_second(encoded, 1, options['duration'])
+			parallel = _logins_per_second(encoded, workers, options['duration'])
+			latency = 1000 / single
+			if latency <= options['budget_ms']:
+				recommended = iterations
+			self.stdout.write('%-12d %10.1f %14.1f %14.1f' % (iterations, latency, single, parallel))
+
+		self.stdout.write('PASSWORD_ITERATIONS is %d' % settings.PASSWORD_ITERATIONS)
+		if recommended:
+			self.stdout.write(self.style.SUCCESS(
+				'Largest work factor within %.0f ms: %d' % (options['budget_ms'], recommended)
+			))
+		else:
+			self.stdout.write(self.style.WARNING(
+				'No work factor fits within %.0f ms' % options['budget_ms']
+			))
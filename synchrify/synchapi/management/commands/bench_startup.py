@@ -0,0 +1,78 @@
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+STAGES = {
+	'wsgi': 'from django.core.wsgi import get_wsgi_application; get_wsgi_application()',
+	# What the first request pays for on top of get_wsgi_application()
+	'wsgi+urlconf': (
+		'from django.core.wsgi import get_wsgi_application; get_wsgi_application(); '
+		'from django.urls import get_resolver; get_resolver().url_patterns'
+	),
+}
+
+_import_line = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def _run(args):
+	start = time.perf_counter()
+	result = subprocess.run(
+		[sys.executable, '-X', 'importtime'] + args,
+		cwd=str(settings.BASE_DIR), capture_output=True, text=True,
+	)
+	elapsed = time.perf_counter() - start
+	if result.returncode != 0:
+		raise CommandError('%s failed:\n%s' % (' '.join(args), result.stderr[-2000:]))
+	return elapsed, result.stderr
+
+
+def _packages(stderr):
+	# Self microseconds summed per top-level package, however deeply imported
+	packages = {}
+	for line in stderr.splitlines():
+		match = _import_line.match(line)
+		if match:
+			package = match.group(4).split('.')[0]
+			packages[package] = packages.get(package, 0) + int(match.group(1))
+	return packages
+
+
+class Command(BaseCommand):
+	help = 'Time cold starts (`manage.py check` and get_wsgi_application) with -X importtime breakdowns'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--repeat', type=int, default=5)
+		parser.add_argument('--top', type=int, default=15,
+			help='packages to list in each import-time breakdown')
+
+	def handle(self, *args, **options):
+		os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE)
+
+		runs = {'manage.py check': ['manage.py', 'check']}
+		runs.update({name: ['-c', 'import django; django.setup(); ' + code] for name, code in STAGES.items()})
+
+		for name, args in runs.items():
+			timings, stderr = [], ''
+			for _ in range(options['repeat']):
+				elapsed, stderr = _run(args)
+				timings.append(elapsed)
+
+			self.stdout.write(self.style.MIGRATE_HEADING('%s: min %.0f ms, median %.0f ms over %d runs' % (
+				name, min(timings) * 1000, statistics.median(timings) * 1000, len(timings)
+			)))
+
+			packages = _packages(stderr)
+			self.stdout.write('  %-32s %10s' % ('package (self time)', 'ms'))
+			for package, us in sorted(packages.items(), key=lambda item: -item[1])[:options['top']]:
+				self.stdout.write('  %-32s %10.1f' % (package, us / 1000))
+
+			heavy = [package for package in ('spotipy', 'requests', 'numpy') if package in packages]
+			if heavy:
+				self.stdout.write('  imported at startup: ' + ', '.join(heavy))
@@ -0,0 +1,389 @@
+import json
+import math
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment
+from django.urls import reverse
+
+import requests
+
+from synchapi import apikeys, db, graph, privacy, ratingbuffer, spotify_endpoints, spotify_stub, synthetic, urls
+
+
+SPOTIFY_ENDPOINT_PARAMS = {
+	'profile': {},
+	'playing_track': {},
+	'recent_tracks': {'limit': 50},
+	'top_tracks': {'limit': 50, 'timespan': 'medium_term'},
+	'followed_artists': {'limit': 50},
+	'playlists': {'limit': 50},
+	'saved_albums': {'limit': 50},
+	'saved_tracks': {'limit': 50},
+	'search': {'q': 'synthetic', 'type': 'track', 'limit': 20},
+	'user_playlists': {'user': 'synthetic', 'limit': 50},
+	'fetch_tracks': {'tracks': ','.join(synthetic.uri(n) for n in range(50))},
+	'fetch_albums': {'albums': ','.join(synthetic.uri(n) for n in range(20))},
+	'fetch_artists': {'artists': ','.join(synthetic.uri(n) for n in range(50))},
+	'add_playlist_custom_image': {'playlist': synthetic.uri(0), 'image': 'c3R1Yg=='},
+	'create_playlist': {'name': 'Benchmark', 'description': 'benchmark'},
+	'follow_playlist': {'playlist': synthetic.uri(0)},
+	'is_following_playlist': {'playlist': synthetic.uri(0), 'users': 'synthetic'},
+	'add_playlist_tracks': {'playlist': synthetic.uri(0), 'tracks': synthetic.uri(1)},
+	'edit_playlist_details': {'playlist': synthetic.uri(0), 'name': 'Benchmark'},
+}
+
+
+class _TestClientSession:
+	def __init__(self):
+		self.client = Client()
+
+	def request(self, method, path, params=None, body=None):
+		if body is not None:
+			response = self.client.generic(method, path, json.dumps(body), 'application/json')
+		else:
+			response = self.client.generic(method, path + '?' + urlencode(params or {}))
+		return response.status_code, response.get('Location')
+
+
+class _HTTPSession:
+	def __init__(self, base_url):
+		self.base_url = base_url
+		self.session = requests.Session()
+
+	def request(self, method, path, params=None, body=None):
+		response = self.session.request(
+			method, self.base_url + path, params=params, json=body, allow_redirects=False
+		)
+		return response.status_code, response.headers.get('Location')
+
+
+def _login(session, sample):
+	session.request('POST', reverse('synchapi:login'), body={
+		'email': sample['email'], 'password': sample['password'],
+	})
+	return session
+
+
+def _register(bench, sample, i):
+	email = 'bench-%s@example.com' % uuid.uuid4().hex[:12]
+	return bench.session, 'POST', reverse('synchapi:register'), None, {'email': email, 'password': synthetic.PASSWORD}
+
+
+def _activate(bench, sample, i):
+	session, method, path, params, body = _register(bench, sample, i)
+	session.request(method, path, body=body)
+	with connection.cursor() as cursor:
+		cursor.execute("""
+			SELECT a.token FROM synchrify_activations a
+			INNER JOIN synchrify_users u
+			ON u.id = a.user
+			WHERE u.email = %s
+		""", (body['email'],))
+		token = cursor.fetchone()[0]
+	return bench.session, 'GET', reverse('synchapi:activate', args=[token]), None, None
+
+
+def _login_scenario(bench, sample, i):
+	return bench.session, 'POST', reverse('synchapi:login'), None, {'email': sample['email'], 'password': sample['password']}
+
+
+def _logout(bench, sample, i):
+	return bench.new_session(), 'GET', reverse('synchapi:logout'), None, None
+
+
+def _blend(bench, sample, i):
+	return bench.session, 'POST', reverse('synchapi:blend-create'), None, {'friends': [sample['friend']], 'size': 20}
+
+
+def _batch(bench, sample, i):
+	# The SPA home screen in one round-trip
+	routes = ['user', 'friends-list', 'friends-pending', 'ratings-list', 'ratings-list-all']
+	requests = [{'route': route} for route in routes] + [{'route': 'spotify-wrapper', 'args': ['playing_track']}]
+	return bench.session, 'POST', reverse('synchapi:batch'), None, {'requests': requests}
+
+
+def _spotify_auth_callback(bench, sample, i):
+	status, location = bench.session.request('GET', reverse('synchapi:spotify-auth'))
+	state = parse_qs(urlsplit(location or '').query).get('state', [''])[0]
+	return bench.session, 'GET', reverse('synchapi:spotify-auth-callback'), {'code': 'benchmark', 'state': state}, None
+
+
+def _get(name, args=None, params=None):
+	def scenario(bench, sample, i):
+		return bench.session, 'GET', reverse('synchapi:' + name, args=args(sample) if args else None), params, None
+	return scenario
+
+
+SCENARIOS = {
+	'register': _register,
+	'activate': _activate,
+	'login': _login_scenario,
+	'user': _get('user'),
+	'privacy': _get('privacy'),
+	'privacy-set': _get('privacy-set', lambda s: ['ratings', 'friends']),
+	'logout': _logout,
+	'friends-list': _get('friends-list'),
+	'friends-list-other': _get('friends-list-other', lambda s: [s['friend']]),
+	'friends-list-all': _get('friends-list-all'),
+	'friends-overlap': _get('friends-overlap'),
+	'friends-top-overlap': _get('friends-top-overlap'),
+	'friends-pending': _get('friends-pending'),
+	'friends-add': _get('friends-add', lambda s: [s['friend']]),
+	'friends-remove': _get('friends-remove', lambda s: [s['friend']]),
+	'content-search': _get('content-search', params={'q': 'synthetic cont'}),
+	'content-search-prefix': _get('content-search', params={'q': 'sy', 'type': 'track'}),
+	'content-get-by-id': _get('content-get-by-id', lambda s: [s['content']]),
+	'content-get-rating': _get('content-get-rating', lambda s: [s['content']]),
+	'content-get-rating-other': _get('content-get-rating-other', lambda s: [s['content'], s['friend']]),
+	'content-set-rating': _get('content-set-rating', lambda s: [s['content'], 7]),
+	'content-reset-rating': _get('content-reset-rating', lambda s: [s['content']]),
+	'content-get-by-uri': _get('content-get-by-uri', lambda s: [s['type'], s['uri']]),
+	'content-get-by-uri-created': lambda bench, sample, i: (
+		bench.session, 'GET', reverse('synchapi:content-get-by-uri', args=['track', 'bench' + uuid.uuid4().hex[:17]]), None, None
+	),
+	'ratings-list': _get('ratings-list'),
+	'ratings-list-other': _get('ratings-list-other', lambda s: [s['friend']]),
+	'ratings-list-all': _get('ratings-list-all'),
+	'ratings-feed': _get('ratings-feed'),
+	'ratings-trending': _get('ratings-trending'),
+	'ratings-trending-24h': _get('ratings-trending', params={'window': '24h'}),
+	'history': _get('history'),
+	'changes': _get('changes', params={'since': 0}),
+	'blend-create': _blend,
+	'batch': _batch,
+	'metrics': _get('metrics'),
+	'job-status': _get('job-status', lambda s: ['0' * 32]),
+	'spotify-auth': _get('spotify-auth'),
+	'spotify-auth-callback': _spotify_auth_callback,
+}
+
+for _endpoint, _params in SPOTIFY_ENDPOINT_PARAMS.items():
+	SCENARIOS['spotify-wrapper:' + _endpoint] = _get(
+		'spotify-wrapper', lambda s, endpoint=_endpoint: [endpoint], _params
+	)
+
+# Scenarios that change state; the rest are reads and must not answer 4xx
+WRITE_SCENARIOS = {
+	'register', 'activate', 'login', 'logout', 'privacy-set', 'friends-add', 'friends-remove',
+	'content-set-rating', 'content-reset-rating', 'content-get-by-uri-created', 'blend-create',
+	'spotify-auth', 'spotify-auth-callback',
+} | {'spotify-wrapper:' + name for name, spec in spotify_endpoints.ENDPOINTS.items() if spec.writes}
+
+
+def _sample_state(sample):
+	return {'rating': db.get_rating(sample['user'], sample['content']), 'privacy': privacy.get(sample['user'])}
+
+
+def _restore_friendship(sample, state):
+	db.insert_friend(sample['user'], sample['friend'])
+	graph.refresh_delta()
+
+
+def _restore_rating(sample, state):
+	# A buffered update would otherwise land after the restore
+	ratingbuffer.flush()
+	if state['rating'] is None:
+		db.delete_rating(sample['user'], sample['content'])
+	else:
+		db.insert_rating(sample['user'], sample['content'], state['rating'])
+
+
+def _restore_privacy(sample, state):
+	privacy.update(sample['user'], 'ratings', state['privacy'][privacy.FIELDS.index('ratings')])
+
+
+# Run untimed after every request of a scenario that mutates the sample, so
+# each request (and every later scenario and run) sees the seeded state
+RESTORE = {
+	'friends-remove': _restore_friendship,
+	'content-set-rating': _restore_rating,
+	'content-reset-rating': _restore_rating,
+	'privacy-set': _restore_privacy,
+}
+
+
+class _Bench:
+	def __init__(self, session_factory, sample):
+		self.session_factory = session_factory
+		self.sample = sample
+		self.session = self.new_session()
+
+	def new_session(self):
+		return _login(self.session_factory(), self.sample)
+
+
+class _QuietHandler(WSGIRequestHandler):
+	def log_message(self, format, *args):
+		pass
+
+
+def _percentile(values, pct):
+	ordered = sorted(values)
+	return ordered[max(0, math.ceil(pct / 100.0 * len(ordered)) - 1)]
+
+
+def _summary(latencies, queries=None):
+	result = {
+		'count': len(latencies),
+		'p50_ms': _percentile(latencies, 50) * 1000,
+		'p95_ms': _percentile(latencies, 95) * 1000,
+		'p99_ms': _percentile(latencies, 99) * 1000,
+	}
+	if queries is not None:
+		result['queries'] = sum(queries) / len(queries)
+	return result
+
+
+class Command(BaseCommand):
+	help = 'Drive every synchapi endpoint against seeded data and a local Spotify stub, reporting latency percentiles'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--iterations', type=int, default=50,
+			help='measured requests per endpoint (per thread with --http)')
+		parser.add_argument('--http', action='store_true',
+			help='serve the WSGI application on a local port and load it over HTTP instead of the test client')
+		parser.add_argument('--threads', type=int, default=8,
+			help='concurrent clients per endpoint with --http')
+		parser.add_argument('--only', nargs='*', metavar='SCENARIO',
+			help='only run these scenarios (URL names, or spotify-wrapper:<endpoint>)')
+		parser.add_argument('--json', metavar='PATH',
+			help='also write the results to this file as JSON')
+		parser.add_argument('--spotify-latency', default='none',
+			help='stub latency: none, fixed:MS, uniform:LOW_MS:HIGH_MS or lognormal:MEDIAN_MS:SIGMA')
+		parser.add_argument('--spotify-rate-limit-rate', type=float, default=0.0,
+			help='fraction of stub responses that are 429 with Retry-After')
+		parser.add_argument('--spotify-error-rate', type=float, default=0.0,
+			help='fraction of stub responses that are 503')
+		parser.add_argument('--rate-limits', action='store_true',
+			help='keep RATE_LIMITS enforced (by default they are lifted so every request reaches its view)')
+
+	def handle(self, *args, **options):
+		names = {pattern.name for pattern in urls.urlpatterns}
+		uncovered = names - {name.split(':')[0] for name in SCENARIOS}
+		uncovered |= {'spotify-wrapper:' + name for name in spotify_endpoints.ENDPOINTS} - set(SCENARIOS)
+		if uncovered:
+			raise CommandError('No benchmark scenario for: ' + ', '.join(sorted(uncovered)))
+
+		scenarios = SCENARIOS
+		if options['only']:
+			scenarios = {name: SCENARIOS[name] for name in options['only']}
+
+		samples = synthetic.sample(max(options['threads'], 1))
+		if not samples:
+			raise CommandError('No synthetic data found; run seed_data first')
+
+		setup_test_environment()
+		stub = spotify_stub.start(config=spotify_stub.StubConfig(
+			latency=options['spotify_latency'],
+			rate_limit_rate=options['spotify_rate_limit_rate'],
+			retry_after=0,
+			error_rate=options['spotify_error_rate'],
+		))
+		apikeys.OAUTH_TOKEN_URL = stub.token_url
+		apikeys.API_PREFIX = stub.api_prefix
+
+		try:
+			with override_settings(RATE_LIMIT_ENABLED=options['rate_limits']):
+				if options['http']:
+					results = self._run_http(scenarios, samples, options['iterations'], options['threads'])
+				else:
+					results = self._run_client(scenarios, samples[0], options['iterations'])
+		finally:
+			stub.shutdown()
+
+		self._report(results)
+		if options['json']:
+			with open(options['json'], 'w') as f:
+				json.dump(results, f, indent=2)
+
+		# A read answering 4xx is timing an error path, not the endpoint
+		allowed = {429} if options['rate_limits'] else set()
+		failed = sorted(
+			name for name, result in results.items() if name not in WRITE_SCENARIOS
+			and any(400 <= status < 500 and status not in allowed for status in result['statuses'])
+		)
+		if failed:
+			raise CommandError('Read scenarios answered 4xx: ' + ', '.join(failed))
+
+	def _run_client(self, scenarios, sample, iterations):
+		bench = _Bench(_TestClientSession, sample)
+		state = _sample_state(sample)
+		results = {}
+		for name, scenario in scenarios.items():
+			restore = RESTORE.get(name)
+			latencies, queries, statuses = [], [], set()
+			for i in range(iterations):
+				session, method, path, params, body = scenario(bench, sample, i)
+				with CaptureQueriesContext(connection) as captured:
+					start = time.perf_counter()
+					status, _ = session.request(method, path, params, body)
+					latencies.append(time.perf_counter() - start)
+				queries.append(len(captured))
+				statuses.add(status)
+				if restore:
+					restore(sample, state)
+			results[name] = dict(_summary(latencies, queries), statuses=sorted(statuses))
+		return results
+
+	def _run_http(self, scenarios, samples, iterations, threads):
+		httpd = ThreadedWSGIServer(('127.0.0.1', 0), _QuietHandler)
+		httpd.set_app(get_internal_wsgi_application())
+		threading.Thread(target=httpd.serve_forever, daemon=True).start()
+		base_url = 'http://127.0.0.1:%d' % httpd.server_address[1]
+
+		states = [_sample_state(sample) for sample in samples]
+
+		def worker(scenario, restore, sample, state):
+			bench = _Bench(lambda: _HTTPSession(base_url), sample)
+			latencies, statuses = [], set()
+			for i in range(iterations):
+				session, method, path, params, body = scenario(bench, sample, i)
+				start = time.perf_counter()
+				status, _ = session.request(method, path, params, body)
+				latencies.append(time.perf_counter() - start)
+				statuses.add(status)
+				if restore:
+					restore(sample, state)
+			connection.close()
+			return latencies, statuses
+
+		results = {}
+		try:
+			with ThreadPoolExecutor(threads) as pool:
+				for name, scenario in scenarios.items():
+					start = time.perf_counter()
+					futures = [
+						pool.submit(worker, scenario, RESTORE.get(name), samples[t % len(samples)], states[t % len(samples)])
+						for t in range(threads)
+					]
+					latencies, statuses = [], set()
+					for future in futures:
+						worker_latencies, worker_statuses = future.result()
+						latencies.extend(worker_latencies)
+						statuses |= worker_statuses
+					elapsed = time.perf_counter() - start
+					results[name] = dict(
+						_summary(latencies), statuses=sorted(statuses), rps=len(latencies) / elapsed
+					)
+		finally:
+			httpd.shutdown()
+		return results
+
+	def _report(self, results):
+		self.stdout.write('%-42s %7s %9s %9s %9s %8s  %s' % (
+			'scenario', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'statuses'
+		))
+		for name, result in results.items():
+			self.stdout.write('%-42s %7d %9.2f %9.2f %9.2f %8s  %s' % (
+				name, result['count'], result['p50_ms'], result['p95_ms'], result['p99_ms'],
+				'%.1f' % result['queries'] if 'queries' in result else '-',
+				','.join(str(status) for status in result['statuses']),
+			))
@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from synchapi import db
+
+
+class Command(BaseCommand):
+	help = 'Prune old entries from the change feed; clients behind the cutoff are told to refetch'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--keep-days', type=int, default=7)
+
+	def handle(self, *args, **options):
+		db.prune_changes(int(time.time()) - options['keep_days'] * 24 * 3600)
+		self.stdout.write('Changes older than %d days pruned' % options['keep_days'])
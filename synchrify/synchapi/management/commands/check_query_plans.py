@@ -0,0 +1,191 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from synchapi import db, synthetic
+
+
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE', 'INSERT')
+FULL_SCAN_TYPES = ('ALL', 'index')
+
+_table_regex = re.compile(r'\bsynchrify_\w+')
+
+# Offline maintenance queries that are expected to walk whole tables
+MAINTENANCE_QUERIES = {
+	'_timeline_overfull_sql',
+	'_timeline_backfill_sql',
+	'_changes_prune_boundary_sql',
+	'_friends_mutual_edges_sql',
+	'_trending_expire_sql',
+	'_trending_backfill_sql',
+}
+
+
+def _sample_params(sample):
+	user, friend, email, content, content_type, uri = (
+		sample['user'], sample['friend'], sample['email'],
+		sample['content'], sample['type'], sample['uri'],
+	)
+	return {
+		'_insert_user_sql': (email, 'x' * 32),
+		'_activate_user_sql': (user,),
+		'_email_exists_sql': (email,),
+		'_user_by_email_sql': (email,),
+		'_set_password_sql': ('x' * 32, user),
+		'_email_by_id_sql': (user,),
+		'_insert_activation_sql': ('00000000-0000-0000-0000-000000000000', email),
+		'_activation_invalidate_sql': ('00000000-0000-0000-0000-000000000000',),
+		'_activation_token_sql': ('00000000-0000-0000-0000-000000000000',),
+		'_insert_friend_sql': (user, friend),
+		'_delete_friend_sql': (user, friend),
+		'_friends_pending_sql': (user,),
+		'_friends_list_sql': (user,),
+		'_friends_of_friends_sql': {'user': user},
+		'_friends_mutual_edges_sql': None,
+		'_friends_check_sql': (user, friend),
+		'_privacy_sql': (user,),
+		'_privacy_many_sql': ((user, friend),),
+		'_set_privacy_sql': {'user': user, 'friends': 1, 'ratings': 1},
+		'_insert_spotify_auth_sql': {
+			'user': user, 'username': 'x', 'access': 'x', 'refresh': 'x', 'expires': 0,
+		},
+		'_spotify_username_by_id_sql': (user,),
+		'_spotify_auth_by_id_sql': (user,),
+		'_insert_content_sql': {'type': content_type, 'uri': uri, 'name': 'x', 'fetched_at': 0},
+		'_content_exists_sql': (content,),
+		'_content_by_id_sql': (content,),
+		'_content_by_uri_sql': (content_type, uri),
+		'_content_stale_sql': {'cutoff': 2 ** 31 - 1, 'fetched_at': 0, 'id': content, 'limit': 200},
+		'_content_refresh_sql': (content, content_type, uri, 'x', 0),
+		'_content_touch_sql': (0, (content,)),
+		'_content_search_fulltext_sql': {'terms': '+synthetic* +cont*', 'type': None, 'limit': 200},
+		'_content_search_prefix_sql': {'prefix': 'sy%', 'type': 'track', 'limit': 200},
+		'_content_friend_ratings_sql': ((content,), (user, friend)),
+		'_content_by_ids_sql': ((content,),),
+		'_content_ids_by_uri_sql': (content_type, (uri,)),
+		'_content_intern_sql': (content_type, uri, 'x', 0),
+		'_insert_rating_sql': {'user': user, 'content': content, 'rating': 5, 'rated_at': 0},
+		'_delete_rating_sql': (user, content),
+		'_content_rating_sql': (user, content),
+		'_ratings_rated_at_sql': (((user, content),),),
+		'_ratings_deleted_at_sql': {'users': (user,), 'contents': (content,)},
+		'_ratings_upsert_sql': (user, content, 5, 0),
+		'_ratings_delete_many_sql': (((user, content),),),
+		'_ratings_mutual_friends_sql': ((user, friend),),
+		'_ratings_timeline_upsert_sql': (friend, user, content, 5, 0),
+		'_ratings_timeline_retract_sql': (((user, content),),),
+		'_ratings_trending_retract_sql': (((user, content),),),
+		'_ratings_trending_upsert_sql': (user, 3600, 0, content, 1),
+		'_ratings_list_sql': (user,),
+		'_ratings_list_friends_sql': (user,),
+		'_group_ratings_sql': {'user': user},
+		'_members_track_ratings_sql': ((user, friend),),
+		'_timeline_fan_out_sql': {'user': user, 'content': content, 'rating': 5, 'rated_at': 0},
+		'_timeline_retract_sql': (user, content),
+		'_timeline_copy_sql': {'owner': user, 'friend': friend, 'limit': 1000},
+		'_timeline_delete_sql': {'user': user, 'friend': friend},
+		'_timeline_page_sql': {
+			'user': user, 'since': 0, 'rated_at': 2 ** 31 - 1, 'friend': 0, 'content': 0, 'limit': 50,
+		},
+		'_timeline_overfull_sql': (1000,),
+		'_timeline_cutoff_sql': (user, 1000),
+		'_timeline_trim_sql': (user, 0),
+		'_timeline_backfill_sql': None,
+		'_trending_retract_sql': {'user': user, 'content': content, 'hours': 0, 'days': 0},
+		'_trending_insert_sql': {'user': user, 'content': content, 'score': 1, 'hour': 0, 'day': 0},
+		'_trending_rows_sql': {'users': (user, friend), 'span': 86400, 'since': 0},
+		'_trending_expire_sql': {'hours': 0, 'days': 0},
+		'_trending_backfill_sql': {'min_rating': 7, 'hours': 0, 'days': 0},
+		'_history_cursors_sql': (0, 200),
+		'_insert_plays_sql': (user, content, 0),
+		'_history_page_sql': {'user': user, 'since': 0, 'before': 2 ** 31 - 1, 'limit': 50},
+		'_spotify_auth_page_sql': (0, 100),
+		'_insert_top_snapshot_sql': (user, 'tracks', 'medium_term', b'', 0),
+		'_top_snapshot_sql': ('tracks', 'medium_term', user),
+		'_top_snapshots_of_sql': ('tracks', 'medium_term', (user, friend)),
+		'_insert_change_sql': (user, 'ratings', 'set', None, content, 5, 0),
+		'_changes_since_sql': (user, 0, 100),
+		'_changes_version_sql': (user,),
+		'_changes_floor_sql': None,
+		'_changes_prune_boundary_sql': (0,),
+		'_changes_next_id_sql': None,
+		'_changes_friends_sql': (0, 1000),
+		'_changes_mark_sql': None,
+		'_changes_prune_sql': (0,),
+		'_checkpoint_get_sql': ('content_refresh',),
+		'_checkpoint_set_sql': ('content_refresh', None, 0),
+	}
+
+
+def _shipped_queries():
+	return {
+		name: value for name, value in vars(db).items()
+		if name.startswith('_') and name.endswith('_sql') and isinstance(value, str)
+	}
+
+
+def _analyze(queries):
+	# Every table the shipped queries touch, so no plan is judged on empty statistics
+	tables = sorted({table for query in queries.values() for table in _table_regex.findall(query)})
+	with connection.cursor() as cursor:
+		cursor.execute('ANALYZE TABLE ' + ', '.join(tables))
+		cursor.fetchall()
+
+
+def _explain(query, params):
+	with connection.cursor() as cursor:
+		cursor.execute('EXPLAIN ' + query, params)
+		columns = [col[0] for col in cursor.description]
+		return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+class Command(BaseCommand):
+	help = 'EXPLAIN every query shipped in synchapi.db and fail if any of them does a full scan'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--seed', type=int, default=0, metavar='USERS',
+			help='insert this many synthetic users (with friends, content and ratings) first')
+		parser.add_argument('--random-seed', type=int, default=0)
+
+	def handle(self, *args, **options):
+		if connection.vendor != 'mysql':
+			raise CommandError('Query plans can only be checked against MySQL')
+
+		if options['seed']:
+			synthetic.seed(options['seed'], options['seed'] * 4, random_seed=options['random_seed'])
+		queries = _shipped_queries()
+		_analyze(queries)
+
+		samples = synthetic.sample()
+		if not samples:
+			raise CommandError('No synthetic data found; run with --seed or seed_data first')
+		sample = samples[0]
+
+		params = _sample_params(sample)
+
+		missing = sorted(set(queries) - set(params))
+		if missing:
+			raise CommandError('No sample parameters for: ' + ', '.join(missing))
+
+		failures = []
+		for name, query in sorted(queries.items()):
+			if name in MAINTENANCE_QUERIES or not query.lstrip().upper().startswith(EXPLAINABLE):
+				continue
+			for row in _explain(query, params[name]):
+				if row.get('select_type') == 'INSERT':
+					continue
+				if row.get('type') in FULL_SCAN_TYPES:
+					failures.append((name, row))
+
+			self.stdout.write('checked ' + name)
+
+		for name, row in failures:
+			self.stderr.write('%s: full scan of %s (type=%s, key=%s, rows=%s)' % (
+				name, row.get('table'), row.get('type'), row.get('key'), row.get('rows')
+			))
+
+		if failures:
+			raise CommandError('%d full scan(s) found' % len(failures))
+
+		self.stdout.write(self.style.SUCCESS('%d queries checked, no full scans' % len(queries)))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from synchapi import ratingbuffer
+
+
+class Command(BaseCommand):
+	help = 'Write out rating buffer journals left behind by processes that exited without flushing'
+
+	def handle(self, *args, **options):
+		replayed = ratingbuffer.recover()
+		self.stdout.write('%d buffered ratings written' % replayed)
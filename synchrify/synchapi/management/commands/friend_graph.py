@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from synchapi import graph
+
+
+class Command(BaseCommand):
+	help = 'Write a memory-mapped CSR snapshot of the mutual friend graph for every worker to share'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--every', type=int, metavar='SECONDS',
+			help='keep running, rebuilding this often whenever friendships have changed')
+
+	def handle(self, *args, **options):
+		while True:
+			if graph.changed_since_build():
+				stats = graph.build()
+				self.stdout.write('Snapshot at change %(mark)d: %(users)d users, %(edges)d edges' % stats)
+
+			if not options['every']:
+				break
+			connection.close()
+			time.sleep(options['every'])
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core import signing
+from django.core.management.base import BaseCommand
+
+from synchapi.middleware import ProfilingMiddleware
+
+
+class Command(BaseCommand):
+	help = 'Print a signed X-Synchrify-Profile header value that forces ProfilingMiddleware to profile a request'
+
+	def handle(self, *args, **options):
+		value = signing.TimestampSigner(salt=ProfilingMiddleware.SALT).sign('profile')
+		self.stdout.write('X-Synchrify-Profile: %s' % value)
+		self.stdout.write('valid for %d seconds; collapsed stacks go to %s' % (
+			settings.PROFILING_HEADER_MAX_AGE, settings.PROFILING_DIR
+		))
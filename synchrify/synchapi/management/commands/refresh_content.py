@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from synchapi import db, refresh
+
+
+class Command(BaseCommand):
+	help = 'Re-fetch the names of stale content rows from Spotify, resuming from the last checkpoint'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--max-age', type=int, default=settings.CONTENT_REFRESH_MAX_AGE,
+			help='refresh rows last fetched more than this many seconds ago')
+		parser.add_argument('--batch-size', type=int, default=settings.CONTENT_REFRESH_BATCH)
+		parser.add_argument('--workers', type=int, default=settings.CONTENT_REFRESH_WORKERS,
+			help='concurrent Spotify requests per batch')
+		parser.add_argument('--rate', type=float,
+			default=settings.SPOTIFY_RATE_BUDGET * settings.CONTENT_REFRESH_BUDGET_SHARE,
+			help='Spotify requests per second (default: CONTENT_REFRESH_BUDGET_SHARE of SPOTIFY_RATE_BUDGET)')
+		parser.add_argument('--max-batches', type=int, default=None,
+			help='stop after this many batches; the next run resumes where this one stopped')
+		parser.add_argument('--restart', action='store_true',
+			help='discard the checkpoint and start from the oldest row')
+
+	def handle(self, *args, **options):
+		if options['restart']:
+			db.set_checkpoint(refresh.CHECKPOINT, None)
+
+		stats = refresh.refresh_stale(
+			options['max_age'],
+			options['batch_size'],
+			options['workers'],
+			options['rate'],
+			max_batches=options['max_batches'],
+		)
+		for name, count in stats.items():
+			self.stdout.write('%s: %d' % (name, count))
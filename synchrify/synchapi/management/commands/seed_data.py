@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from synchapi import synthetic
+
+
+class Command(BaseCommand):
+	help = 'Bulk-insert a reproducible synthetic dataset (users, friend graph, content, ratings, plays)'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--users', type=int, default=1000)
+		parser.add_argument('--content', type=int, default=10000)
+		parser.add_argument('--mean-degree', type=int, default=20,
+			help='mean number of outgoing friend edges per user (power-law distributed)')
+		parser.add_argument('--mutual', type=float, default=0.7,
+			help='probability that a friend edge is reciprocated')
+		parser.add_argument('--mean-ratings', type=int, default=50,
+			help='mean number of ratings per user (content popularity is Zipf distributed)')
+		parser.add_argument('--mean-plays', type=int, default=100,
+			help='mean number of listening-history plays per user')
+		parser.add_argument('--random-seed', type=int, default=0)
+		parser.add_argument('--no-spotify-auth', action='store_true',
+			help='do not create synthetic Spotify credentials for the new users')
+
+	def handle(self, *args, **options):
+		counts = synthetic.seed(
+			options['users'],
+			options['content'],
+			mean_degree=options['mean_degree'],
+			mutual=options['mutual'],
+			mean_ratings=options['mean_ratings'],
+			mean_plays=options['mean_plays'],
+			random_seed=options['random_seed'],
+			spotify_auth=not options['no_spotify_auth'],
+		)
+		for name, count in counts.items():
+			self.stdout.write('%s: %d' % (name, count))
+		self.stdout.write(self.style.SUCCESS('Synthetic users log in with password %r' % synthetic.PASSWORD))
@@ -0,0 +1,44 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from synchapi import db, snapshots
+
+
+class Command(BaseCommand):
+	help = "Snapshot every Spotify-authenticated user's top tracks and artists for each time range"
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=settings.TOP_SNAPSHOT_BATCH,
+			help='users snapshotted per batch')
+		parser.add_argument('--workers', type=int, default=settings.TOP_SNAPSHOT_WORKERS,
+			help='users fetched concurrently per batch')
+		parser.add_argument('--rate', type=float,
+			default=settings.SPOTIFY_RATE_BUDGET * settings.TOP_SNAPSHOT_BUDGET_SHARE,
+			help='Spotify requests per second (default: TOP_SNAPSHOT_BUDGET_SHARE of SPOTIFY_RATE_BUDGET)')
+		parser.add_argument('--max-batches', type=int, default=None,
+			help='stop after this many batches; the next run resumes where this one stopped')
+		parser.add_argument('--restart', action='store_true',
+			help='discard the checkpoint and start from the first user')
+		parser.add_argument('--every', type=int, metavar='SECONDS',
+			help='keep running, starting a new pass this long after the previous one finished')
+
+	def handle(self, *args, **options):
+		if options['restart']:
+			db.set_checkpoint(snapshots.CHECKPOINT, None)
+
+		while True:
+			stats = snapshots.take(
+				options['batch_size'],
+				options['workers'],
+				options['rate'],
+				max_batches=options['max_batches'],
+			)
+			self.stdout.write(', '.join('%s: %d' % item for item in stats.items()))
+
+			if not options['every']:
+				break
+			connection.close()
+			time.sleep(options['every'])
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from synchapi import spotify_stub
+
+
+class Command(BaseCommand):
+	help = 'Serve a local Spotify token endpoint and Web API subset with deterministic fake data'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--host', default='127.0.0.1')
+		parser.add_argument('--port', type=int, default=8900)
+		parser.add_argument('--latency', default='none',
+			help='none, fixed:MS, uniform:LOW_MS:HIGH_MS or lognormal:MEDIAN_MS:SIGMA')
+		parser.add_argument('--rate-limit-rate', type=float, default=0.0,
+			help='fraction of responses that are 429 with Retry-After')
+		parser.add_argument('--retry-after', type=int, default=1,
+			help='Retry-After seconds sent with 429 responses')
+		parser.add_argument('--error-rate', type=float, default=0.0,
+			help='fraction of responses that are 503')
+		parser.add_argument('--random-seed', type=int, default=0)
+
+	def handle(self, *args, **options):
+		config = spotify_stub.StubConfig(
+			latency=options['latency'],
+			rate_limit_rate=options['rate_limit_rate'],
+			retry_after=options['retry_after'],
+			error_rate=options['error_rate'],
+			random_seed=options['random_seed'],
+		)
+		server = spotify_stub.StubServer((options['host'], options['port']), config)
+
+		self.stdout.write('Spotify stub listening on ' + server.base_url)
+		self.stdout.write('  SPOTIFY_TOKEN_URL=' + server.token_url)
+		self.stdout.write('  SPOTIFY_API_URL=' + server.api_prefix)
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			server.server_close()
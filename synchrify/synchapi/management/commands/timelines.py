@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from synchapi import db
+
+
+class Command(BaseCommand):
+	help = 'Maintain the per-user activity feed timelines'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--backfill', action='store_true',
+			help="fan existing ratings out into every mutual friend's timeline")
+		parser.add_argument('--trim', action='store_true',
+			help='cap every timeline at TIMELINE_LENGTH entries')
+
+	def handle(self, *args, **options):
+		if not options['backfill'] and not options['trim']:
+			raise CommandError('Nothing to do; pass --backfill and/or --trim')
+
+		if options['backfill']:
+			db.backfill_timelines()
+			self.stdout.write('Timelines backfilled')
+
+		if options['trim']:
+			trimmed = db.trim_timelines(settings.TIMELINE_LENGTH)
+			self.stdout.write('%d timelines trimmed to %d entries' % (trimmed, settings.TIMELINE_LENGTH))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from synchapi import db
+
+
+class Command(BaseCommand):
+	help = 'Maintain the time-bucketed trending counters'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--backfill', action='store_true',
+			help='add counters for existing ratings inside the trending windows')
+		parser.add_argument('--expire', action='store_true',
+			help='drop expired buckets of users who have not rated since they expired')
+
+	def handle(self, *args, **options):
+		if not options['backfill'] and not options['expire']:
+			raise CommandError('Nothing to do; pass --backfill and/or --expire')
+
+		if options['backfill']:
+			db.backfill_trending()
+			self.stdout.write('Trending counters backfilled')
+
+		if options['expire']:
+			db.expire_trending()
+			self.stdout.write('Expired trending buckets dropped')
@@ -0,0 +1,200 @@
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+	'synchapi_view_seconds': ('histogram', 'View latency by URL name'),
+	'synchapi_view_responses_total': ('counter', 'Responses by URL name and status code'),
+	'synchapi_db_query_seconds': ('histogram', 'synchapi.db query latency by query name'),
+	'synchapi_spotify_request_seconds': ('histogram', 'Spotify API latency by endpoint'),
+	'synchapi_spotify_responses_total': ('counter', 'Spotify API responses by endpoint and status code'),
+	'synchapi_spotify_token_refreshes_total': ('counter', 'Spotify access tokens fetched, by grant type'),
+	'synchapi_cache_requests_total': ('counter', 'Cache lookups by cache and result (hit or miss)'),
+	'synchapi_rating_buffer_total': ('counter', 'Ratings buffered by the write-behind buffer, rows it wrote and updates superseded by newer ratings'),
+}
+
+# Recording is a dict update under one lock; with METRICS_DIR set, each process
+# also rewrites its own snapshot file at most every METRICS_FLUSH_INTERVAL
+# seconds and the metrics view sums the files of every live process. Only one
+# thread flushes at a time; the others carry on without waiting for it.
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_next_flush = 0.0
+
+
+def _after_fork():
+	# A forked worker must not report what its parent recorded before the fork
+	global _lock, _flush_lock, _next_flush
+	_lock = threading.Lock()
+	_flush_lock = threading.Lock()
+	_counters.clear()
+	_histograms.clear()
+	_next_flush = 0.0
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def inc(name, labels=(), value=1):
+	key = (name, labels)
+	with _lock:
+		_counters[key] = _counters.get(key, 0) + value
+	_maybe_flush()
+
+
+def observe(name, labels, seconds):
+	key = (name, labels)
+	index = bisect.bisect_left(BUCKETS, seconds)
+	with _lock:
+		histogram = _histograms.get(key)
+		if histogram is None:
+			# One count per bucket, then +Inf, then the sum
+			histogram = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+		histogram[index] += 1
+		histogram[-1] += seconds
+	_maybe_flush()
+
+
+def _directory():
+	return getattr(settings, 'METRICS_DIR', None)
+
+
+def _maybe_flush():
+	if time.monotonic() >= _next_flush and _flush_lock.acquire(blocking=False):
+		try:
+			if time.monotonic() >= _next_flush:
+				_flush()
+		finally:
+			_flush_lock.release()
+
+
+def _snapshot():
+	with _lock:
+		return {
+			'counters': [[name, labels, value] for (name, labels), value in _counters.items()],
+			'histograms': [[name, labels, list(values)] for (name, labels), values in _histograms.items()],
+		}
+
+
+def flush():
+	with _flush_lock:
+		_flush()
+
+
+def _flush():
+	global _next_flush
+	directory = _directory()
+	if not directory:
+		_next_flush = float('inf')
+		return
+
+	_next_flush = time.monotonic() + settings.METRICS_FLUSH_INTERVAL
+	snapshot = _snapshot()
+	path = os.path.join(directory, 'metrics-%d.json' % os.getpid())
+	tmp = '%s.%d.tmp' % (path, threading.get_ident())
+	try:
+		with open(tmp, 'w') as f:
+			json.dump(snapshot, f)
+		os.replace(tmp, path)
+	except OSError as e:
+		# Recording must never fail the request it happens in
+		logger.warning('Writing metrics to %s failed: %s', directory, e)
+
+
+def _alive(path):
+	try:
+		os.kill(int(os.path.basename(path)[len('metrics-'):-len('.json')]), 0)
+	except ValueError:
+		return True
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		pass
+	return True
+
+
+def _collect():
+	directory = _directory()
+	if not directory:
+		return [_snapshot()]
+
+	flush()
+	snapshots = []
+	for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+		if not _alive(path):
+			# Its counters would otherwise be summed into every scrape forever
+			try:
+				os.unlink(path)
+			except OSError:
+				pass
+			continue
+		try:
+			with open(path) as f:
+				snapshots.append(json.load(f))
+		except (OSError, ValueError):
+			continue
+	return snapshots
+
+
+def _merge(snapshots):
+	counters, histograms = {}, {}
+	for snapshot in snapshots:
+		for name, labels, value in snapshot['counters']:
+			key = (name, tuple(tuple(label) for label in labels))
+			counters[key] = counters.get(key, 0) + value
+		for name, labels, values in snapshot['histograms']:
+			key = (name, tuple(tuple(label) for label in labels))
+			merged = histograms.get(key)
+			histograms[key] = values if merged is None else [a + b for a, b in zip(merged, values)]
+	return counters, histograms
+
+
+def _escape(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, extra=()):
+	labels = tuple(labels) + tuple(extra)
+	if not labels:
+		return ''
+	return '{' + ','.join('%s="%s"' % (key, _escape(value)) for key, value in labels) + '}'
+
+
+def render():
+	counters, histograms = _merge(_collect())
+
+	lines = []
+	for name, (kind, help_text) in METRICS.items():
+		lines.append('# HELP %s %s' % (name, help_text))
+		lines.append('# TYPE %s %s' % (name, kind))
+
+		if kind == 'counter':
+			for (metric, labels), value in sorted(counters.items()):
+				if metric == name:
+					lines.append('%s%s %s' % (name, _labels(labels), value))
+			continue
+
+		for (metric, labels), values in sorted(histograms.items()):
+			if metric != name:
+				continue
+			cumulative = 0
+			for bound, count in zip(BUCKETS + ('+Inf',), values):
+				cumulative += count
+				lines.append('%s_bucket%s %d' % (name, _labels(labels, [('le', bound)]), cumulative))
+			lines.append('%s_sum%s %r' % (name, _labels(labels), values[-1]))
+			lines.append('%s_count%s %d' % (name, _labels(labels), cumulative))
+
+	return '\n'.join(lines) + '\n'
@@ -0,0 +1,308 @@
+import collections
+import gzip
+import math
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import patch_vary_headers
+
+from . import metrics
+from .responses import JsonResponse
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+
+def _accepted_encodings(header):
+	accepted = {}
+	for part in header.split(','):
+		coding, _, params = part.strip().partition(';')
+		quality = 1.0
+		params = params.strip()
+		if params.startswith('q='):
+			try:
+				quality = float(params[2:])
+			except ValueError:
+				quality = 0.0
+		if coding:
+			accepted[coding.strip().lower()] = quality
+	return accepted
+
+
+def _gzip_stream(chunks, level):
+	compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+	for chunk in chunks:
+		data = compressor.compress(chunk)
+		if data:
+			yield data
+	yield compressor.flush()
+
+
+def _brotli_stream(chunks, quality):
+	compressor = brotli.Compressor(quality=quality)
+	for chunk in chunks:
+		data = compressor.process(chunk)
+		if data:
+			yield data
+	yield compressor.finish()
+
+
+class MetricsMiddleware:
+	def __init__(self, get_response):
+		if not getattr(settings, 'METRICS_ENABLED', True):
+			raise MiddlewareNotUsed()
+		self.get_response = get_response
+
+	def __call__(self, request):
+		start = time.perf_counter()
+		response = self.get_response(request)
+		elapsed = time.perf_counter() - start
+
+		match = getattr(request, 'resolver_match', None)
+		view = (('view', match.url_name if match else 'unresolved'),)
+		metrics.observe('synchapi_view_seconds', view, elapsed)
+		metrics.inc('synchapi_view_responses_total', view + (('status', str(response.status_code)),))
+		return response
+
+
+class CompressionMiddleware:
+	def __init__(self, get_response):
+		self.get_response = get_response
+		self.min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 1024)
+		self.gzip_level = getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6)
+		self.brotli_quality = getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 5)
+
+	def _negotiate(self, request):
+		accepted = _accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+		if brotli is not None and accepted.get('br', 0) > 0:
+			return 'br'
+		if accepted.get('gzip', 0) > 0:
+			return 'gzip'
+		return None
+
+	def _compress(self, encoding, content):
+		if encoding == 'br':
+			return brotli.compress(content, quality=self.brotli_quality)
+		return gzip.compress(content, compresslevel=self.gzip_level, mtime=0)
+
+	def _compress_stream(self, encoding, chunks):
+		if encoding == 'br':
+			return _brotli_stream(chunks, self.brotli_quality)
+		return _gzip_stream(chunks, self.gzip_level)
+
+	def __call__(self, request):
+		response = self.get_response(request)
+
+		if response.has_header('Content-Encoding') or response.status_code == 304:
+			return response
+
+		if not response.streaming and len(response.content) < self.min_size:
+			return response
+
+		patch_vary_headers(response, ('Accept-Encoding',))
+
+		encoding = self._negotiate(request)
+		if not encoding:
+			return response
+
+		if response.streaming:
+			response.streaming_content = self._compress_stream(encoding, response.streaming_content)
+			del response['Content-Length']
+		else:
+			compressed = self._compress(encoding, response.content)
+			if len(compressed) >= len(response.content):
+				return response
+			response.content = compressed
+			response['Content-Length'] = str(len(compressed))
+
+		etag = response.get('ETag')
+		if etag and etag.startswith('"'):
+			response['ETag'] = 'W/' + etag
+
+		response['Content-Encoding'] = encoding
+		return response
+
+
+class RateLimitMiddleware:
+	# Sliding-window counters per (URL name, user or IP). Each request costs one
+	# atomic cache.incr; the previous window's final count never changes, so it
+	# is read from the cache once per window and then remembered locally.
+	def __init__(self, get_response):
+		self.limits = getattr(settings, 'RATE_LIMITS', None)
+		if not self.limits or not getattr(settings, 'RATE_LIMIT_ENABLED', True):
+			raise MiddlewareNotUsed()
+		self.get_response = get_response
+		self.trust_forwarded = getattr(settings, 'RATE_LIMIT_TRUST_X_FORWARDED_FOR', False)
+		self.previous = {}
+
+	def __call__(self, request):
+		return self.get_response(request)
+
+	def _client(self, request):
+		user = request.session.get('user') if hasattr(request, 'session') else None
+		if user:
+			return 'u%d' % user
+		forwarded = request.META.get('HTTP_X_FORWARDED_FOR') if self.trust_forwarded else None
+		return 'ip' + (forwarded.split(',')[0].strip() if forwarded else request.META.get('REMOTE_ADDR', ''))
+
+	def _increment(self, key, timeout, cost):
+		try:
+			return cache.incr(key, cost)
+		except ValueError:
+			if cache.add(key, cost, timeout):
+				return cost
+			return cache.incr(key, cost)
+
+	def _previous_count(self, key, window_index):
+		cached = self.previous.get(key)
+		if cached is None or cached[0] != window_index:
+			if len(self.previous) > 10000:
+				self.previous.clear()
+			cached = (window_index, cache.get(key, 0))
+			self.previous[key] = cached
+		return cached[1]
+
+	def process_view(self, request, view_func, view_args, view_kwargs):
+		match = request.resolver_match
+		limit = self.limits.get(match.url_name) if match else None
+		if not limit:
+			return None
+
+		requests, window = limit
+		now = time.time()
+		window_index = int(now // window)
+		elapsed = now - window_index * window
+		prefix = 'synchapi:ratelimit:%s:%s:' % (match.url_name, self._client(request))
+
+		# Views may weigh a request by the upstream work it causes
+		cost = getattr(view_func, 'rate_limit_cost', None)
+		cost = cost(request, **view_kwargs) if cost else 1
+
+		current = self._increment(prefix + str(window_index), window * 2, cost)
+		if current <= requests:
+			previous = self._previous_count(prefix + str(window_index - 1), window_index)
+			weight = 1 - elapsed / window
+			if current + previous * weight <= requests:
+				return None
+
+		response = JsonResponse({'error': 'Rate limit exceeded'}, status=429)
+		response['Retry-After'] = str(max(1, math.ceil(window - elapsed)))
+		return response
+
+
+# Innermost matching frame decides a sample's phase
+_PROFILE_PHASES = (
+	('spotify', ('synchapi.apikeys', 'spotipy', 'requests', 'urllib3', 'http.client', 'ssl', 'socket')),
+	('db', ('synchapi.db', 'django.db', 'MySQLdb')),
+	('serialization', ('synchapi.responses', 'json', 'orjson')),
+)
+
+
+def _frame_name(frame):
+	return '%s:%s' % (frame.f_globals.get('__name__', '?'), frame.f_code.co_name)
+
+
+def _phase(names):
+	for name in reversed(names):
+		module = name.split(':', 1)[0]
+		for phase, prefixes in _PROFILE_PHASES:
+			if module.startswith(prefixes):
+				return phase
+	return 'app'
+
+
+class _StackSampler(threading.Thread):
+	def __init__(self, thread_id, interval):
+		super().__init__(daemon=True)
+		self.thread_id = thread_id
+		self.interval = interval
+		self.stacks = collections.Counter()
+		self.stopped = threading.Event()
+
+	def run(self):
+		while not self.stopped.wait(self.interval):
+			frame = sys._current_frames().get(self.thread_id)
+			names = []
+			while frame is not None:
+				names.append(_frame_name(frame))
+				frame = frame.f_back
+			if names:
+				names.reverse()
+				self.stacks[(_phase(names),) + tuple(names)] += 1
+
+	def stop(self):
+		self.stopped.set()
+		self.join()
+
+
+class ProfilingMiddleware:
+	# Samples the request thread's stack every PROFILING_INTERVAL seconds and
+	# writes collapsed stacks ("phase;frame;frame count") for flamegraph.pl or
+	# speedscope. Requests are picked by PROFILING_SAMPLE_RATE, PROFILING_USERS
+	# or a header signed with `manage.py profile_header`.
+	HEADER = 'HTTP_X_SYNCHRIFY_PROFILE'
+	SALT = 'synchapi.profile'
+
+	def __init__(self, get_response):
+		if not getattr(settings, 'PROFILING_ENABLED', False):
+			raise MiddlewareNotUsed()
+		self.get_response = get_response
+		self.sample_rate = settings.PROFILING_SAMPLE_RATE
+		self.users = set(settings.PROFILING_USERS)
+		self.interval = settings.PROFILING_INTERVAL
+		self.directory = settings.PROFILING_DIR
+		os.makedirs(self.directory, exist_ok=True)
+
+	def _wanted(self, request):
+		header = request.META.get(self.HEADER)
+		if header:
+			try:
+				signing.TimestampSigner(salt=self.SALT).unsign(header, max_age=settings.PROFILING_HEADER_MAX_AGE)
+				return True
+			except signing.BadSignature:
+				pass
+		if self.users and request.session.get('user') in self.users:
+			return True
+		return random.random() < self.sample_rate
+
+	def __call__(self, request):
+		if not self._wanted(request):
+			return self.get_response(request)
+
+		sampler = _StackSampler(threading.get_ident(), self.interval)
+		sampler.start()
+		start = time.perf_counter()
+		try:
+			response = self.get_response(request)
+		finally:
+			sampler.stop()
+		elapsed = time.perf_counter() - start
+
+		match = getattr(request, 'resolver_match', None)
+		path = os.path.join(self.directory, '%s-%d-%d.collapsed' % (
+			match.url_name if match else 'unresolved', int(time.time() * 1000), os.getpid()
+		))
+		with open(path, 'w') as f:
+			for stack, count in sampler.stacks.most_common():
+				f.write('%s %d\n' % (';'.join(stack), count))
+
+		phases = collections.Counter()
+		for stack, count in sampler.stacks.items():
+			phases[stack[0]] += count
+		total = sum(phases.values()) or 1
+		response['X-Synchrify-Profile'] = os.path.basename(path)
+		response['X-Synchrify-Profile-Phases'] = ', '.join(
+			'%s=%.1fms' % (phase, elapsed * 1000 * phases[phase] / total)
+			for phase in ('db', 'spotify', 'serialization', 'app')
+		)
+		return response
@@ -0,0 +1,41 @@
+from django.db import connection, migrations
+
+
+# Reverse-edge probes (friender = f.friendee AND friendee = f.friender) and
+# "who has friended me" lookups.
+create_friends_reverse_index_sql = """
+	CREATE INDEX friends_friendee_friender
+	ON synchrify_friends (friendee, friender)
+"""
+
+# Content-centric rating reads. Includes the rating so they never touch the
+# clustered rows; user-centric reads are already covered by PRIMARY KEY
+# (user, content), which InnoDB clusters the whole row on.
+create_ratings_content_index_sql = """
+	CREATE INDEX ratings_content_user_rating
+	ON synchrify_ratings (content, user, rating)
+"""
+
+
+def _execute(query):
+	with connection.cursor() as cursor:
+		cursor.execute(query)
+
+
+def create_friends_reverse_index(apps, schema_editor):
+	_execute(create_friends_reverse_index_sql)
+
+
+def create_ratings_content_index(apps, schema_editor):
+	_execute(create_ratings_content_index_sql)
+
+
+class Migration(migrations.Migration):
+	dependencies = [
+		('synchapi', '0001_initial'),
+	]
+
+	operations = [
+		migrations.RunPython(create_friends_reverse_index),
+		migrations.RunPython(create_ratings_content_index),
+	]
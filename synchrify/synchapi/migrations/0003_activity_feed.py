@@ -0,0 +1,70 @@
+from django.db import connection, migrations
+
+
+add_rated_at_sql = """
+	ALTER TABLE synchrify_ratings
+	ADD COLUMN rated_at INTEGER NOT NULL DEFAULT 0,
+	ADD INDEX ratings_user_rated_at (user, rated_at)
+"""
+
+backfill_rated_at_sql = """
+	UPDATE synchrify_ratings SET rated_at = UNIX_TIMESTAMP()
+	WHERE rated_at = 0
+"""
+
+create_timeline_sql = """
+	CREATE TABLE synchrify_timeline (
+		owner INTEGER NOT NULL,
+		friend INTEGER NOT NULL,
+		content INTEGER NOT NULL,
+		rating TINYINT UNSIGNED NOT NULL,
+		rated_at INTEGER NOT NULL,
+		PRIMARY KEY (owner, friend, content),
+		KEY timeline_owner_rated_at (owner, rated_at, friend, content),
+		KEY timeline_friend_content (friend, content),
+		FOREIGN KEY (owner)
+			REFERENCES synchrify_users(id)
+				ON DELETE CASCADE,
+		FOREIGN KEY (friend)
+			REFERENCES synchrify_users(id)
+				ON DELETE CASCADE,
+		FOREIGN KEY (content)
+			REFERENCES synchrify_spotify_content(id)
+				ON DELETE CASCADE
+	)
+"""
+
+backfill_timeline_sql = """
+	INSERT IGNORE INTO synchrify_timeline (owner, friend, content, rating, rated_at)
+	SELECT f.friender, r.user, r.content, r.rating, r.rated_at FROM synchrify_friends f
+	INNER JOIN synchrify_friends b
+	ON b.friender = f.friendee AND b.friendee = f.friender
+	INNER JOIN synchrify_ratings r
+	ON r.user = f.friendee
+"""
+
+
+def _execute(query):
+	with connection.cursor() as cursor:
+		cursor.execute(query)
+
+
+def add_rated_at(apps, schema_editor):
+	_execute(add_rated_at_sql)
+	_execute(backfill_rated_at_sql)
+
+
+def create_timeline(apps, schema_editor):
+	_execute(create_timeline_sql)
+	_execute(backfill_timeline_sql)
+
+
+class Migration(migrations.Migration):
+	dependencies = [
+		('synchapi', '0002_indexes'),
+	]
+
+	operations = [
+		migrations.RunPython(add_rated_at),
+		migrations.RunPython(create_timeline),
+	]
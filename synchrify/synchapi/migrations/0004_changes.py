@@ -0,0 +1,40 @@
+from django.db import connection, migrations
+
+
+create_changes_sql = """
+	CREATE TABLE synchrify_changes (
+		id BIGINT PRIMARY KEY AUTO_INCREMENT,
+		user INTEGER NOT NULL,
+		kind CHAR(16) NOT NULL,
+		op CHAR(6) NOT NULL,
+		subject INTEGER,
+		content INTEGER,
+		rating TINYINT UNSIGNED,
+		changed_at INTEGER NOT NULL,
+		KEY changes_user_id (user, id),
+		FOREIGN KEY (user)
+			REFERENCES synchrify_users(id)
+				ON DELETE CASCADE,
+		CHECK (kind in ('friends', 'pending', 'ratings', 'friend_ratings')),
+		CHECK (op in ('set', 'delete'))
+	)
+"""
+
+
+def _execute(query):
+	with connection.cursor() as cursor:
+		cursor.execute(query)
+
+
+def create_changes(apps, schema_editor):
+	_execute(create_changes_sql)
+
+
+class Migration(migrations.Migration):
+	dependencies = [
+		('synchapi', '0003_activity_feed'),
+	]
+
+	operations = [
+		migrations.RunPython(create_changes),
+	]
@@ -0,0 +1,30 @@
+from django.db import connection, migrations
+
+
+# InnoDB maintains FULLTEXT indexes on commit, so every insert_content upsert
+# is searchable immediately. The B-tree index serves short LIKE 'prefix%'
+# lookups that fall under innodb_ft_min_token_size.
+add_content_name_indexes_sql = """
+	ALTER TABLE synchrify_spotify_content
+	ADD FULLTEXT INDEX content_name_fulltext (name),
+	ADD INDEX content_name (name)
+"""
+
+
+def _execute(query):
+	with connection.cursor() as cursor:
+		cursor.execute(query)
+
+
+def add_content_name_indexes(apps, schema_editor):
+	_execute(add_content_name_indexes_sql)
+
+
+class Migration(migrations.Migration):
+	dependencies = [
+		('synchapi', '0004_changes'),
+	]
+
+	operations = [
+		migrations.RunPython(add_content_name_indexes),
+	]
@@ -0,0 +1,42 @@
+from django.db import connection, migrations
+
+
+# Existing rows keep fetched_at = 0 so the first refresh pass revisits them
+add_fetched_at_sql = """
+	ALTER TABLE synchrify_spotify_content
+	ADD COLUMN fetched_at INTEGER NOT NULL DEFAULT 0,
+	ADD INDEX content_fetched_at (fetched_at, id)
+"""
+
+create_checkpoints_sql = """
+	CREATE TABLE synchrify_checkpoints (
+		name VARCHAR(64) NOT NULL,
+		position VARCHAR(255),
+		updated_at INTEGER NOT NULL,
+		PRIMARY KEY (name)
+	)
+"""
+
+
+def _execute(query):
+	with connection.cursor() as cursor:
+		cursor.execute(query)
+
+
+def add_fetched_at(apps, schema_editor):
+	_execute(add_fetched_at_sql)
+
+
+def create_checkpoints(apps, schema_editor):
+	_execute(create_checkpoints_sql)
+
+
+class Migration(migrations.Migration):
+	dependencies = [
+		('synchapi', '0005_content_search'),
+	]
+
+	operations = [
+		migrations.RunPython(add_fetched_at),
+		migrations.RunPython(create_checkpoints),
+	]
@@ -0,0 +1,28 @@
+from django.db import connection, migrations
+
+
+# Room for "pbkdf2_sha256$<iterations>$<salt>$<digest>"; legacy values are
+# rehashed the next time their owner logs in
+widen_password_sql = """
+	ALTER TABLE synchrify_users
+	MODIFY password VARCHAR(128) NOT NULL
+"""
+
+
+def _execute(query):
+	with connection.cursor() as cursor:
+		cursor.execute(query)
+
+
+def widen_password(apps, schema_editor):
+	_execute(widen_password_sql)
+
+
+class Migration(migrations.Migration):
+	dependencies = [
+		('synchapi', '0006_content_refresh'),
+	]
+
+	operations = [
+		migrations.RunPython(widen_password),
+	]
@@ -0,0 +1,38 @@
+from django.db import connection, migrations
+
+
+# One narrow row per play, clustered by (user, played_at) so history ranges
+# and each user's ingestion cursor (MAX(played_at)) are primary key reads
+create_plays_sql = """
+	CREATE TABLE synchrify_plays (
+		user INTEGER NOT NULL,
+		content INTEGER NOT NULL,
+		played_at INTEGER NOT NULL,
+		PRIMARY KEY (user, played_at),
+		FOREIGN KEY (user)
+			REFERENCES synchrify_users(id)
+				ON DELETE CASCADE,
+		FOREIGN KEY (content)
+			REFERENCES synchrify_spotify_content(id)
+				ON DELETE CASCADE
+	)
+"""
+
+
+def _execute(query):
+	with connection.cursor() as cursor:
+		cursor.execute(query)
+
+
+def create_plays(apps, schema_editor):
+	_execute(create_plays_sql)
+
+
+class Migration(migrations.Migration):
+	dependencies = [
+		('synchapi', '0007_password_hashes'),
+	]
+
+	operations = [
+		migrations.RunPython(create_plays),
+	]
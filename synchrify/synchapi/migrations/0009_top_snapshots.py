@@ -0,0 +1,39 @@
+from django.db import connection, migrations
+
+
+# items holds the snapshot's content ids as a sorted little-endian uint32
+# array, so a friend comparison reads one short blob per friend
+create_top_snapshots_sql = """
+	CREATE TABLE synchrify_top_snapshots (
+		user INTEGER NOT NULL,
+		kind CHAR(7) NOT NULL,
+		timespan CHAR(11) NOT NULL,
+		items BLOB NOT NULL,
+		taken_at INTEGER NOT NULL,
+		PRIMARY KEY (kind, timespan, user),
+		FOREIGN KEY (user)
+			REFERENCES synchrify_users(id)
+				ON DELETE CASCADE,
+		CHECK (kind in ('tracks', 'artists')),
+		CHECK (timespan in ('short_term', 'medium_term', 'long_term'))
+	)
+"""
+
+
+def _execute(query):
+	with connection.cursor() as cursor:
+		cursor.execute(query)
+
+
+def create_top_snapshots(apps, schema_editor):
+	_execute(create_top_snapshots_sql)
+
+
+class Migration(migrations.Migration):
+	dependencies = [
+		('synchapi', '0008_listening_history'),
+	]
+
+	operations = [
+		migrations.RunPython(create_top_snapshots),
+	]
@@ -0,0 +1,41 @@
+from django.db import connection, migrations
+
+
+# One row per high rating per bucket width (span seconds), keyed by the rater.
+# Rows are rewritten when the rating changes and dropped once their bucket
+# falls out of the longest window, so each user's range stays short.
+create_trending_sql = """
+	CREATE TABLE synchrify_trending (
+		user INTEGER NOT NULL,
+		span INTEGER NOT NULL,
+		bucket INTEGER NOT NULL,
+		content INTEGER NOT NULL,
+		score TINYINT UNSIGNED NOT NULL,
+		PRIMARY KEY (user, span, bucket, content),
+		FOREIGN KEY (user)
+			REFERENCES synchrify_users(id)
+				ON DELETE CASCADE,
+		FOREIGN KEY (content)
+			REFERENCES synchrify_spotify_content(id)
+				ON DELETE CASCADE
+	)
+"""
+
+
+def _execute(query):
+	with connection.cursor() as cursor:
+		cursor.execute(query)
+
+
+def create_trending(apps, schema_editor):
+	_execute(create_trending_sql)
+
+
+class Migration(migrations.Migration):
+	dependencies = [
+		('synchapi', '0009_top_snapshots'),
+	]
+
+	operations = [
+		migrations.RunPython(create_trending),
+	]
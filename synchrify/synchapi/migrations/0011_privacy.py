@@ -0,0 +1,36 @@
+from django.db import connection, migrations
+
+
+# Levels: 0 public, 1 friends, 2 friends of friends, 3 private. Users without
+# a row get friends-only for both, which is what every endpoint enforced before.
+create_privacy_sql = """
+	CREATE TABLE synchrify_privacy (
+		user INTEGER PRIMARY KEY,
+		friends TINYINT UNSIGNED NOT NULL,
+		ratings TINYINT UNSIGNED NOT NULL,
+		FOREIGN KEY (user)
+			REFERENCES synchrify_users(id)
+				ON DELETE CASCADE,
+		CHECK (friends <= 3),
+		CHECK (ratings <= 3)
+	)
+"""
+
+
+def _execute(query):
+	with connection.cursor() as cursor:
+		cursor.execute(query)
+
+
+def create_privacy(apps, schema_editor):
+	_execute(create_privacy_sql)
+
+
+class Migration(migrations.Migration):
+	dependencies = [
+		('synchapi', '0010_trending'),
+	]
+
+	operations = [
+		migrations.RunPython(create_privacy),
+	]
@@ -0,0 +1,55 @@
+import base64
+import hashlib
+import hmac
+import secrets
+
+from django.conf import settings
+
+
+ALGORITHM = 'pbkdf2_sha256'
+SALT_BYTES = 16
+
+
+def _derive(password, salt, iterations):
+	digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('ascii'), iterations)
+	return base64.b64encode(digest).decode('ascii')
+
+
+def _split(encoded):
+	# Rows written before hashing was introduced hold the client's value verbatim
+	parts = encoded.split('$')
+	if len(parts) != 4 or parts[0] != ALGORITHM:
+		return None
+	algorithm, iterations, salt, digest = parts
+	return int(iterations), salt, digest
+
+
+def make_password(password, iterations=None):
+	iterations = iterations or settings.PASSWORD_ITERATIONS
+	salt = secrets.token_urlsafe(SALT_BYTES)
+	return '%s$%d$%s$%s' % (ALGORITHM, iterations, salt, _derive(password, salt, iterations))
+
+
+# Derived once per process, so unknown emails cost as much as wrong passwords
+_dummy = None
+
+
+def check_password(password, encoded):
+	global _dummy
+	if encoded is None:
+		if _dummy is None:
+			_dummy = make_password(secrets.token_urlsafe(SALT_BYTES))
+		encoded = _dummy
+		password = ''
+
+	parts = _split(encoded)
+	if parts is None:
+		return hmac.compare_digest(password.encode('utf-8'), encoded.encode('utf-8'))
+
+	iterations, salt, digest = parts
+	return hmac.compare_digest(_derive(password, salt, iterations), digest)
+
+
+def needs_rehash(encoded):
+	parts = _split(encoded)
+	return parts is None or parts[0] != settings.PASSWORD_ITERATIONS
@@ -0,0 +1,126 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import db, graph, versions
+
+
+PUBLIC, FRIENDS, FRIENDS_OF_FRIENDS, PRIVATE = range(4)
+LEVELS = ['public', 'friends', 'friends_of_friends', 'private']
+FIELDS = ['friends', 'ratings']
+DEFAULTS = (FRIENDS, FRIENDS)
+SETTINGS_TTL = 3600
+
+# Precomputed per worker, so a check is a few dict lookups:
+#   _levels: user -> (levels, checked at)
+#   _relations: viewer -> (friends version, friends, friends of friends who
+#   are not friends, checked at)
+# Entries younger than PRIVACY_RECHECK_INTERVAL are used as they are; older
+# ones are revalidated against the cache, where settings changes land at once
+# and every friendship change touching a viewer or their friends moves the
+# viewer's 'friends' version. A per-process cache (locmem) sees neither, so
+# there levels are reread from the database and relations rebuilt instead.
+_levels = {}
+_relations = {}
+
+
+def _key(user):
+	return 'synchapi:privacy:%d' % user
+
+
+def _settings_ttl():
+	# A per-process cache cannot carry another worker's update, so there it only
+	# holds a value as long as the local memo would anyway
+	return SETTINGS_TTL if versions.shared_cache() else settings.PRIVACY_RECHECK_INTERVAL
+
+
+def _remember(memo, key, value):
+	if len(memo) >= settings.PRIVACY_CACHE_SIZE:
+		memo.clear()
+	memo[key] = value
+
+
+def get(user):
+	now = time.monotonic()
+	entry = _levels.get(user)
+	if entry is not None and now - entry[1] < settings.PRIVACY_RECHECK_INTERVAL:
+		return entry[0]
+
+	levels = cache.get(_key(user))
+	if levels is None:
+		levels = tuple(db.get_privacy(user) or DEFAULTS)
+		cache.set(_key(user), levels, _settings_ttl())
+	_remember(_levels, user, (levels, now))
+	return levels
+
+
+def get_many(users):
+	now = time.monotonic()
+	levels, stale = {}, []
+	for user in users:
+		entry = _levels.get(user)
+		if entry is not None and now - entry[1] < settings.PRIVACY_RECHECK_INTERVAL:
+			levels[user] = entry[0]
+		else:
+			stale.append(user)
+
+	if stale:
+		keys = {_key(user): user for user in stale}
+		fetched = {keys[key]: value for key, value in cache.get_many(keys).items()}
+		missing = [user for user in stale if user not in fetched]
+		if missing:
+			stored = db.get_privacy_many(missing)
+			loaded = {user: tuple(stored.get(user, DEFAULTS)) for user in missing}
+			cache.set_many({_key(user): value for user, value in loaded.items()}, _settings_ttl())
+			fetched.update(loaded)
+		for user, value in fetched.items():
+			_remember(_levels, user, (value, now))
+		levels.update(fetched)
+	return levels
+
+
+def update(user, field, level):
+	levels = list(get(user))
+	levels[FIELDS.index(field)] = level
+	levels = tuple(levels)
+	db.set_privacy(user, *levels)
+	cache.set(_key(user), levels, _settings_ttl())
+	_remember(_levels, user, (levels, time.monotonic()))
+
+
+def _relations_of(viewer):
+	now = time.monotonic()
+	entry = _relations.get(viewer)
+	if entry is not None and now - entry[3] < settings.PRIVACY_RECHECK_INTERVAL:
+		return entry
+
+	version = graph.friends_version(viewer)
+	# Another worker's friendship change only moves the version in a shared cache
+	if entry is not None and entry[0] == version and versions.shared_cache():
+		entry = entry[:3] + (now,)
+	else:
+		friends = frozenset(graph.friends(viewer))
+		entry = (version, friends, frozenset(graph.friends_of_friends(viewer)) - friends, now)
+	_remember(_relations, viewer, entry)
+	return entry
+
+
+def can_view(viewer, target, field):
+	if viewer == target:
+		return True
+
+	level = get(target)[FIELDS.index(field)]
+	if level == PUBLIC:
+		return True
+	if level == PRIVATE:
+		return False
+
+	_, friends, friends_of_friends, _ = _relations_of(viewer)
+	return target in friends or (level == FRIENDS_OF_FRIENDS and target in friends_of_friends)
+
+
+def hidden_from_friends(friends, field):
+	# Of the viewer's friends, those who keep field private; every other level includes friends
+	index = FIELDS.index(field)
+	return {friend for friend, levels in get_many(friends).items() if levels[index] == PRIVATE}
@@ -0,0 +1,304 @@
+import atexit
+import fcntl
+import glob
+import itertools
+import logging
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+
+from . import metrics, versions
+
+
+logger = logging.getLogger(__name__)
+
+# Updates to the same (user, content) between flushes collapse into one write.
+# Each update is appended to this process's journal, which it keeps flock()ed,
+# before it is acknowledged; a journal whose lock is free belonged to a process
+# that died and is replayed by recover(). Flushes write a batch with a fixed
+# number of statements (db.write_ratings), and an update is only written if the
+# rating has not been set or reset more recently since, so a late replay cannot
+# undo a newer change. Reads see pending values through a per-user overlay in
+# the cache until the flush that wrote them; the overlay must be shared by every
+# worker, and as concurrent puts for one user from two workers can race on it,
+# it only narrows the window until the next flush.
+OVERLAY_TTL = 300
+WRITE_CHUNK = 1000  # updates written per batch of statements
+
+_lock = threading.Lock()
+_pending = {}  # (user, content) -> (rating or None for a reset, time it was acknowledged)
+_enabled = None
+_journal = None
+_journal_id = None
+_rotations = itertools.count()
+_wake = threading.Event()
+_flusher = None
+
+
+def _after_fork():
+	# The child must not share the parent's journal, or its lock would outlive the parent
+	global _lock, _journal, _journal_id, _wake, _flusher
+	if _journal is not None:
+		_journal.close()
+	_lock = threading.Lock()
+	_pending.clear()
+	_journal = None
+	_journal_id = None
+	_wake = threading.Event()
+	_flusher = None
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def enabled():
+	global _enabled
+	if _enabled is None:
+		_enabled = settings.RATING_BUFFER_ENABLED
+		if _enabled and not versions.shared_cache():
+			logger.error('The rating buffer needs a cache shared by all workers; writing ratings directly')
+			_enabled = False
+	return _enabled
+
+
+def _journal_path():
+	# Unique per process rather than just its pid: a new process can be handed a
+	# dead one's pid, and must not append to (or rotate over) its orphaned journals
+	global _journal_id
+	if _journal_id is None:
+		_journal_id = '%d-%s' % (os.getpid(), uuid.uuid4().hex[:12])
+	return os.path.join(settings.RATING_BUFFER_DIR, 'ratings-%s.journal' % _journal_id)
+
+
+def _open_journal():
+	global _journal
+	if _journal is None:
+		os.makedirs(settings.RATING_BUFFER_DIR, exist_ok=True)
+		_journal = open(_journal_path(), 'a')
+		fcntl.flock(_journal, fcntl.LOCK_EX)
+	return _journal
+
+
+def _append(updates):
+	journal = _open_journal()
+	journal.write(''.join(
+		'%d %d %s %d\n' % (user, content, '-' if rating is None else rating, at)
+		for (user, content), (rating, at) in updates
+	))
+	journal.flush()
+	if settings.RATING_BUFFER_FSYNC:
+		os.fsync(journal.fileno())
+
+
+def _parse(lines):
+	updates = {}
+	for line in lines:
+		parts = line.split()
+		# A torn final line from a crash mid-write was never acknowledged
+		if line.endswith('\n') and len(parts) == 4:
+			updates[int(parts[0]), int(parts[1])] = (None if parts[2] == '-' else int(parts[2]), int(parts[3]))
+	return updates
+
+
+def _overlay_key(user):
+	return 'synchapi:rating-overlay:%d' % user
+
+
+def overlay(user):
+	# content -> pending rating (None for a reset) for ratings not yet written
+	if not enabled():
+		return None
+	return cache.get(_overlay_key(user))
+
+
+def put(user, content, rating):
+	update = (rating, int(time.time()))
+	with _lock:
+		_append([((user, content), update)])
+		_pending[user, content] = update
+		full = len(_pending) >= settings.RATING_BUFFER_MAX
+
+		key = _overlay_key(user)
+		pending = cache.get(key) or {}
+		pending[content] = rating
+		cache.set(key, pending, OVERLAY_TTL)
+
+	versions.bump('ratings', [user])
+	metrics.inc('synchapi_rating_buffer_total', (('event', 'buffered'),))
+	_start_flusher()
+	if full:
+		_wake.set()
+
+
+def _split(items):
+	sets = [(user, content, rating, at) for (user, content), (rating, at) in items if rating is not None]
+	deletes = [key for key, (rating, _) in items if rating is None]
+	return sets, deletes
+
+
+def _write_each(db, items):
+	written = 0
+	for key, (rating, at) in items:
+		try:
+			with transaction.atomic():
+				db.write_ratings(*_split([(key, (rating, at))]))
+			written += 1
+		except IntegrityError:
+			# The user or content was deleted while the update was pending
+			logger.warning('Dropping buffered rating %r for user %d, content %d', rating, *key)
+	return written
+
+
+def _write(updates):
+	from . import db
+
+	written = superseded = 0
+	with transaction.atomic():
+		items = sorted(updates.items())
+		for start in range(0, len(items), WRITE_CHUNK):
+			chunk = items[start:start + WRITE_CHUNK]
+			latest = db.get_rated_at([key for key, _ in chunk])
+			# Rated or reset again since, through another worker or after this was journaled
+			fresh = [(key, (rating, at)) for key, (rating, at) in chunk if latest.get(key, at) <= at]
+			superseded += len(chunk) - len(fresh)
+			try:
+				with transaction.atomic():
+					db.write_ratings(*_split(fresh))
+				written += len(fresh)
+			except IntegrityError:
+				written += _write_each(db, fresh)
+	metrics.inc('synchapi_rating_buffer_total', (('event', 'written'),), written)
+	metrics.inc('synchapi_rating_buffer_total', (('event', 'superseded'),), superseded)
+	return written
+
+
+def _clear_overlay(updates):
+	by_user = {}
+	for (user, content), (rating, _) in updates.items():
+		by_user.setdefault(user, {})[content] = rating
+
+	with _lock:
+		for user, written in by_user.items():
+			key = _overlay_key(user)
+			pending = cache.get(key)
+			if not pending:
+				continue
+			# Entries changed again since this flush started stay pending
+			for content, rating in written.items():
+				if content in pending and pending[content] == rating:
+					del pending[content]
+			if pending:
+				cache.set(key, pending, OVERLAY_TTL)
+			else:
+				cache.delete(key)
+
+
+def flush():
+	global _journal
+	with _lock:
+		if not _pending:
+			return 0
+		updates = dict(_pending)
+		_pending.clear()
+		# The batch's journal moves aside, still locked, until the batch is written
+		flushing = _journal
+		flushing_path = '%s.%d.flushing' % (_journal_path(), next(_rotations))
+		os.rename(_journal_path(), flushing_path)
+		_journal = None
+
+	try:
+		written = _write(updates)
+	except Exception:
+		logger.exception('Flushing %d buffered ratings failed; retrying on the next flush', len(updates))
+		with _lock:
+			retry = [(key, update) for key, update in updates.items() if key not in _pending]
+			_append(retry)
+			_pending.update(retry)
+		written = 0
+	else:
+		_clear_overlay(updates)
+
+	os.unlink(flushing_path)
+	flushing.close()
+	return written
+
+
+def _replay_order(path):
+	# A dead process's set-aside batches predate its live journal, in rotation order
+	name = os.path.basename(path).split('.')
+	return (name[0], 0, int(name[2])) if len(name) == 4 else (name[0], 1, 0)
+
+
+def recover():
+	# Replays journals whose lock is free, i.e. whose process has exited
+	orphans = []
+	try:
+		for path in sorted(glob.glob(os.path.join(settings.RATING_BUFFER_DIR, 'ratings-*.journal*')), key=_replay_order):
+			try:
+				journal = open(path)
+			except FileNotFoundError:
+				continue
+			try:
+				fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except BlockingIOError:
+				journal.close()
+				continue
+			# Another process replayed and removed it before we got the lock
+			if os.fstat(journal.fileno()).st_nlink == 0:
+				journal.close()
+				continue
+			orphans.append((path, journal))
+
+		updates = {}
+		for _, journal in orphans:
+			updates.update(_parse(journal))
+		replayed = _write(updates) if updates else 0
+		_clear_overlay(updates)
+
+		for path, _ in orphans:
+			os.unlink(path)
+		return replayed
+	finally:
+		for _, journal in orphans:
+			journal.close()
+
+
+def _run():
+	try:
+		recover()
+	except Exception:
+		logger.exception('Replaying rating journals failed')
+
+	while True:
+		_wake.wait(settings.RATING_BUFFER_INTERVAL)
+		_wake.clear()
+		try:
+			flush()
+		except Exception:
+			logger.exception('Flushing buffered ratings failed')
+		finally:
+			connection.close()
+
+
+def _start_flusher():
+	global _flusher
+	if _flusher is None:
+		with _lock:
+			if _flusher is None:
+				_flusher = threading.Thread(target=_run, name='synchapi-rating-buffer', daemon=True)
+				_flusher.start()
+
+
+@atexit.register
+def _flush_at_exit():
+	# Whatever misses this stays in the journal for the next process to replay
+	if _pending:
+		try:
+			flush()
+		except Exception:
+			logger.exception('Flushing buffered ratings at exit failed')
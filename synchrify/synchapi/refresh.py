@@ -0,0 +1,108 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import spotipy
+
+from . import apikeys, db, throttle
+
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT = 'content_refresh'
+
+# Most IDs accepted per request by Spotify's multi-ID endpoints; playlists have none
+CHUNK_SIZES = {'track': 50, 'album': 20, 'artist': 50, 'playlist': 1}
+
+
+def _fetch_names(client, bucket, content_type, uris):
+	bucket.acquire()
+	if content_type == 'track':
+		items = client.tracks(uris)['tracks']
+	elif content_type == 'album':
+		items = client.albums(uris)['albums']
+	elif content_type == 'artist':
+		items = client.artists(uris)['artists']
+	else:
+		items = [client.playlist(uris[0], fields='name')]
+
+	return {uri: item['name'] for uri, item in zip(uris, items) if item and 'name' in item}
+
+
+def _chunks(rows):
+	by_type = {}
+	for row in rows:
+		by_type.setdefault(row[1], []).append(row)
+
+	for content_type, typed in by_type.items():
+		size = CHUNK_SIZES.get(content_type, 1)
+		for start in range(0, len(typed), size):
+			yield content_type, typed[start:start + size]
+
+
+def _position(after):
+	return '%d.%d' % after
+
+
+def _parse_position(position):
+	return tuple(int(part) for part in position.split('.')) if position else (-1, 0)
+
+
+def refresh_stale(max_age, batch_size, workers, rate, max_batches=None):
+	bucket = throttle.TokenBucket(rate)
+	cutoff = int(time.time()) - max_age
+	after = _parse_position(db.get_checkpoint(CHECKPOINT))
+
+	stats = {'batches': 0, 'scanned': 0, 'changed': 0, 'failed': 0}
+	with ThreadPoolExecutor(workers) as pool:
+		while max_batches is None or stats['batches'] < max_batches:
+			rows = db.get_stale_content(cutoff, after, batch_size)
+			if not rows:
+				# The pass is complete; the next run starts from the oldest row again
+				db.set_checkpoint(CHECKPOINT, None)
+				break
+
+			# The app token lasts an hour; app_client reuses it until it is about to expire
+			client = apikeys.app_client()
+			chunks = list(_chunks(rows))
+			futures = [
+				pool.submit(_fetch_names, client, bucket, content_type, [row[2] for row in chunk])
+				for content_type, chunk in chunks
+			]
+
+			changed, unchanged = [], []
+			unauthorized = False
+			for (content_type, chunk), future in zip(chunks, futures):
+				try:
+					names = future.result()
+				except (spotipy.SpotifyException, requests.RequestException) as e:
+					# Left untouched, so they are retried on the next pass
+					logger.warning('Refreshing %d %s rows failed: %s', len(chunk), content_type, e)
+					stats['failed'] += len(chunk)
+					unauthorized = unauthorized or getattr(e, 'http_status', None) == 401
+					continue
+
+				for content, _, uri, name, _ in chunk:
+					new_name = names.get(uri)
+					if new_name is not None and new_name != name:
+						changed.append((content, content_type, uri, new_name))
+					else:
+						unchanged.append(content)
+
+			db.refresh_content(changed, unchanged, int(time.time()))
+			if unauthorized:
+				# Keep the checkpoint so the next run retries this batch rather than skipping it
+				logger.warning('Spotify rejected the app token; stopping before %s', _position(after))
+				break
+
+			last = rows[-1]
+			after = (last[4], last[0])
+			db.set_checkpoint(CHECKPOINT, _position(after))
+
+			stats['batches'] += 1
+			stats['scanned'] += len(rows)
+			stats['changed'] += len(changed)
+
+	return stats
+
@@ -0,0 +1,58 @@
+import json
+
+from django.http import HttpResponse
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+
+def dumps(data):
+	if orjson is not None:
+		return orjson.dumps(data)
+	return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+class JsonResponse(HttpResponse):
+	# Drop-in for django.http.JsonResponse that encodes with orjson when it is
+	# installed and emits compact stdlib JSON otherwise.
+	def __init__(self, data, **kwargs):
+		kwargs.setdefault('content_type', 'application/json')
+		super().__init__(content=dumps(data), **kwargs)
+
+
+class RawJsonResponse(HttpResponse):
+	def __init__(self, body, **kwargs):
+		kwargs.setdefault('content_type', 'application/json')
+		super().__init__(content=body or b'{}', **kwargs)
+
+
+def columns(names, rows):
+	return {'columns': names, 'rows': rows}
+
+
+def _field_tree(paths):
+	tree = {}
+	for path in paths:
+		node = tree
+		for key in path.split('.'):
+			if key:
+				node = node.setdefault(key, {})
+	return tree
+
+
+def _project(data, tree):
+	if not tree:
+		return data
+	if isinstance(data, list):
+		return [_project(item, tree) for item in data]
+	if isinstance(data, dict):
+		return {key: _project(data[key], subtree) for key, subtree in tree.items() if key in data}
+	return data
+
+
+def project(data, fields):
+	# fields=items.track.name,items.track.id keeps only those keys; lists are
+	# traversed transparently.
+	return _project(data, _field_tree(fields.split(',')))
@@ -0,0 +1,47 @@
+import math
+import re
+
+from . import db, graph
+
+
+MIN_TOKEN_SIZE = 3
+CANDIDATES = 200
+FRIEND_BOOST = 0.5
+
+_term_regex = re.compile(r'\w+', re.UNICODE)
+
+
+def _boolean_query(terms):
+	return ' '.join('+%s*' % term for term in terms)
+
+
+def search_content(user, query, content_type=None, limit=20):
+	terms = _term_regex.findall(query.lower())
+	if not terms:
+		return []
+
+	if all(len(term) < MIN_TOKEN_SIZE for term in terms):
+		candidates = db.search_content_prefix(query.strip(), content_type, CANDIDATES)
+	else:
+		candidates = db.search_content_fulltext(_boolean_query(terms), content_type, CANDIDATES)
+
+	if not candidates:
+		return []
+
+	friends = graph.friends(user)
+	friend_ratings = db.count_friend_ratings([row[0] for row in candidates], friends) if friends else {}
+
+	results = []
+	for content_id, content_type, uri, name, relevance in candidates:
+		count = friend_ratings.get(content_id, 0)
+		results.append({
+			'content_id': content_id,
+			'type': content_type,
+			'uri': uri,
+			'name': name,
+			'friend_ratings': count,
+			'score': round(float(relevance) * (1 + FRIEND_BOOST * math.log1p(count)), 4),
+		})
+
+	results.sort(key=lambda result: (-result['score'], result['content_id']))
+	return results[:limit]
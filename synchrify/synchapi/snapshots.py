@@ -0,0 +1,85 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import spotipy
+from django.db import connection
+
+from . import analytics, db, throttle
+from .apikeys import SpotifyUserAuth
+from .spotify_endpoints import TIME_RANGES
+
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT = 'top_snapshots'
+
+# Snapshot kind -> content type of its items
+KINDS = {'tracks': 'track', 'artists': 'artist'}
+SIZE = 50
+
+
+def _fetch_top(bucket, user, username, access_token, refresh_token, expires_at):
+	try:
+		client = SpotifyUserAuth(access_token, refresh_token, expires_at, user, username).client(user)
+	finally:
+		# Refreshing an expired token writes through this thread's connection
+		connection.close()
+
+	top = {}
+	for kind in KINDS:
+		fetch = client.current_user_top_tracks if kind == 'tracks' else client.current_user_top_artists
+		for timespan in TIME_RANGES:
+			bucket.acquire()
+			top[kind, timespan] = [
+				(item['id'], item.get('name')) for item in fetch(SIZE, 0, timespan).get('items') or [] if item.get('id')
+			]
+	return top
+
+
+def take(batch_size, workers, rate, max_batches=None):
+	bucket = throttle.TokenBucket(rate)
+	after = int(db.get_checkpoint(CHECKPOINT) or 0)
+
+	stats = {'batches': 0, 'users': 0, 'snapshots': 0, 'failed': 0}
+	with ThreadPoolExecutor(workers) as pool:
+		while max_batches is None or stats['batches'] < max_batches:
+			rows = db.get_spotify_auth_page(after, batch_size)
+			if not rows:
+				db.set_checkpoint(CHECKPOINT, None)
+				break
+
+			futures = [pool.submit(_fetch_top, bucket, *row) for row in rows]
+
+			fetched = []
+			for row, future in zip(rows, futures):
+				try:
+					fetched.append((row[0], future.result()))
+				except (spotipy.SpotifyException, requests.RequestException) as e:
+					# Their previous snapshots stay until the next pass
+					logger.warning('Fetching top items for user %d failed: %s', row[0], e)
+					stats['failed'] += 1
+
+			names = {kind: {} for kind in KINDS}
+			for _, top in fetched:
+				for (kind, _), items in top.items():
+					names[kind].update(items)
+			ids = {kind: db.intern_content(content_type, names[kind]) for kind, content_type in KINDS.items()}
+
+			taken_at = int(time.time())
+			snapshots = [
+				(user, kind, timespan, analytics.pack_ids([ids[kind][uri] for uri, _ in items if uri in ids[kind]]), taken_at)
+				for user, top in fetched
+				for (kind, timespan), items in top.items()
+			]
+			db.insert_top_snapshots(snapshots)
+
+			after = rows[-1][0]
+			db.set_checkpoint(CHECKPOINT, str(after))
+
+			stats['batches'] += 1
+			stats['users'] += len(rows)
+			stats['snapshots'] += len(snapshots)
+
+	return stats
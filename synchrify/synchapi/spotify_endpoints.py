@@ -0,0 +1,246 @@
+import hashlib
+
+from django.core.cache import cache
+
+from . import metrics, versions
+from .responses import dumps
+
+
+SPOTIFY_MARKET = 'US'
+
+TIME_RANGES = ['short_term', 'medium_term', 'long_term']
+SEARCH_TYPES = ['album', 'artist', 'playlist', 'track', 'show', 'episode']
+
+
+class Param:
+	def __init__(self, name, kind='str', required=False, default=None, minimum=None, maximum=None,
+			choices=None, max_items=None):
+		self.name = name
+		self.kind = kind
+		self.required = required
+		self.default = default
+		self.minimum = minimum
+		self.maximum = maximum
+		self.choices = choices
+		self.max_items = max_items
+
+	def parse(self, params):
+		raw = params.get(self.name)
+		if not raw:
+			if self.required:
+				raise ValueError("Field '%s' is required" % self.name)
+			return self.default
+
+		if self.kind == 'int':
+			try:
+				value = int(raw)
+			except ValueError:
+				raise ValueError("Field '%s' must be numeric" % self.name)
+			if (self.minimum is not None and value < self.minimum) or (self.maximum is not None and value > self.maximum):
+				raise ValueError("Field '%s' must be between %s and %s" % (self.name, self.minimum, self.maximum))
+			return value
+
+		if self.kind == 'list':
+			value = [item for item in raw.split(',') if item]
+			if self.max_items is not None and len(value) > self.max_items:
+				raise ValueError("Field '%s' takes at most %d items" % (self.name, self.max_items))
+			if self.choices and any(item not in self.choices for item in value):
+				raise ValueError("Field '%s' must be in %s" % (self.name, self.choices))
+			return value
+
+		if self.choices and raw not in self.choices:
+			raise ValueError("Field '%s' must be in %s" % (self.name, self.choices))
+		return raw
+
+
+def _limit(maximum=50):
+	return Param('limit', 'int', minimum=1, maximum=maximum)
+
+
+def _offset(maximum=100000):
+	return Param('offset', 'int', minimum=0, maximum=maximum)
+
+
+class Endpoint:
+	# call(client, username, args) performs the request. cache is (scope, seconds)
+	# where scope is 'user' or 'shared'; writes invalidate the user's cached reads.
+	# chunk is (param, size, result key): larger lists are split into several
+	# Spotify requests and the result lists merged. cost is what one Spotify
+	# request counts against RATE_LIMITS.
+	def __init__(self, call, params=(), needs_username=False, cache=None, writes=False, chunk=None, cost=1):
+		self.call = call
+		self.params = params
+		self.needs_username = needs_username
+		self.cache = cache
+		self.writes = writes
+		self.chunk = chunk
+		self.cost = cost
+
+	def parse(self, params):
+		return {param.name: param.parse(params) for param in self.params}
+
+	def chunks(self, args):
+		if not self.chunk:
+			return [args]
+		name, size, _ = self.chunk
+		items = args[name]
+		return [dict(args, **{name: items[start:start + size]}) for start in range(0, len(items), size)]
+
+	def requests(self, params):
+		# Number of Spotify requests a call makes, without validating anything
+		if not self.chunk:
+			return 1
+		raw = params.get(self.chunk[0]) or ''
+		return max(1, -(-len([item for item in raw.split(',') if item]) // self.chunk[1]))
+
+	def merge(self, results):
+		_, _, key = self.chunk
+		return {key: [item for result in results for item in result.get(key, [])]}
+
+	def cache_key(self, endpoint, user, args):
+		scope, _ = self.cache
+		digest = hashlib.sha1(dumps(sorted(args.items()))).hexdigest()
+		if scope == 'user':
+			return 'synchapi:spotify:%d:%s:%s:%s' % (user, versions.get('spotify', user), endpoint, digest)
+		return 'synchapi:spotify:shared:%s:%s' % (endpoint, digest)
+
+
+ENDPOINTS = {
+	'profile': Endpoint(
+		lambda client, username, args: client.current_user(),
+		cache=('user', 300),
+	),
+	'playing_track': Endpoint(
+		lambda client, username, args: client.currently_playing(SPOTIFY_MARKET),
+	),
+	'recent_tracks': Endpoint(
+		lambda client, username, args: client.current_user_recently_played(
+			args['limit'], after=args['after'], before=args['before']
+		),
+		[_limit(), Param('before', 'int', minimum=0), Param('after', 'int', minimum=0)],
+	),
+	'top_tracks': Endpoint(
+		lambda client, username, args: client.current_user_top_tracks(args['limit'], args['offset'], args['timespan']),
+		[_limit(), _offset(), Param('timespan', choices=TIME_RANGES, default='medium_term')],
+		cache=('user', 3600),
+	),
+	'followed_artists': Endpoint(
+		lambda client, username, args: client.current_user_followed_artists(args['limit'], args['after']),
+		[_limit(), Param('after')],
+		cache=('user', 300),
+	),
+	'playlists': Endpoint(
+		lambda client, username, args: client.current_user_playlists(args['limit'], args['offset']),
+		[_limit(), _offset()],
+		cache=('user', 60),
+	),
+	'saved_albums': Endpoint(
+		lambda client, username, args: client.current_user_saved_albums(args['limit'], args['offset']),
+		[_limit(), _offset()],
+		cache=('user', 60),
+	),
+	'saved_tracks': Endpoint(
+		lambda client, username, args: client.current_user_saved_tracks(args['limit'], args['offset']),
+		[_limit(), _offset()],
+		cache=('user', 60),
+	),
+
+	'search': Endpoint(
+		lambda client, username, args: client.search(
+			args['q'], args['limit'], args['offset'], ','.join(args['type']), SPOTIFY_MARKET
+		),
+		[Param('q', required=True), _limit(), _offset(1000), Param('type', 'list', choices=SEARCH_TYPES, default=['track'])],
+		cache=('shared', 300),
+	),
+	'user_playlists': Endpoint(
+		lambda client, username, args: client.user_playlists(args['user'], args['limit'], args['offset']),
+		[Param('user', required=True), _limit(), _offset()],
+		# Per caller: Spotify includes the owner's private playlists when the owner asks
+		cache=('user', 300),
+	),
+	'fetch_tracks': Endpoint(
+		lambda client, username, args: client.tracks(args['tracks'], SPOTIFY_MARKET),
+		[Param('tracks', 'list', required=True, max_items=500)],
+		cache=('shared', 3600),
+		chunk=('tracks', 50, 'tracks'),
+	),
+	'fetch_albums': Endpoint(
+		lambda client, username, args: client.albums(args['albums']),
+		[Param('albums', 'list', required=True, max_items=200)],
+		cache=('shared', 3600),
+		chunk=('albums', 20, 'albums'),
+	),
+	'fetch_artists': Endpoint(
+		lambda client, username, args: client.artists(args['artists']),
+		[Param('artists', 'list', required=True, max_items=500)],
+		cache=('shared', 3600),
+		chunk=('artists', 50, 'artists'),
+	),
+
+	'add_playlist_custom_image': Endpoint(
+		lambda client, username, args: client.playlist_upload_cover_image(args['playlist'], args['image']),
+		[Param('playlist', required=True), Param('image', required=True)],
+		writes=True,
+	),
+	'create_playlist': Endpoint(
+		lambda client, username, args: client.user_playlist_create(username, args['name'], description=args['description']),
+		[Param('name', required=True), Param('description', default='')],
+		needs_username=True,
+		writes=True,
+	),
+	'follow_playlist': Endpoint(
+		lambda client, username, args: client.user_playlist_follow_playlist(username, args['playlist']),
+		[Param('playlist', required=True)],
+		needs_username=True,
+		writes=True,
+	),
+	'is_following_playlist': Endpoint(
+		lambda client, username, args: client.user_playlist_is_following(username, args['playlist'], args['users']),
+		[Param('playlist', required=True), Param('users', 'list', required=True, max_items=5)],
+		needs_username=True,
+	),
+	'add_playlist_tracks': Endpoint(
+		lambda client, username, args: client.user_playlist_add_tracks(
+			username, args['playlist'], args['tracks'], args['position']
+		),
+		[Param('playlist', required=True), Param('tracks', 'list', required=True, max_items=100),
+			Param('position', 'int', minimum=0)],
+		needs_username=True,
+		writes=True,
+	),
+	'edit_playlist_details': Endpoint(
+		lambda client, username, args: client.user_playlist_change_details(
+			username, args['playlist'], args['name'], description=args['description']
+		),
+		[Param('playlist', required=True), Param('name'), Param('description')],
+		needs_username=True,
+		writes=True,
+	),
+}
+
+
+def request_cost(request, endpoint=None, **kwargs):
+	# Rate-limit cost of a spotify_wrapper call: Spotify requests it would make
+	spec = ENDPOINTS.get(endpoint)
+	if not spec:
+		return 1
+	return spec.cost * spec.requests(request.GET)
+
+
+def cached_body(spec, endpoint, user, args):
+	if not spec.cache:
+		return None, None
+	key = spec.cache_key(endpoint, user, args)
+	body = cache.get(key)
+	metrics.inc('synchapi_cache_requests_total', (('cache', 'spotify'), ('result', 'miss' if body is None else 'hit')))
+	return key, body
+
+
+def store_body(spec, key, body):
+	if key:
+		cache.set(key, body, spec.cache[1])
+
+
+def invalidate(spec, user):
+	if spec.writes:
+		versions.bump('spotify', [user])
@@ -0,0 +1,426 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+MARKETS = [
+	'AD', 'AE', 'AR', 'AT', 'AU', 'BE', 'BG', 'BH', 'BO', 'BR', 'CA', 'CH', 'CL', 'CO', 'CR', 'CY',
+	'CZ', 'DE', 'DK', 'DO', 'DZ', 'EC', 'EE', 'EG', 'ES', 'FI', 'FR', 'GB', 'GR', 'GT', 'HK', 'HN',
+	'HU', 'ID', 'IE', 'IL', 'IN', 'IS', 'IT', 'JO', 'JP', 'KW', 'LB', 'LI', 'LT', 'LU', 'LV', 'MA',
+	'MC', 'MT', 'MX', 'MY', 'NI', 'NL', 'NO', 'NZ', 'OM', 'PA', 'PE', 'PH', 'PL', 'PS', 'PT', 'PY',
+	'QA', 'RO', 'SA', 'SE', 'SG', 'SK', 'SV', 'TH', 'TN', 'TR', 'TW', 'US', 'UY', 'VN', 'ZA',
+]
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+TOP_POOL = 500  # distinct top items per kind and time range, shared by every user
+
+
+def _digest(*parts):
+	return hashlib.sha1(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def _spotify_id(*parts):
+	return _digest(*parts)[:22]
+
+
+def _pool_index(*parts):
+	return int(_digest(*parts), 16) % TOP_POOL
+
+
+def _image(seed):
+	return [{'url': 'https://i.scdn.co/image/' + _digest('image', seed)[:40], 'height': 640, 'width': 640}]
+
+
+def artist(artist_id):
+	return {
+		'id': artist_id,
+		'type': 'artist',
+		'uri': 'spotify:artist:' + artist_id,
+		'name': 'Artist ' + artist_id[:6],
+		'genres': ['genre-%s' % artist_id[0]],
+		'popularity': int(_digest(artist_id), 16) % 100,
+		'followers': {'href': None, 'total': int(_digest('followers', artist_id), 16) % 1000000},
+		'images': _image(artist_id),
+	}
+
+
+def _simple_artist(artist_id):
+	return {key: value for key, value in artist(artist_id).items() if key in ('id', 'type', 'uri', 'name')}
+
+
+def album(album_id):
+	artist_id = _spotify_id('album-artist', album_id)
+	return {
+		'id': album_id,
+		'type': 'album',
+		'album_type': 'album',
+		'uri': 'spotify:album:' + album_id,
+		'name': 'Album ' + album_id[:6],
+		'artists': [_simple_artist(artist_id)],
+		'available_markets': MARKETS,
+		'release_date': '20%02d-01-01' % (int(_digest(album_id), 16) % 20),
+		'total_tracks': 12,
+		'images': _image(album_id),
+	}
+
+
+def track(track_id):
+	album_id = _spotify_id('track-album', track_id)
+	return {
+		'id': track_id,
+		'type': 'track',
+		'uri': 'spotify:track:' + track_id,
+		'name': 'Track ' + track_id[:6],
+		'album': album(album_id),
+		'artists': album(album_id)['artists'],
+		'available_markets': MARKETS,
+		'duration_ms': 120000 + int(_digest('duration', track_id), 16) % 240000,
+		'explicit': False,
+		'popularity': int(_digest(track_id), 16) % 100,
+		'track_number': 1 + int(_digest('number', track_id), 16) % 12,
+	}
+
+
+def playlist(playlist_id, owner='stub-user'):
+	return {
+		'id': playlist_id,
+		'type': 'playlist',
+		'uri': 'spotify:playlist:' + playlist_id,
+		'name': 'Playlist ' + playlist_id[:6],
+		'description': '',
+		'owner': {'id': owner, 'type': 'user', 'uri': 'spotify:user:' + owner},
+		'public': True,
+		'collaborative': False,
+		'images': _image(playlist_id),
+		'snapshot_id': _digest('snapshot', playlist_id),
+		'tracks': {'href': None, 'total': 25},
+	}
+
+
+def user(user_id):
+	return {
+		'id': user_id,
+		'type': 'user',
+		'uri': 'spotify:user:' + user_id,
+		'display_name': 'User ' + user_id,
+		'country': 'US',
+		'product': 'premium',
+		'followers': {'href': None, 'total': 0},
+		'images': _image(user_id),
+	}
+
+
+def _page(request, make_item, total=100):
+	limit = min(int(request.query.get('limit') or DEFAULT_LIMIT), MAX_LIMIT)
+	offset = int(request.query.get('offset') or 0)
+	count = max(0, min(limit, total - offset))
+	return {
+		'href': request.path,
+		'items': [make_item(offset + n) for n in range(count)],
+		'limit': limit,
+		'offset': offset,
+		'total': total,
+		'next': None,
+		'previous': None,
+	}
+
+
+def _ids(request):
+	return [item for item in (request.query.get('ids') or '').split(',') if item]
+
+
+class _Request:
+	def __init__(self, method, path, query, token, match):
+		self.method = method
+		self.path = path
+		self.query = query
+		self.token = token
+		self.match = match
+
+	@property
+	def owner(self):
+		return 'stub-' + _digest('user', self.token)[:10]
+
+
+def _me(request):
+	return user(request.owner)
+
+
+def _currently_playing(request):
+	return {
+		'timestamp': int(time.time() * 1000),
+		'progress_ms': 30000,
+		'is_playing': True,
+		'currently_playing_type': 'track',
+		'item': track(_spotify_id('playing', request.owner)),
+	}
+
+
+def _recently_played(request):
+	# One play every three minutes on a fixed grid, so polls with an 'after'
+	# cursor see the same plays again and only the newer ones are new
+	interval = 180000
+	now = int(time.time() * 1000)
+	before = min(int(request.query.get('before') or now), now)
+	after = int(request.query.get('after') or 0)
+	limit = min(int(request.query.get('limit') or DEFAULT_LIMIT), MAX_LIMIT)
+	items = []
+	newest = played_at = (before - 1) // interval * interval
+	while len(items) < limit and played_at > after:
+		items.append({
+			'track': track(_spotify_id('recent', request.owner, played_at // 3600000, played_at // interval % 20)),
+			'played_at': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(played_at / 1000)),
+			'context': None,
+		})
+		played_at -= interval
+	return {
+		'items': items,
+		'limit': limit,
+		'cursors': {'after': str(newest), 'before': str(played_at + interval)} if items else None,
+		'next': None,
+	}
+
+
+def _top(kind):
+	def handler(request):
+		timespan = request.query.get('time_range') or 'medium_term'
+		make = track if kind == 'tracks' else artist
+		return _page(
+			request,
+			lambda n: make(_spotify_id('top', kind, timespan, _pool_index(request.owner, timespan, n))),
+			total=50
+		)
+	return handler
+
+
+def _followed_artists(request):
+	limit = min(int(request.query.get('limit') or DEFAULT_LIMIT), MAX_LIMIT)
+	return {'artists': {
+		'items': [artist(_spotify_id('followed', request.owner, n)) for n in range(limit)],
+		'limit': limit,
+		'total': limit,
+		'cursors': {'after': None},
+		'next': None,
+	}}
+
+
+def _saved(kind):
+	def handler(request):
+		def item(n):
+			content_id = _spotify_id('saved', kind, request.owner, n)
+			return {
+				'added_at': '2020-01-01T00:00:00Z',
+				kind: track(content_id) if kind == 'track' else album(content_id),
+			}
+		return _page(request, item)
+	return handler
+
+
+def _my_playlists(request):
+	return _page(request, lambda n: playlist(_spotify_id('playlist', request.owner, n), request.owner))
+
+
+def _user_playlists(request):
+	owner = request.match.group(1)
+	return _page(request, lambda n: playlist(_spotify_id('playlist', owner, n), owner))
+
+
+def _search(request):
+	query = request.query.get('q') or ''
+	result = {}
+	makers = {'track': track, 'artist': artist, 'album': album, 'playlist': playlist}
+	for kind in (request.query.get('type') or 'track').split(','):
+		if kind in makers:
+			result[kind + 's'] = _page(
+				request, lambda n, kind=kind: makers[kind](_spotify_id('search', kind, query, n))
+			)
+	return result
+
+
+def _several(key, make):
+	def handler(request):
+		return {key: [make(item) for item in _ids(request)]}
+	return handler
+
+
+def _single(make):
+	def handler(request):
+		return make(request.match.group(1))
+	return handler
+
+
+def _create_playlist(request):
+	return playlist(_spotify_id('created', request.match.group(1), time.time()), request.match.group(1))
+
+
+def _snapshot(request):
+	return {'snapshot_id': _digest('snapshot', request.match.group(1), time.time())}
+
+
+def _is_following(request):
+	return [False for _ in (request.query.get('ids') or '').split(',')]
+
+
+def _empty(request):
+	return None
+
+
+ROUTES = [
+	('GET', r'/v1/me', _me),
+	('GET', r'/v1/me/player/currently-playing', _currently_playing),
+	('GET', r'/v1/me/player/recently-played', _recently_played),
+	('GET', r'/v1/me/top/tracks', _top('tracks')),
+	('GET', r'/v1/me/top/artists', _top('artists')),
+	('GET', r'/v1/me/following', _followed_artists),
+	('GET', r'/v1/me/playlists', _my_playlists),
+	('GET', r'/v1/me/albums', _saved('album')),
+	('GET', r'/v1/me/tracks', _saved('track')),
+	('PUT', r'/v1/me/library', _empty),
+	('GET', r'/v1/search', _search),
+	('GET', r'/v1/users/([^/]+)', lambda request: user(request.match.group(1))),
+	('GET', r'/v1/users/([^/]+)/playlists', _user_playlists),
+	('POST', r'/v1/users/([^/]+)/playlists', _create_playlist),
+	('GET', r'/v1/tracks', _several('tracks', track)),
+	('GET', r'/v1/albums', _several('albums', album)),
+	('GET', r'/v1/artists', _several('artists', artist)),
+	('GET', r'/v1/tracks/([^/]+)', _single(track)),
+	('GET', r'/v1/albums/([^/]+)', _single(album)),
+	('GET', r'/v1/artists/([^/]+)', _single(artist)),
+	('GET', r'/v1/playlists/([^/]+)', _single(playlist)),
+	('PUT', r'/v1/playlists/([^/]+)', _empty),
+	('PUT', r'/v1/playlists/([^/]+)/images', _empty),
+	('PUT', r'/v1/playlists/([^/]+)/followers', _empty),
+	('GET', r'/v1/playlists/([^/]+)/followers/contains', _is_following),
+	('POST', r'/v1/playlists/([^/]+)/(?:tracks|items)', _snapshot),
+]
+ROUTES = [(method, re.compile(pattern + '$'), handler) for method, pattern, handler in ROUTES]
+
+
+class StubConfig:
+	def __init__(self, latency='none', rate_limit_rate=0.0, retry_after=1, error_rate=0.0, random_seed=0):
+		self.latency = self._parse_latency(latency)
+		self.rate_limit_rate = rate_limit_rate
+		self.retry_after = retry_after
+		self.error_rate = error_rate
+		self._random = random.Random(random_seed)
+		self._lock = threading.Lock()
+
+	@staticmethod
+	def _parse_latency(spec):
+		# none | fixed:MS | uniform:LOW_MS:HIGH_MS | lognormal:MEDIAN_MS:SIGMA
+		kind, _, args = (spec or 'none').partition(':')
+		args = [float(arg) for arg in args.split(':') if arg]
+		expected = {'none': 0, 'fixed': 1, 'uniform': 2, 'lognormal': 2}
+		if kind not in expected or len(args) != expected[kind]:
+			raise ValueError('Invalid latency spec: ' + spec)
+		return kind, args
+
+	def random(self):
+		with self._lock:
+			return self._random.random()
+
+	def delay(self):
+		kind, args = self.latency
+		with self._lock:
+			if kind == 'fixed':
+				ms = args[0]
+			elif kind == 'uniform':
+				ms = self._random.uniform(args[0], args[1])
+			elif kind == 'lognormal':
+				ms = self._random.lognormvariate(0, args[1]) * args[0]
+			else:
+				ms = 0
+		return ms / 1000.0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def log_message(self, format, *args):
+		pass
+
+	def _send_json(self, status, body, headers=None):
+		data = b'' if body is None else json.dumps(body).encode('utf-8')
+		self.send_response(status if data or status != 200 else 204)
+		if data:
+			self.send_header('Content-Type', 'application/json')
+		for name, value in (headers or {}).items():
+			self.send_header(name, value)
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def _error(self, status, message, headers=None):
+		self._send_json(status, {'error': {'status': status, 'message': message}}, headers)
+
+	def _handle(self):
+		length = int(self.headers.get('Content-Length') or 0)
+		if length:
+			self.rfile.read(length)
+
+		config = self.server.config
+		time.sleep(config.delay())
+
+		if config.rate_limit_rate and config.random() < config.rate_limit_rate:
+			return self._error(429, 'API rate limit exceeded', {'Retry-After': str(config.retry_after)})
+		if config.error_rate and config.random() < config.error_rate:
+			return self._error(503, 'Service unavailable')
+
+		url = urlsplit(self.path)
+		path = url.path.rstrip('/')
+		query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+		if path == '/api/token':
+			return self._send_json(200, {
+				'access_token': 'stub-access-' + _digest('token', time.time())[:16],
+				'token_type': 'Bearer',
+				'expires_in': 3600,
+				'refresh_token': 'stub-refresh-token',
+			})
+
+		authorization = self.headers.get('Authorization') or ''
+		if not authorization.startswith('Bearer '):
+			return self._error(401, 'No token provided')
+
+		for method, pattern, handler in ROUTES:
+			match = pattern.match(path)
+			if match and method == self.command:
+				request = _Request(self.command, path, query, authorization[7:], match)
+				return self._send_json(200, handler(request))
+
+		self._error(404, 'Service not found')
+
+	do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+class StubServer(ThreadingHTTPServer):
+	daemon_threads = True
+
+	def __init__(self, server_address, config=None):
+		super().__init__(server_address, StubHandler)
+		self.config = config or StubConfig()
+
+	@property
+	def base_url(self):
+		host, port = self.server_address[:2]
+		return 'http://%s:%d' % (host, port)
+
+	@property
+	def token_url(self):
+		return self.base_url + '/api/token'
+
+	@property
+	def api_prefix(self):
+		return self.base_url + '/v1/'
+
+
+def start(host='127.0.0.1', port=0, config=None):
+	server = StubServer((host, port), config)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
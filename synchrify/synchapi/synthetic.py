@@ -0,0 +1,219 @@
+import bisect
+import itertools
+import random
+import time
+
+from django.db import connection, transaction
+
+from . import analytics, db, passwords, snapshots
+from .spotify_endpoints import TIME_RANGES
+
+
+PASSWORD = 'synchrify-synthetic-password-000'
+CONTENT_TYPES = ['track', 'track', 'track', 'track', 'album', 'artist', 'playlist']
+INSERT_CHUNK = 5000
+
+
+def _executemany(query, rows):
+	with connection.cursor() as cursor:
+		for start in range(0, len(rows), INSERT_CHUNK):
+			cursor.executemany(query, rows[start:start + INSERT_CHUNK])
+
+
+def _fetchone(query, values=None):
+	with connection.cursor() as cursor:
+		cursor.execute(query, values)
+		return cursor.fetchone()
+
+
+def _fetchall(query, values=None):
+	with connection.cursor() as cursor:
+		cursor.execute(query, values)
+		return cursor.fetchall()
+
+
+def email(user):
+	return 'synthetic%d@example.com' % user
+
+
+def uri(n):
+	return 'synth%017d' % n
+
+
+class _WeightedSampler:
+	def __init__(self, population, weights, rng):
+		self.population = population
+		self.cumulative = list(itertools.accumulate(weights))
+		self.rng = rng
+
+	def choice(self):
+		return self.population[bisect.bisect(self.cumulative, self.rng.random() * self.cumulative[-1])]
+
+	def sample(self, k, exclude=None):
+		chosen = set()
+		attempts = 0
+		while len(chosen) < k and attempts < k * 10:
+			attempts += 1
+			item = self.choice()
+			if item != exclude:
+				chosen.add(item)
+		return chosen
+
+
+def _zipf_weights(n, exponent):
+	return [1.0 / (rank ** exponent) for rank in range(1, n + 1)]
+
+
+def _friend_edges(users, rng, mean_degree, mutual):
+	# Degrees follow a Pareto distribution and targets are picked in proportion
+	# to a Zipf popularity weight, giving a heavy-tailed friend graph.
+	popularity = list(users)
+	rng.shuffle(popularity)
+	sampler = _WeightedSampler(popularity, _zipf_weights(len(users), 0.8), rng)
+
+	edges = set()
+	for user in users:
+		degree = min(int(rng.paretovariate(1.5) * mean_degree / 3), len(users) - 1)
+		for friend in sampler.sample(degree, exclude=user):
+			edges.add((user, friend))
+			if rng.random() < mutual:
+				edges.add((friend, user))
+	return sorted(edges)
+
+
+def _ratings(users, content, rng, mean_ratings, now):
+	sampler = _WeightedSampler(content, _zipf_weights(len(content), 1.0), rng)
+	values = list(range(11))
+	value_weights = [1, 1, 1, 2, 3, 5, 7, 9, 10, 8, 6]
+
+	rows = []
+	for user in users:
+		count = min(int(rng.expovariate(1.0 / mean_ratings)) + 1, len(content))
+		for item in sampler.sample(count):
+			rated_at = now - int(rng.expovariate(1.0 / (7 * 24 * 3600)))
+			rows.append((user, item, rng.choices(values, value_weights)[0], rated_at))
+	return rows
+
+
+def _plays(users, tracks, rng, mean_plays, now):
+	sampler = _WeightedSampler(tracks, _zipf_weights(len(tracks), 1.0), rng)
+
+	rows = []
+	for user in users:
+		played_at = now
+		for _ in range(int(rng.expovariate(1.0 / mean_plays)) if mean_plays else 0):
+			# At least 30 seconds apart, as Spotify only counts plays that long
+			played_at -= 30 + int(rng.expovariate(1.0 / 3600))
+			rows.append((user, sampler.choice(), played_at))
+	return rows
+
+
+def _top_snapshots(users, content_ids, content_types, rng, now):
+	rows = []
+	for kind, content_type in snapshots.KINDS.items():
+		items = [item for item, item_type in zip(content_ids, content_types) if item_type == content_type]
+		if not items:
+			continue
+		sampler = _WeightedSampler(items, _zipf_weights(len(items), 1.0), rng)
+		for user in users:
+			for timespan in TIME_RANGES:
+				rows.append((user, kind, timespan, analytics.pack_ids(sampler.sample(min(snapshots.SIZE, len(items)))), now))
+	return rows
+
+
+def seed(users, content, mean_degree=20, mutual=0.7, mean_ratings=50, mean_plays=100, random_seed=0,
+		spotify_auth=True):
+	rng = random.Random(random_seed)
+	# One salted hash shared by every synthetic user keeps seeding fast
+	password = passwords.make_password(PASSWORD)
+
+	with transaction.atomic():
+		first_user = _fetchone('SELECT COALESCE(MAX(id), 0) FROM synchrify_users')[0] + 1
+		user_ids = list(range(first_user, first_user + users))
+
+		_executemany(
+			'INSERT INTO synchrify_users (id, email, password, activated) VALUES (%s, %s, %s, 1)',
+			[(user, email(user), password) for user in user_ids]
+		)
+
+		if spotify_auth:
+			expires_at = int(time.time()) + 10 * 365 * 24 * 3600
+			_executemany(
+				'INSERT INTO synchrify_spotify_auth (user, username, access_token, refresh_token, expires_at) '
+				'VALUES (%s, %s, %s, %s, %s)',
+				[(user, 'synthetic%d' % user, 'access-%d' % user, 'refresh-%d' % user, expires_at)
+					for user in user_ids]
+			)
+
+		first_content = _fetchone('SELECT COALESCE(MAX(id), 0) FROM synchrify_spotify_content')[0] + 1
+		content_ids = list(range(first_content, first_content + content))
+		content_types = [rng.choice(CONTENT_TYPES) for _ in content_ids]
+
+		_executemany(
+			'INSERT INTO synchrify_spotify_content (id, type, uri, name) VALUES (%s, %s, %s, %s)',
+			[(item, content_type, uri(item), 'Synthetic Content %d' % item)
+				for item, content_type in zip(content_ids, content_types)]
+		)
+
+		edges = _friend_edges(user_ids, rng, mean_degree, mutual)
+		_executemany(
+			'INSERT INTO synchrify_friends (friender, friendee) VALUES (%s, %s)',
+			edges
+		)
+
+		ratings = _ratings(user_ids, content_ids, rng, mean_ratings, int(time.time()))
+		_executemany(
+			'INSERT INTO synchrify_ratings (user, content, rating, rated_at) VALUES (%s, %s, %s, %s)',
+			ratings
+		)
+
+		db.backfill_timelines()
+		db.backfill_trending()
+
+		tracks = [item for item, content_type in zip(content_ids, content_types) if content_type == 'track']
+		plays = _plays(user_ids, tracks, rng, mean_plays, int(time.time())) if tracks else []
+		_executemany(
+			'INSERT INTO synchrify_plays (user, content, played_at) VALUES (%s, %s, %s)',
+			plays
+		)
+
+		top_snapshots = _top_snapshots(user_ids, content_ids, content_types, rng, int(time.time()))
+		_executemany(
+			'INSERT INTO synchrify_top_snapshots (user, kind, timespan, items, taken_at) VALUES (%s, %s, %s, %s, %s)',
+			top_snapshots
+		)
+
+	return {
+		'users': len(user_ids),
+		'content': len(content_ids),
+		'friend_edges': len(edges),
+		'ratings': len(ratings),
+		'plays': len(plays),
+		'top_snapshots': len(top_snapshots),
+	}
+
+
+def sample(count=1):
+	rows = _fetchall("""
+		SELECT f.friender, f.friendee FROM synchrify_friends f
+		INNER JOIN synchrify_friends r
+		ON r.friender = f.friendee AND r.friendee = f.friender
+		INNER JOIN synchrify_users u
+		ON u.id = f.friender
+		WHERE u.email LIKE 'synthetic%%@example.com'
+		LIMIT %s
+	""", (count,))
+
+	content = _fetchall("""
+		SELECT id, type, uri FROM synchrify_spotify_content
+		WHERE uri LIKE 'synth%%'
+		LIMIT %s
+	""", (count,))
+
+	return [
+		{
+			'user': user, 'friend': friend, 'email': email(user), 'password': PASSWORD,
+			'content': content_id, 'type': content_type, 'uri': content_uri,
+		}
+		for (user, friend), (content_id, content_type, content_uri) in zip(rows, itertools.cycle(content))
+	] if content else []
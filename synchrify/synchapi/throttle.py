@@ -0,0 +1,28 @@
+import threading
+import time
+
+
+class TokenBucket:
+	# Shared between threads; acquire() blocks until enough tokens have accrued.
+	# A rate of 0 or less disables throttling.
+	def __init__(self, rate, capacity=None):
+		self.rate = rate
+		self.capacity = capacity or max(rate, 1)
+		self.tokens = self.capacity
+		self.updated = time.monotonic()
+		self.lock = threading.Lock()
+
+	def acquire(self, tokens=1):
+		if self.rate <= 0:
+			return
+
+		while True:
+			with self.lock:
+				now = time.monotonic()
+				self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+				self.updated = now
+				if self.tokens >= tokens:
+					self.tokens -= tokens
+					return
+				wait = (tokens - self.tokens) / self.rate
+			time.sleep(wait)
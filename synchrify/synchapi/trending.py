@@ -0,0 +1,32 @@
+import heapq
+import itertools
+import time
+
+from . import db, graph, privacy
+
+
+def _totals(merged):
+	# (content, score) pairs sorted by content -> (content, summed score, number of friends)
+	for content, group in itertools.groupby(merged, key=lambda pair: pair[0]):
+		scores = [score for _, score in group]
+		yield content, sum(scores), len(scores)
+
+
+def top(user, window, limit):
+	span, buckets = db.TRENDING_WINDOWS[window]
+	since = int(time.time()) // span - buckets + 1
+	friends = graph.friends(user)
+	hidden = privacy.hidden_from_friends(friends, 'ratings')
+	rows = db.get_trending_rows([friend for friend in friends if friend not in hidden], span, since)
+
+	# Rows arrive ordered by (friend, bucket, content), so each friend's bucket
+	# is a run sorted by content; a k-way merge of the runs brings equal content together
+	runs = [
+		[(content, score) for _, _, content, score in run]
+		for _, run in itertools.groupby(rows, key=lambda row: row[:2])
+	]
+	return heapq.nlargest(
+		limit,
+		_totals(heapq.merge(*runs)),
+		key=lambda total: (total[1], total[2], -total[0])
+	)
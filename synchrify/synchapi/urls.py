@@ -12,15 +12,20 @@ urlpatterns = [
 			views.activate, name='activate'),  # Takes activation token (UUIDv4)
 	path('login/', views.login, name='login'),
 	path('user/', views.user, name='user'),
+	path('user/privacy', views.privacy_get, name='privacy'),
+	path('user/privacy/set/<field>/<level>', views.privacy_set, name='privacy-set'),
 	path('logout/', views.logout, name='logout'),
 
 	path('friends/list', views.friends_list, name='friends-list'),
 	path('friends/list/<int:friend_id>', views.friends_list, name='friends-list-other'),
 	path('friends/list/friends', views.friends_list_friends, name='friends-list-all'),
+	path('friends/overlap', views.friends_overlap, name='friends-overlap'),
+	path('friends/overlap/top', views.friends_top_overlap, name='friends-top-overlap'),
 	path('friends/pending', views.friends_pending, name='friends-pending'),
 	path('friends/add/<int:friend_id>', views.friends_add, name='friends-add'),
 	path('friends/remove/<int:friend_id>', views.friends_remove, name='friends-remove'),
 
+	path('content/search', views.content_search, name='content-search'),
 	path('content/<int:content_id>', views.content_get_by_id, name='content-get-by-id'),
 	path('content/<int:content_id>/rating', views.content_get_rating, name='content-get-rating'),
 	path('content/<int:content_id>/rating/<int:friend_id>', views.content_get_rating, name='content-get-rating-other'),
@@ -31,6 +36,19 @@ urlpatterns = [
 	path('ratings/list', views.ratings_list, name='ratings-list'),
 	path('ratings/list/<int:friend_id>', views.ratings_list, name='ratings-list-other'),
 	path('ratings/list/friends', views.ratings_list_friends, name='ratings-list-all'),
+	path('ratings/feed', views.ratings_feed, name='ratings-feed'),
+	path('ratings/trending', views.ratings_trending, name='ratings-trending'),
+
+	path('history', views.history_list, name='history'),
+
+	path('changes', views.changes_since, name='changes'),
+
+	path('blend/', views.blend_create, name='blend-create'),
+	path('jobs/<job_id>', views.job_status, name='job-status'),
+
+	path('batch/', views.batch_execute, name='batch'),
+
+	path('metrics', views.metrics_export, name='metrics'),
 
 	path('spotify/auth', views.spotify_auth, name='spotify-auth'),
 	path('spotify/auth/callback', views.spotify_auth_callback, name='spotify-auth-callback'),
@@ -0,0 +1,39 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+
+
+# Per-process backends: what one worker stores here, no other worker sees
+LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+
+
+def shared_cache():
+	return settings.CACHES['default']['BACKEND'] not in LOCAL_CACHES
+
+
+def _key(scope, ident):
+	return 'synchapi:version:%s:%s' % (scope, ident)
+
+
+def _token():
+	return uuid.uuid4().hex[:16]
+
+
+def get(scope, ident):
+	# A missing (or evicted) version gets a fresh random token rather than a
+	# counter restarting at zero, so a stale validator can never match again.
+	key = _key(scope, ident)
+	version = cache.get(key)
+	metrics.inc('synchapi_cache_requests_total', (('cache', 'versions'), ('result', 'miss' if version is None else 'hit')))
+	if version is None:
+		version = _token()
+		if not cache.add(key, version, None):
+			version = cache.get(key, version)
+	return version
+
+
+def bump(scope, idents):
+	cache.set_many({_key(scope, ident): _token() for ident in idents}, None)
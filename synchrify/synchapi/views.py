@@ -1,25 +1,55 @@
+import hmac
 import json
 import uuid
+import zlib
 
 from django.conf import settings
-from django.http import JsonResponse, HttpResponseBadRequest, HttpResponseRedirect, HttpResponseNotAllowed, HttpResponseNotFound
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, HttpResponseNotAllowed, HttpResponseNotFound
+from django.utils.cache import get_conditional_response
 
-import spotipy
+from . import db, mail, patterns, apikeys, batch, changes, graph, jobs, metrics, passwords, privacy, ratingbuffer, search, spotify_endpoints, trending, versions
+from .responses import JsonResponse, RawJsonResponse, columns, dumps, project
 
-from . import db, mail, patterns, apikeys
 
+# Built on first use so worker boot and management commands skip spotipy
+_spotify_oauth = None
 
-SPOTIFY_OAUTH = spotipy.SpotifyOAuth(
-	settings.SPOTIFY_CLIENT_ID,
-	settings.SPOTIFY_CLIENT_SECRET,
-	settings.SPOTIFY_REDIRECT_URI,
-	scope=settings.SPOTIFY_SCOPE,
-	username=settings.SPOTIFY_USERNAME,
-)
 
-SPOTIFY_MARKET = 'US'
+def _get_spotify_oauth():
+	global _spotify_oauth
+	if _spotify_oauth is None:
+		from spotipy import SpotifyOAuth
+		_spotify_oauth = SpotifyOAuth(
+			settings.SPOTIFY_CLIENT_ID,
+			settings.SPOTIFY_CLIENT_SECRET,
+			settings.SPOTIFY_REDIRECT_URI,
+			scope=settings.SPOTIFY_SCOPE,
+			username=settings.SPOTIFY_USERNAME,
+		)
+	return _spotify_oauth
+
+
+SPOTIFY_MARKET = spotify_endpoints.SPOTIFY_MARKET
 SPOTIFY_CONTENT_TYPES = ['track', 'artist', 'album', 'playlist']
 
+FEED_PAGE_SIZE = 50
+FEED_MAX_PAGE_SIZE = 200
+
+CHANGES_PAGE_SIZE = 500
+CHANGES_MAX_WAIT = 30
+
+CONTENT_MAX_AGE = 3600
+
+SEARCH_PAGE_SIZE = 10
+SEARCH_MAX_PAGE_SIZE = 50
+
+TRENDING_PAGE_SIZE = 20
+TRENDING_MAX_PAGE_SIZE = 100
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+
 
 def _enforce_method(request, method):
 	if not request.method == method:
@@ -33,6 +63,13 @@ def _get_user(request):
 		return request.session['user']
 
 
+def _get_spotify_auth(request, user):
+	# Batch sub-requests carry the auth their batch already looked up
+	if hasattr(request, 'spotify_auth'):
+		return request.spotify_auth
+	return db.get_spotify_auth(user)
+
+
 def _ok():
 	return JsonResponse({})
 
@@ -41,6 +78,26 @@ def _err(msg):
 	return JsonResponse({'error': msg})
 
 
+def _wants_columns(request):
+	return request.GET.get('format') == 'columns'
+
+
+def _etag(*parts):
+	return '"%s"' % '-'.join(str(part) for part in parts)
+
+
+def _tagged(response, etag, cache_control='private, no-cache'):
+	response['ETag'] = etag
+	response['Cache-Control'] = cache_control
+	return response
+
+
+def _not_modified(request, etag, cache_control='private, no-cache'):
+	response = get_conditional_response(request, etag=etag)
+	if response:
+		return _tagged(response, etag, cache_control)
+
+
 def register(request):
 	err = _enforce_method(request, 'POST')
 	if err:
@@ -58,7 +115,7 @@ def register(request):
 	if db.check_email_exists(email):
 		return _err('User already exists!')
 
-	db.insert_user(email, password)
+	db.insert_user(email, passwords.make_password(password))
 
 	token = str(uuid.uuid4())
 	db.insert_activation(email, token)
@@ -106,6 +163,7 @@ def login(request):
 	row = db.get_login(email)
 
 	if not row:
+		passwords.check_password(password, None)
 		return _err('User does not exist')
 
 	user, pass_hash, activated = row
@@ -113,9 +171,12 @@ def login(request):
 	if activated != 1:
 		return _err('Account is not activated! Check your email')
 
-	if password != pass_hash:
+	if not passwords.check_password(password, pass_hash):
 		return _err('Wrong password')
 
+	if passwords.needs_rehash(pass_hash):
+		db.set_password(user, passwords.make_password(password))
+
 	request.session['user'] = user
 	return _ok()
 
@@ -144,6 +205,35 @@ def logout(request):
 	return _ok()
 
 
+def privacy_get(request):
+	err = _enforce_method(request, 'GET')
+	if err:
+		return err
+
+	user = _get_user(request)
+	if not user:
+		return _err('You must be logged in to access this URL')
+
+	levels = privacy.get(user)
+	return JsonResponse({field: privacy.LEVELS[level] for field, level in zip(privacy.FIELDS, levels)})
+
+
+def privacy_set(request, field, level):
+	err = _enforce_method(request, 'GET')
+	if err:
+		return err
+
+	user = _get_user(request)
+	if not user:
+		return _err('You must be logged in to access this URL')
+
+	if field not in privacy.FIELDS or level not in privacy.LEVELS:
+		return _err('Field must be in %s and level in %s' % (privacy.FIELDS, privacy.LEVELS))
+
+	privacy.update(user, field, privacy.LEVELS.index(level))
+	return _ok()
+
+
 def friends_list(request, friend_id=None):
 	err = _enforce_method(request, 'GET')
 	if err:
@@ -153,15 +243,16 @@ def friends_list(request, friend_id=None):
 	if not user:
 		return _err('You must be logged in to access this URL')
 
-	friends = db.get_friends_list(user)
+	if friend_id and not privacy.can_view(user, friend_id, 'friends'):
+		return _err("This user's friends list is not visible to you")
 
-	if friend_id:
-		# TODO: privacy settings?
-		if friend_id not in friends:
-			return _err('You must be friends with this user to list their friends')
-		friends = db.get_friends_list(friend_id)
+	target = friend_id if friend_id else user
+	etag = _etag('friends', user, target, graph.friends_version(target))
+	not_modified = _not_modified(request, etag)
+	if not_modified:
+		return not_modified
 
-	return JsonResponse({'friends': friends})
+	return _tagged(JsonResponse({'friends': graph.friends(target)}), etag)
 
 
 def friends_list_friends(request):
@@ -173,7 +264,74 @@ def friends_list_friends(request):
 	if not user:
 		return _err('You must be logged in to access this URL')
 
-	return JsonResponse({'friends_of_friends': db.get_friends_of_friends(user)})
+	version = graph.friends_version(user)
+	# Friends who keep their friends list private contribute nothing, and the
+	# ETag changes with who they are
+	hidden = privacy.hidden_from_friends(graph.friends(user), 'friends')
+	etag = _etag('friends-of-friends', user, version, '%08x' % zlib.crc32(dumps(sorted(hidden))))
+	not_modified = _not_modified(request, etag)
+	if not_modified:
+		return not_modified
+
+	return _tagged(JsonResponse({'friends_of_friends': graph.friends_of_friends(user, hidden)}), etag)
+
+
+def friends_overlap(request):
+	from . import analytics  # numpy
+
+	err = _enforce_method(request, 'GET')
+	if err:
+		return err
+
+	user = _get_user(request)
+	if not user:
+		return _err('You must be logged in to access this URL')
+
+	friends = graph.friends(user)
+	hidden = privacy.hidden_from_friends(friends, 'ratings')
+	members = sorted([user] + [friend for friend in friends if friend not in hidden])
+	# Ratings are read live while members come from the graph snapshot; rows of
+	# anyone not in members (hidden, or no longer a friend) are dropped by rating_overlap
+	shared, mean_diff = analytics.rating_overlap(members, db.get_group_ratings(user))
+
+	return JsonResponse({
+		'users': members,
+		'shared': shared.tolist(),
+		'mean_abs_diff': [[None if value != value else round(value, 3) for value in row] for row in mean_diff.tolist()],
+	})
+
+
+def friends_top_overlap(request):
+	from . import analytics  # numpy
+
+	err = _enforce_method(request, 'GET')
+	if err:
+		return err
+
+	user = _get_user(request)
+	if not user:
+		return _err('You must be logged in to access this URL')
+
+	kind = request.GET.get('kind', 'tracks')
+	timespan = request.GET.get('timespan', 'medium_term')
+	if kind not in ('tracks', 'artists') or timespan not in spotify_endpoints.TIME_RANGES:
+		return HttpResponseBadRequest("Field 'kind' must be tracks or artists and 'timespan' in %s" % spotify_endpoints.TIME_RANGES)
+
+	row = db.get_top_snapshot(user, kind, timespan)
+	if not row:
+		return HttpResponseNotFound('No top %s snapshot has been taken for you yet' % kind)
+	items, taken_at = row
+
+	overlap = analytics.top_overlap(items, db.get_top_snapshots(graph.friends(user), kind, timespan))
+	return JsonResponse({
+		'kind': kind,
+		'timespan': timespan,
+		'taken_at': taken_at,
+		'friends': [
+			{'friend_id': friend, 'shared': shared, 'jaccard': round(jaccard, 3)}
+			for friend, shared, jaccard in overlap
+		],
+	})
 
 
 def friends_pending(request):
@@ -185,7 +343,12 @@ def friends_pending(request):
 	if not user:
 		return _err('You must be logged in to access this URL')
 
-	return JsonResponse({'pending': db.get_friends_pending(user)})
+	etag = _etag('pending', user, versions.get('friends', user))
+	not_modified = _not_modified(request, etag)
+	if not_modified:
+		return not_modified
+
+	return _tagged(JsonResponse({'pending': db.get_friends_pending(user)}), etag)
 
 
 def friends_add(request, friend_id):
@@ -204,6 +367,7 @@ def friends_add(request, friend_id):
 		return _err('Friend user not found')
 
 	db.insert_friend(user, friend_id)
+	graph.refresh_delta()
 	return _ok()
 
 
@@ -217,6 +381,7 @@ def friends_remove(request, friend_id):
 		return _err('You must be logged in to access this URL')
 
 	db.delete_friend(user, friend_id)
+	graph.refresh_delta()
 	return _ok()
 
 
@@ -229,15 +394,49 @@ def content_get_by_id(request, content_id):
 	if not user:
 		return _err('You must be logged in to access this URL')
 
+	cache_control = 'private, max-age=%d' % CONTENT_MAX_AGE
+	etag = _etag('content', content_id, versions.get('content', content_id))
+	not_modified = _not_modified(request, etag, cache_control)
+	if not_modified:
+		return not_modified
+
 	row = db.get_content_by_id(content_id)
 	if not row:
 		return _err('Content ID not found')
 
 	content_type, uri, name = row
-	return JsonResponse({'type': content_type, 'uri': uri, 'name': name})
+	return _tagged(JsonResponse({'type': content_type, 'uri': uri, 'name': name}), etag, cache_control)
+
+
+def content_search(request):
+	err = _enforce_method(request, 'GET')
+	if err:
+		return err
+
+	user = _get_user(request)
+	if not user:
+		return _err('You must be logged in to access this URL')
+
+	params = request.GET
+	query = params.get('q', '')
+	content_type = params.get('type')
+	if content_type is not None and content_type not in SPOTIFY_CONTENT_TYPES:
+		return HttpResponseBadRequest("Invalid 'type'")
+
+	try:
+		limit = min(int(params.get('limit', SEARCH_PAGE_SIZE)), SEARCH_MAX_PAGE_SIZE)
+	except ValueError:
+		return HttpResponseBadRequest("Field 'limit' must be numeric")
+
+	if limit < 1:
+		return HttpResponseBadRequest("Invalid 'limit'")
+
+	return JsonResponse({'results': search.search_content(user, query, content_type, limit)})
 
 
 def content_get_by_uri(request, content_type, uri):
+	from spotipy import SpotifyException
+
 	err = _enforce_method(request, 'GET')
 	if err:
 		return err
@@ -246,7 +445,7 @@ def content_get_by_uri(request, content_type, uri):
 	if not user:
 		return _err('You must be logged in to access this URL')
 
-	auth = db.get_spotify_auth(user)
+	auth = _get_spotify_auth(request, user)
 	if not auth:
 		return _err('You must be authenticated with Spotify to access this URL')
 
@@ -271,7 +470,7 @@ def content_get_by_uri(request, content_type, uri):
 		elif content_type == 'playlist':
 			content_info = client.playlist(uri, market=SPOTIFY_MARKET)
 
-	except spotipy.SpotifyException as e:
+	except SpotifyException as e:
 		return _err(str(e))
 
 	if not content_info:
@@ -299,10 +498,8 @@ def content_get_rating(request, content_id, friend_id=None):
 	if not user:
 		return _err('You must be logged in to access this URL')
 
-	if friend_id:
-		# TODO: privacy settings?
-		if not db.check_friends(user, friend_id):
-			return _err('You must be friends with this user to view their ratings')
+	if friend_id and not privacy.can_view(user, friend_id, 'ratings'):
+		return _err("This user's ratings are not visible to you")
 
 	rating = db.get_rating(friend_id if friend_id else user, content_id)
 	if not rating:
@@ -311,6 +508,20 @@ def content_get_rating(request, content_id, friend_id=None):
 	return JsonResponse({'rating': rating})
 
 
+def _content_exists(content_id):
+	# Content rows are never deleted, so with the rating buffer on (slider
+	# scrubbing) a positive answer is remembered instead of queried every call
+	if not ratingbuffer.enabled():
+		return db.check_content_exists(content_id)
+	key = 'synchapi:content-exists:%d' % content_id
+	if cache.get(key):
+		return True
+	exists = db.check_content_exists(content_id)
+	if exists:
+		cache.set(key, True, CONTENT_MAX_AGE)
+	return exists
+
+
 def content_set_rating(request, content_id, rating):
 	err = _enforce_method(request, 'GET')
 	if err:
@@ -320,13 +531,16 @@ def content_set_rating(request, content_id, rating):
 	if not user:
 		return _err('You must be logged in to access this URL')
 
-	if not db.check_content_exists(content_id):
+	if not _content_exists(content_id):
 		return _err('Content ID not found')
 
 	if rating < 0 or rating > 10:
 		return _err('Rating value must be in range 0 <= r <= 10')
 
-	db.insert_rating(user, content_id, rating)
+	if ratingbuffer.enabled():
+		ratingbuffer.put(user, content_id, rating)
+	else:
+		db.insert_rating(user, content_id, rating)
 	return _ok()
 
 
@@ -339,10 +553,13 @@ def content_reset_rating(request, content_id):
 	if not user:
 		return _err('You must be logged in to access this URL')
 
-	if not db.check_content_exists(content_id):
+	if not _content_exists(content_id):
 		return _err('Content ID not found')
 
-	db.delete_rating(user, content_id)
+	if ratingbuffer.enabled():
+		ratingbuffer.put(user, content_id, None)
+	else:
+		db.delete_rating(user, content_id)
 	return _ok()
 
 
@@ -355,13 +572,22 @@ def ratings_list(request, friend_id=None):
 	if not user:
 		return _err('You must be logged in to access this URL')
 
-	if friend_id:
-		# TODO: privacy settings?
-		if not db.check_friends(user, friend_id):
-			return _err('You must be friends with this user to list their ratings')
+	if friend_id and not privacy.can_view(user, friend_id, 'ratings'):
+		return _err("This user's ratings are not visible to you")
 
-	ratings = db.get_ratings(friend_id if friend_id else user)
-	return JsonResponse({'ratings': ratings})
+	target = friend_id if friend_id else user
+	as_rows = _wants_columns(request)
+	etag = _etag(
+		'ratings', user, target, int(as_rows), versions.get('ratings', target), versions.get('content', 'names')
+	)
+	not_modified = _not_modified(request, etag)
+	if not_modified:
+		return not_modified
+
+	ratings = db.get_ratings(target, as_rows)
+	if as_rows:
+		ratings = columns(db.RATINGS_COLUMNS, ratings)
+	return _tagged(JsonResponse({'ratings': ratings}), etag)
 
 
 def ratings_list_friends(request):
@@ -373,10 +599,271 @@ def ratings_list_friends(request):
 	if not user:
 		return _err('You must be logged in to access this URL')
 
-	ratings = db.get_friends_ratings(user)
+	rows = db.get_friends_ratings(user, as_rows=True)
+	hidden = privacy.hidden_from_friends({row[0] for row in rows}, 'ratings')
+	if hidden:
+		rows = [row for row in rows if row[0] not in hidden]
+
+	if _wants_columns(request):
+		ratings = columns(db.FRIENDS_RATINGS_COLUMNS, rows)
+	else:
+		ratings = [dict(zip(db.FRIENDS_RATINGS_COLUMNS, row)) for row in rows]
 	return JsonResponse({'ratings': ratings})
 
 
+def ratings_feed(request):
+	err = _enforce_method(request, 'GET')
+	if err:
+		return err
+
+	user = _get_user(request)
+	if not user:
+		return _err('You must be logged in to access this URL')
+
+	params = request.GET
+	try:
+		since = int(params.get('since', 0))
+		limit = min(int(params.get('limit', FEED_PAGE_SIZE)), FEED_MAX_PAGE_SIZE)
+		cursor = params.get('cursor')
+		before = tuple(int(part) for part in cursor.split('.')) if cursor else db.TIMELINE_START
+	except ValueError:
+		return HttpResponseBadRequest("Fields 'since', 'limit' and 'cursor' must be numeric")
+
+	if len(before) != 3 or limit < 1:
+		return HttpResponseBadRequest("Invalid 'cursor' or 'limit'")
+
+	rows = db.get_timeline(user, since, before, limit, as_rows=True)
+
+	next_cursor = None
+	if len(rows) == limit:
+		friend, content_id, _, _, _, _, rated_at = rows[-1]
+		next_cursor = '%d.%d.%d' % (rated_at, friend, content_id)
+
+	# Filtered after paging, so a page can come back short while 'next' is set
+	hidden = privacy.hidden_from_friends({row[0] for row in rows}, 'ratings')
+	if hidden:
+		rows = [row for row in rows if row[0] not in hidden]
+
+	if _wants_columns(request):
+		ratings = columns(db.TIMELINE_COLUMNS, rows)
+	else:
+		ratings = [dict(zip(db.TIMELINE_COLUMNS, row)) for row in rows]
+
+	return JsonResponse({'ratings': ratings, 'next': next_cursor})
+
+
+def ratings_trending(request):
+	err = _enforce_method(request, 'GET')
+	if err:
+		return err
+
+	user = _get_user(request)
+	if not user:
+		return _err('You must be logged in to access this URL')
+
+	window = request.GET.get('window', '7d')
+	if window not in db.TRENDING_WINDOWS:
+		return HttpResponseBadRequest("Field 'window' must be in %s" % list(db.TRENDING_WINDOWS))
+
+	try:
+		limit = min(int(request.GET.get('limit', TRENDING_PAGE_SIZE)), TRENDING_MAX_PAGE_SIZE)
+	except ValueError:
+		return HttpResponseBadRequest("Field 'limit' must be numeric")
+
+	if limit < 1:
+		return HttpResponseBadRequest("Invalid 'limit'")
+
+	ranked = trending.top(user, window, limit)
+	content = db.get_content_by_ids([row[0] for row in ranked])
+
+	return JsonResponse({
+		'window': window,
+		'content': [
+			{
+				'content_id': content_id, 'type': content[content_id][1], 'uri': content[content_id][2],
+				'name': content[content_id][3], 'score': score, 'friends': friends,
+			}
+			for content_id, score, friends in ranked if content_id in content
+		],
+	})
+
+
+def history_list(request):
+	err = _enforce_method(request, 'GET')
+	if err:
+		return err
+
+	user = _get_user(request)
+	if not user:
+		return _err('You must be logged in to access this URL')
+
+	params = request.GET
+	try:
+		since = int(params.get('since', 0))
+		before = int(params.get('before', 2 ** 31 - 1))
+		limit = min(int(params.get('limit', HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE)
+	except ValueError:
+		return HttpResponseBadRequest("Fields 'since', 'before' and 'limit' must be numeric")
+
+	if limit < 1:
+		return HttpResponseBadRequest("Invalid 'limit'")
+
+	rows = db.get_history(user, since, before, limit, as_rows=True)
+
+	# played_at is unique per user, so it alone is the cursor for the next page
+	next_before = rows[-1][3] if len(rows) == limit else None
+
+	if _wants_columns(request):
+		plays = columns(db.HISTORY_COLUMNS, rows)
+	else:
+		plays = [dict(zip(db.HISTORY_COLUMNS, row)) for row in rows]
+
+	return JsonResponse({'plays': plays, 'next': next_before})
+
+
+def changes_since(request):
+	err = _enforce_method(request, 'GET')
+	if err:
+		return err
+
+	user = _get_user(request)
+	if not user:
+		return _err('You must be logged in to access this URL')
+
+	params = request.GET
+	if 'since' not in params:
+		return JsonResponse({'version': db.get_changes_version(user) or 0, 'changes': [], 'reset': True})
+
+	try:
+		since = int(params['since'])
+		wait = min(float(params.get('wait', 0)), CHANGES_MAX_WAIT)
+	except ValueError:
+		return HttpResponseBadRequest("Fields 'since' and 'wait' must be numeric")
+
+	floor = db.get_changes_floor()
+	if floor and since + 1 < floor:
+		return JsonResponse({'version': db.get_changes_version(user) or 0, 'changes': [], 'reset': True})
+
+	if wait > 0:
+		changes.wait(user, since, wait, lambda: db.get_changes_version(user))
+
+	deltas = db.get_changes(user, since, CHANGES_PAGE_SIZE)
+	version = deltas[-1]['version'] if deltas else since
+	# Filtered after the version is taken, so hidden deltas are skipped rather than re-read
+	raters = {delta['subject'] for delta in deltas if delta['kind'] == 'friend_ratings'}
+	hidden = privacy.hidden_from_friends(raters, 'ratings')
+	if hidden:
+		deltas = [delta for delta in deltas if delta['kind'] != 'friend_ratings' or delta['subject'] not in hidden]
+	return JsonResponse({'version': version, 'changes': deltas, 'reset': False})
+
+
+def blend_create(request):
+	from . import blend  # numpy
+
+	err = _enforce_method(request, 'POST')
+	if err:
+		return err
+
+	user = _get_user(request)
+	if not user:
+		return _err('You must be logged in to access this URL')
+
+	params = json.loads(request.body)
+	friends, name = params.get('friends'), params.get('name', 'Synchrify Blend')
+
+	try:
+		friends = sorted({int(friend) for friend in friends or []})
+		size = min(int(params.get('size', 50)), settings.BLEND_MAX_SIZE)
+	except (TypeError, ValueError):
+		return HttpResponseBadRequest("Field 'friends' must be a list of user IDs and 'size' a number")
+
+	if not friends:
+		return HttpResponseBadRequest("Field 'friends' is required")
+
+	for friend in friends:
+		if not graph.check_friends(user, friend):
+			return _err('You must be friends with every user in the blend')
+		if not privacy.can_view(user, friend, 'ratings'):
+			return _err('Every user in the blend must share their ratings with you')
+
+	if not _get_spotify_auth(request, user):
+		return _err('You must be authenticated with Spotify to access this URL')
+
+	job_id = jobs.submit(user, 'blend', blend.build_blend, user, [user] + friends, name, size)
+	return JsonResponse({'job_id': job_id})
+
+
+def job_status(request, job_id):
+	err = _enforce_method(request, 'GET')
+	if err:
+		return err
+
+	user = _get_user(request)
+	if not user:
+		return _err('You must be logged in to access this URL')
+
+	job = jobs.get(job_id)
+	if not job or job['owner'] != user:
+		return _err('Job not found')
+
+	return JsonResponse(job)
+
+
+def batch_execute(request):
+	err = _enforce_method(request, 'POST')
+	if err:
+		return err
+
+	user = _get_user(request)
+	if not user:
+		return _err('You must be logged in to access this URL')
+
+	try:
+		params = json.loads(request.body)
+	except ValueError:
+		params = None
+	items = params.get('requests') if isinstance(params, dict) else None
+	if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+		return HttpResponseBadRequest("Field 'requests' must be a non-empty list of objects")
+
+	if len(items) > settings.BATCH_MAX_REQUESTS:
+		return HttpResponseBadRequest('At most %d requests per batch' % settings.BATCH_MAX_REQUESTS)
+
+	auth = None
+	if any(item.get('route') in batch.SPOTIFY_ROUTES for item in items):
+		auth = db.get_spotify_auth(user)
+		if auth and any(item.get('route') in batch.CONCURRENT_ROUTES for item in items):
+			from requests import RequestException
+			from spotipy import SpotifyException
+
+			# Refresh an expiring token once, before the sub-requests share it. If
+			# that fails, each Spotify sub-request retries and reports its own error.
+			try:
+				auth.client(user)
+			except (SpotifyException, RequestException):
+				pass
+
+	return RawJsonResponse(batch.execute(request, items, auth))
+
+
+batch_execute.rate_limit_cost = batch.cost
+
+
+def metrics_export(request):
+	err = _enforce_method(request, 'GET')
+	if err:
+		return err
+
+	if not settings.METRICS_ENABLED:
+		return HttpResponseNotFound()
+
+	token = settings.METRICS_TOKEN
+	if token and not hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + token):
+		return HttpResponse(status=401)
+
+	return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4')
+
+
 def spotify_auth(request):
 	err = _enforce_method(request, 'GET')
 	if err:
@@ -390,11 +877,13 @@ def spotify_auth(request):
 	request.session['auth_state'] = auth_state
 
 	return HttpResponseRedirect(
-		SPOTIFY_OAUTH.get_authorize_url(auth_state)
+		_get_spotify_oauth().get_authorize_url(auth_state)
 	)
 
 
 def spotify_auth_callback(request):
+	from spotipy import SpotifyException
+
 	err = _enforce_method(request, 'GET')
 	if err:
 		return err
@@ -430,11 +919,13 @@ def spotify_auth_callback(request):
 		db.insert_spotify_auth(user, auth)
 		return _ok()
 
-	except spotipy.SpotifyException as e:
+	except SpotifyException as e:
 		return _err(str(e))
 
 
 def spotify_wrapper(request, endpoint):
+	from spotipy import SpotifyException
+
 	err = _enforce_method(request, 'GET')
 	if err:
 		return err
@@ -443,88 +934,51 @@ def spotify_wrapper(request, endpoint):
 	if not user:
 		return _err('You must be logged in to access this URL')
 
-	auth = db.get_spotify_auth(user)
-	if not auth:
-		return _err('You must be authenticated with Spotify to access this URL')
-
-	params = request.GET
-
-	limit = params.get('limit')
-	before = params.get('before')
-	after = params.get('after')
-	offset = params.get('offset')
-	timespan = params.get('timespan')
+	spec = spotify_endpoints.ENDPOINTS.get(endpoint)
+	if not spec:
+		return HttpResponseNotFound('Unknown endpoint')
 
-	tracks = params.get('tracks')
-	tracks = tracks.split(',') if tracks else None
-
-	albums = params.get('albums')
-	albums = albums.split(',') if albums else None
-
-	artists = params.get('artists')
-	artists = artists.split(',') if artists else None
+	try:
+		args = spec.parse(request.GET)
+	except ValueError as e:
+		return HttpResponseBadRequest(str(e))
 
-	users = params.get('users')
-	users = users.split(',') if users else None
+	fields = request.GET.get('fields')
 
-	name = params.get('name')
-	description = params.get('description')
-	playlist = params.get('playlist')
-	position = params.get('position')
-	image_b64 = params.get('image')
+	auth = _get_spotify_auth(request, user)
+	if not auth:
+		return _err('You must be authenticated with Spotify to access this URL')
 
-	query = params.get('q')
-	query_type = params.get('type')
-	query_user = params.get('user')
+	key, body = spotify_endpoints.cached_body(spec, endpoint, user, args)
+	if body is not None:
+		if fields:
+			return JsonResponse(project(json.loads(body), fields))
+		return RawJsonResponse(body)
 
 	try:
 		client = auth.client(user)
 		username = auth.username
 
-		if endpoint == 'profile':
-			return JsonResponse(client.current_user())
-		elif endpoint == 'playing_track':
-			return JsonResponse(client.currently_playing(SPOTIFY_MARKET))
-		elif endpoint == 'recent_tracks':
-			return JsonResponse(client.current_user_recently_played(limit, before, after))
-		elif endpoint == 'top_tracks':
-			return JsonResponse(client.current_user_top_tracks(limit, offset, timespan))
-		elif endpoint == 'followed_artists':
-			return JsonResponse(client.current_user_followed_artists(limit, after))
-		elif endpoint == 'playlists':
-			return JsonResponse(client.current_user_playlists(limit, offset))
-		elif endpoint == 'saved_albums':
-			return JsonResponse(client.current_user_saved_albums(limit, offset))
-		elif endpoint == 'saved_tracks':
-			return JsonResponse(client.current_user_saved_tracks(limit, offset))
-
-		elif endpoint == 'search':
-			return JsonResponse(client.search(query, limit, offset, query_type, SPOTIFY_MARKET))
-		elif endpoint == 'user_playlists':
-			return JsonResponse(client.user_playlists(query_user, limit, offset))
-		elif endpoint == 'fetch_tracks':
-			return JsonResponse(client.tracks(tracks, SPOTIFY_MARKET))
-		elif endpoint == 'fetch_albums':
-			return JsonResponse(client.albums(albums))
-		elif endpoint == 'fetch_artists':
-			return JsonResponse(client.artists(artists))
-
-		elif endpoint == 'add_playlist_custom_image':
-			return JsonResponse(client.playlist_upload_cover_image(playlist, image_b64))
-		elif not username:
+		if spec.needs_username and not username:
 			return _err('Failed to fetch Spotify User ID')
-		elif endpoint == 'create_playlist':
-			return JsonResponse(client.user_playlist_create(username, name, description=description))
-		elif endpoint == 'follow_playlist':
-			return JsonResponse(client.user_playlist_follow_playlist(username, playlist))
-		elif endpoint == 'is_following_playlist':
-			return JsonResponse(client.user_playlist_is_following(username, playlist, users))
-		elif endpoint == 'add_playlist_tracks':
-			return JsonResponse(client.user_playlist_add_tracks(username, playlist, tracks, position))
-		elif endpoint == 'edit_playlist_details':
-			return JsonResponse(client.user_playlist_change_details(username, playlist, name, description=description))
+
+		chunks = spec.chunks(args)
+		if len(chunks) == 1:
+			result = spec.call(client, username, args)
+			body = client.last_body()
 		else:
-			return HttpResponseNotFound('Unknown endpoint')
+			result = spec.merge([spec.call(client, username, chunk) for chunk in chunks])
+			body = dumps(result)
 
-	except spotipy.SpotifyException as e:
+	except SpotifyException as e:
 		return _err(str(e))
+
+	spotify_endpoints.store_body(spec, key, body)
+	spotify_endpoints.invalidate(spec, user)
+
+	if fields:
+		return JsonResponse(project(result, fields))
+	return RawJsonResponse(body)
+
+
+spotify_wrapper.rate_limit_cost = spotify_endpoints.request_cost
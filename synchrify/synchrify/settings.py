@@ -52,14 +52,42 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+	'synchapi.middleware.MetricsMiddleware',
 	'django.middleware.security.SecurityMiddleware',
+	'synchapi.middleware.CompressionMiddleware',
 	'django.contrib.sessions.middleware.SessionMiddleware',
+	'synchapi.middleware.ProfilingMiddleware',
 	'corsheaders.middleware.CorsMiddleware',
 	'django.middleware.common.CommonMiddleware',
+	'synchapi.middleware.RateLimitMiddleware',
 	'django.contrib.messages.middleware.MessageMiddleware',
 	'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# gzip, or brotli when the `brotli` package is installed
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+
+# Requests allowed per window (seconds), keyed by URL name from synchapi/urls.py.
+# Counters live in CACHES, so point that at a shared backend when running
+# more than one worker.
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') == '1'
+RATE_LIMIT_TRUST_X_FORWARDED_FOR = False
+RATE_LIMITS = {
+	'register': (5, 600),
+	'login': (10, 60),
+	'friends-list-all': (30, 60),
+	'friends-overlap': (30, 60),
+	'friends-top-overlap': (30, 60),
+	'ratings-list-all': (30, 60),
+	'content-search': (120, 60),
+	'content-get-by-uri': (60, 60),
+	'blend-create': (5, 600),
+	'batch': (300, 60),  # charged what each sub-request costs; sub-requests also count against their own route
+	'spotify-wrapper': (60, 60),
+}
+
 ROOT_URLCONF = 'synchrify.urls'
 
 TEMPLATES = [
@@ -97,6 +125,78 @@ SPOTIFY_REDIRECT_URI = os.getenv('SPOTIFY_REDIRECT_URI')
 SPOTIFY_SCOPE = os.getenv('SPOTIFY_SCOPE')
 SPOTIFY_USERNAME = os.getenv('SPOTIFY_USERNAME')
 
+# Point these at `manage.py spotify_stub` to run without a live Spotify
+SPOTIFY_TOKEN_URL = os.getenv('SPOTIFY_TOKEN_URL', 'https://accounts.spotify.com/api/token')
+SPOTIFY_API_URL = os.getenv('SPOTIFY_API_URL', 'https://api.spotify.com/v1/')
+
+# Passwords (PBKDF2-SHA256; `manage.py bench_passwords` measures logins/s per core)
+
+PASSWORD_ITERATIONS = 200000  # rows hashed with a different count are rehashed on login
+LOGIN_HASH_BUDGET_MS = 100  # per-login hashing budget bench_passwords tunes against
+
+# Activity feed
+
+TIMELINE_LENGTH = 1000  # entries kept per user by `manage.py timelines --trim`
+TRENDING_MIN_RATING = 7  # ratings below this do not count towards trending
+
+# Rating write-behind buffer (opt-in; `manage.py flush_ratings` replays journals left by dead processes)
+
+RATING_BUFFER_ENABLED = os.getenv('RATING_BUFFER_ENABLED', '0') == '1'  # needs a shared CACHES backend; ignored with locmem
+RATING_BUFFER_INTERVAL = 1.0  # seconds between flushes; updates to one rating within it become one write
+RATING_BUFFER_MAX = 1000  # pending ratings that trigger an early flush
+RATING_BUFFER_DIR = os.getenv('RATING_BUFFER_DIR', '/tmp/synchrify-ratings')  # journals; must outlive the processes
+RATING_BUFFER_FSYNC = True  # fsync the journal before acknowledging each update
+
+# Friend graph snapshot (`manage.py friend_graph`); reads fall back to SQL until one exists
+
+GRAPH_DIR = os.getenv('GRAPH_DIR', '/tmp/synchrify-graph')
+GRAPH_RELOAD_INTERVAL = 5  # seconds between checks for a newer snapshot
+GRAPH_DELTA_INTERVAL = 1  # seconds between polls of the change feed for newer friendships
+GRAPH_DELTA_BATCH = 10000
+PRIVACY_CACHE_SIZE = 10000  # viewers (and users' settings) each worker keeps precomputed
+PRIVACY_RECHECK_INTERVAL = 1  # seconds a worker trusts a precomputed entry before revalidating it
+
+# Background jobs (in-process thread pool; state is kept in the cache)
+
+JOB_WORKERS = 2
+BLEND_FETCH_WORKERS = 8  # concurrent Spotify library fetches per blend
+BLEND_MAX_SIZE = 200
+
+# Metrics (`metrics` route, Prometheus text format)
+
+METRICS_ENABLED = True
+METRICS_DIR = os.getenv('METRICS_DIR')  # writable directory shared by the worker processes on one host (files of dead PIDs are dropped)
+METRICS_FLUSH_INTERVAL = 5  # seconds between per-process snapshot writes to METRICS_DIR
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # when set, scrapes must send "Authorization: Bearer <token>"
+
+# Request profiling (ProfilingMiddleware; fully removed from the stack unless enabled)
+
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '0') == '1'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_USERS = []  # user IDs whose requests are always profiled
+PROFILING_INTERVAL = 0.001  # seconds between stack samples
+PROFILING_DIR = os.getenv('PROFILING_DIR', '/tmp/synchrify-profiles')
+PROFILING_HEADER_MAX_AGE = 3600  # seconds a `manage.py profile_header` value stays valid
+
+# Batch API (`batch/`)
+
+BATCH_MAX_REQUESTS = 20
+BATCH_WORKERS = 4  # concurrent Spotify sub-requests per batch
+
+# Content metadata refresh (`manage.py refresh_content`)
+
+SPOTIFY_RATE_BUDGET = 10  # Spotify API requests per second we allow ourselves in total
+CONTENT_REFRESH_BUDGET_SHARE = 0.25  # share of SPOTIFY_RATE_BUDGET the refresh may use
+CONTENT_REFRESH_MAX_AGE = 7 * 24 * 3600
+CONTENT_REFRESH_BATCH = 200
+CONTENT_REFRESH_WORKERS = 4
+HISTORY_INGEST_BUDGET_SHARE = 0.25  # share of SPOTIFY_RATE_BUDGET listening-history ingestion may use
+HISTORY_INGEST_BATCH = 200
+HISTORY_INGEST_WORKERS = 4
+TOP_SNAPSHOT_BUDGET_SHARE = 0.1  # share of SPOTIFY_RATE_BUDGET top-items snapshots may use; 6 requests per user
+TOP_SNAPSHOT_BATCH = 100
+TOP_SNAPSHOT_WORKERS = 4
+
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
@@ -113,6 +213,17 @@ DATABASES = {
 	}
 }
 
+# Cache
+# Change versions live here, so production needs a backend shared by all
+# workers (e.g. memcached); the default local-memory cache is per process.
+
+CACHES = {
+	'default': {
+		'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+		'LOCATION': os.getenv('CACHE_LOCATION', ''),
+	}
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.0/topics/i18n/
 